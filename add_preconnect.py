@@ -1,21 +1,306 @@
 import os
+import sys
 import re
 import argparse
+from functools import partial, lru_cache
+from urllib.parse import urlsplit
+from bs4 import BeautifulSoup
+from parallel import add_jobs_argument
+from build_manifest import file_hash, run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from site_paths import resolve_url, is_site_url, strip_query
+from prefilter import without_noscript, tag_attributes
+import css_rules
 
-# The HTML snippet to insert
-TAGS_TO_INSERT = """<link rel="preconnect" href="https://fonts.googleapis.com">
-<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>"""
+# Connections are expensive to hold open; only the highest ranked origins of
+# a page get a preconnect, the rest a (cheap) dns-prefetch
+MAX_PRECONNECT = 3
+MAX_DNS_PREFETCH = 8
 
-# Specific parts to check for existence to avoid duplication
-# We check for the hrefs as they are quite unique to these tags
-CHECK_STRINGS = [
-    'href="https://fonts.googleapis.com"',
-    'href="https://fonts.gstatic.com"'
-]
+# Origins whose responses always send the browser on to another origin,
+# which can't be discovered without fetching them: (origin, crossorigin)
+FOLLOW_ON_ORIGINS = {
+    "https://fonts.googleapis.com": ("https://fonts.gstatic.com", True),
+}
 
-def modify_html_file(file_path):
+# Font files are always fetched in CORS mode, so their connection needs crossorigin
+FONT_EXTENSIONS = ('.woff2', '.woff', '.ttf', '.otf', '.eot')
+
+CSS_URL_PATTERN = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)|@import\s+(['"])([^'"]+)\3''', re.IGNORECASE)
+FONT_FACE_PATTERN = re.compile(r'@font-face\s*\{[^}]*\}', re.IGNORECASE)
+FONT_SRC_PATTERN = re.compile(r'\bsrc\s*:', re.IGNORECASE)
+FONT_FORMAT_PATTERN = re.compile(r'''\s*format\(\s*['"]?([\w-]+)''', re.IGNORECASE)
+
+# @font-face sources current browsers skip on their way to one they can use
+UNSUPPORTED_FONT_FORMATS = ('embedded-opentype', 'svg')
+UNSUPPORTED_FONT_EXTENSIONS = ('.eot', '.svg')
+
+# Attributes holding URLs the browser fetches while loading the page
+# (links in <a href> are only fetched when followed)
+RESOURCE_ATTRIBUTES = {
+    'script': ('src',),
+    'img': ('src', 'srcset'),
+    'source': ('src', 'srcset'),
+    'iframe': ('src',),
+    'video': ('src', 'poster'),
+    'audio': ('src',),
+    'embed': ('src',),
+}
+
+# <link> relations that fetch their href
+FETCHING_LINK_RELS = {'stylesheet', 'preload', 'modulepreload', 'icon', 'apple-touch-icon'}
+
+# Raw tags that fetch a URL and url()s naming another origin, for the
+# trigger (see _has_unhinted_origins())
+FETCHING_TAG_PATTERN = re.compile(rb'<(?:link|' + '|'.join(RESOURCE_ATTRIBUTES).encode('ascii') + rb')\b[^>]*>',
+                                  re.IGNORECASE)
+ABSOLUTE_CSS_URL_PATTERN = re.compile(rb'''url\(\s*['"]?((?:https?:)?//[^'")\s]+)''', re.IGNORECASE)
+
+# --- START OF ORIGIN DISCOVERY ---
+def url_origin(url):
+    """Returns the scheme://host origin of an absolute or protocol-relative URL, or None."""
+    url = url.strip().replace('\\/', '/')
+    if url.startswith('//'):
+        url = 'https:' + url
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc.lower()}"
+
+def _needs_cors(url, tag=None):
+    """True if the browser fetches url in CORS mode (fonts, module scripts, crossorigin tags)."""
+    if strip_query(url).lower().endswith(FONT_EXTENSIONS):
+        return True
+    return tag is not None and (tag.has_attr('crossorigin') or tag.get('type') == 'module'
+                                or (tag.name == 'link' and tag.get('as') == 'font'))
+
+def _font_face_source(css_text, start, end):
+    """
+    Returns the position of the url() a browser fetches for the @font-face
+    block at css_text[start:end]: the first usable source of its last src
+    descriptor, or None if it has none.
+    """
+    declarations = list(FONT_SRC_PATTERN.finditer(css_text, start, end))
+    if not declarations:
+        return None
+    sources = list(CSS_URL_PATTERN.finditer(css_text, declarations[-1].end(), end))
+    for source in sources:
+        url = source.group(2) or source.group(4) or ''
+        font_format = FONT_FORMAT_PATTERN.match(css_text, source.end())
+        if (not strip_query(url).lower().endswith(UNSUPPORTED_FONT_EXTENSIONS)
+                and not (font_format and font_format.group(1).lower() in UNSUPPORTED_FONT_FORMATS)):
+            return source.start()
+    return sources[0].start() if sources else None
+
+def font_face_url(font_face_body):
+    """Returns the URL a browser fetches for the body of an @font-face rule, or None."""
+    position = _font_face_source(font_face_body, 0, len(font_face_body))
+    if position is None:
+        return None
+    return (CSS_URL_PATTERN.match(font_face_body, position).group(2) or '').strip() or None
+
+def css_urls(css_text):
+    """
+    Returns the (url, is_font, is_import) references of CSS text; every
+    url() inside an @font-face is a font, whatever its extension (e.g. .svg#name).
+    Of each @font-face block only the one source a browser fetches counts,
+    not its fallbacks.
+    """
+    font_spans = [match.span() for match in FONT_FACE_PATTERN.finditer(css_text)]
+    font_sources = {_font_face_source(css_text, start, end) for start, end in font_spans}
+    urls = []
+    for match in CSS_URL_PATTERN.finditer(css_text):
+        url = (match.group(2) or match.group(4)).strip()
+        is_font = any(start <= match.start() < end for start, end in font_spans)
+        if is_font and match.start() not in font_sources:
+            continue
+        if not url.startswith('data:'):
+            urls.append((url, is_font, bool(match.group(4))))
+    return urls
+
+@lru_cache(maxsize=None)
+def _stylesheet_urls(path, digest):
+    """(url, is_font) references of a local stylesheet, including those of the stylesheets it @imports."""
+    css_text = css_rules.strip_comments(css_rules.read_stylesheet(path))
+    urls = []
+    for url, is_font, is_import in css_urls(css_text):
+        urls.append((url, is_font))
+        if is_import:
+            imported = resolve_url(url, path, os.path.dirname(path))
+            if imported and os.path.isfile(imported) and imported != path:
+                urls.extend(_stylesheet_urls(imported, file_hash(imported)))
+    return tuple(urls)
+
+def page_requests(soup, file_path=None, site_root=None):
+    """
+    Returns the (url, crossorigin, in_head, from_css) resources a page
+    requests, in document order. The url() and @import references of its
+    local stylesheets and of inline styles count at the position of their
+    <link>/<style> tag, with from_css set. Content inside <noscript> and
+    scripts held back until interaction (data-src) are left out.
+    """
+    requests = []
+    for tag in soup.find_all(True):
+        if tag.find_parent('noscript'):
+            continue
+        in_head = soup.head is not None and tag.find_parent('head') is not None
+        urls = []
+        css_references = []
+        if tag.name == 'link':
+            rels = {rel.lower() for rel in tag.get('rel') or []}
+            if rels & FETCHING_LINK_RELS and tag.get('href'):
+                urls.append(tag['href'])
+                local_path = resolve_url(tag['href'], file_path, site_root) if file_path and site_root else None
+                if 'stylesheet' in rels or tag.get('as') == 'style':
+                    if local_path and os.path.isfile(local_path):
+                        css_references.extend(_stylesheet_urls(local_path, file_hash(local_path)))
+        elif tag.name == 'style' and tag.string:
+            css_references.extend(reference[:2] for reference in css_urls(tag.string))
+        else:
+            for attribute in RESOURCE_ATTRIBUTES.get(tag.name, ()):
+                value = tag.get(attribute)
+                if not value:
+                    continue
+                if attribute == 'srcset':
+                    urls.extend(candidate.split()[0] for candidate in value.split(',') if candidate.strip())
+                else:
+                    urls.append(value)
+        if tag.get('style'):
+            css_references.extend(reference[:2] for reference in css_urls(tag['style']))
+        requests.extend((url, _needs_cors(url, tag), in_head, False) for url in urls)
+        requests.extend((url, is_font or _needs_cors(url), in_head, True) for url, is_font in css_references)
+    return requests
+
+def rank_origins(requests):
+    """
+    Returns [(origin, crossorigin)] of the third-party origins requested,
+    best first: origins requested by <head> tags themselves (render-critical)
+    before those only referenced from its stylesheets, then the others;
+    within each, by number of requests, then by first request.
+    """
+    stats = {}
+    for position, (url, crossorigin, in_head, from_css) in enumerate(requests):
+        if is_site_url(url):
+            continue
+        origin = url_origin(url)
+        if origin is None:
+            continue
+        keys = [(origin, crossorigin)]
+        if origin in FOLLOW_ON_ORIGINS:
+            keys.append(FOLLOW_ON_ORIGINS[origin])
+        for key in keys:
+            entry = stats.setdefault(key, {'first': position, 'count': 0, 'head': False, 'head_tag': False})
+            entry['count'] += 1
+            entry['head'] = entry['head'] or in_head
+            entry['head_tag'] = entry['head_tag'] or (in_head and not from_css)
+    return sorted(stats, key=lambda key: (not stats[key]['head_tag'], not stats[key]['head'],
+                                          -stats[key]['count'], stats[key]['first']))
+
+def existing_hints(soup):
+    """Returns {'preconnect': {(origin, crossorigin)}, 'dns-prefetch': {origin}} already in the page."""
+    hints = {'preconnect': set(), 'dns-prefetch': set()}
+    for link in soup.find_all('link', href=True):
+        rels = {rel.lower() for rel in link.get('rel') or []}
+        origin = url_origin(link['href'])
+        if origin is None:
+            continue
+        if 'preconnect' in rels:
+            hints['preconnect'].add((origin, link.has_attr('crossorigin')))
+        if 'dns-prefetch' in rels:
+            hints['dns-prefetch'].add(origin)
+    return hints
+
+def _is_charset_declaration(tag):
+    return tag.name == 'meta' and (tag.has_attr('charset') or (tag.get('http-equiv') or '').lower() == 'content-type')
+
+def hint_position(head):
     """
-    Modifies a single HTML file to add the preconnect links after the <head> tag.
+    Returns the index in head.contents to insert hints at: right after the
+    character encoding declaration, which must stay in the first 1024 bytes,
+    or at the top of <head> without one.
+    """
+    for position, child in enumerate(head.contents):
+        if getattr(child, 'name', None) and _is_charset_declaration(child):
+            return position + 1
+    return 0
+
+def _has_unhinted_origins(data, file_path, site_root):
+    """
+    Trigger (see prefilter.py): True if the raw page requests a third-party
+    origin, directly or through its local stylesheets, that has no
+    preconnect or dns-prefetch hint yet and there is room for another hint.
+    """
+    data = without_noscript(data)
+    origins, hinted = set(), set()
+    for match in FETCHING_TAG_PATTERN.finditer(data):
+        attributes = tag_attributes(match.group(0))
+        rels = set(attributes.get('rel', '').lower().split())
+        if rels & {'preconnect', 'dns-prefetch'}:
+            hinted.add(url_origin(attributes.get('href', '')))
+            continue
+        urls = [attributes[name] for name in ('src', 'poster') if attributes.get(name)]
+        urls += [candidate.split()[0] for candidate in attributes.get('srcset', '').split(',') if candidate.strip()]
+        if rels & FETCHING_LINK_RELS and attributes.get('href'):
+            urls.append(attributes['href'])
+            local_path = resolve_url(attributes['href'], file_path, site_root)
+            if ('stylesheet' in rels or attributes.get('as') == 'style') and local_path and os.path.isfile(local_path):
+                urls.extend(url for url, _ in _stylesheet_urls(local_path, file_hash(local_path)))
+        origins.update(url_origin(url) for url in urls if not is_site_url(url))
+    absolute_urls = [url.decode('utf-8', 'replace') for url in ABSOLUTE_CSS_URL_PATTERN.findall(data)]
+    origins.update(url_origin(url) for url in absolute_urls if not is_site_url(url))
+    origins |= {FOLLOW_ON_ORIGINS[origin][0] for origin in origins if origin in FOLLOW_ON_ORIGINS}
+    origins.discard(None)
+    return bool(origins - hinted) and len(hinted) < MAX_PRECONNECT + MAX_DNS_PREFETCH
+
+# Pages whose third-party origins all have a hint need no more (see prefilter.py)
+PRECONNECT_TRIGGER = _has_unhinted_origins
+# --- END OF ORIGIN DISCOVERY ---
+
+
+def insert_resource_hints(soup, file_path=None, site_root=None,
+                          max_preconnect=MAX_PRECONNECT, max_dns_prefetch=MAX_DNS_PREFETCH):
+    """
+    Inserts preconnect links for the top ranked third-party origins of an
+    already parsed document and dns-prefetch links for the rest, at the top
+    of <head> after <meta charset>, skipping origins that already have the hint.
+    With file_path and site_root, the page's local stylesheets are scanned too.
+    Returns True if any link was inserted.
+    """
+    if soup.head is None:
+        return False
+
+    ranked = rank_origins(page_requests(soup, file_path, site_root))
+    hints = existing_hints(soup)
+    preconnected = {origin for origin, _ in hints['preconnect']}
+
+    new_links = []
+    for rank, (origin, crossorigin) in enumerate(ranked):
+        if rank < max_preconnect:
+            if (origin, crossorigin) in hints['preconnect']:
+                continue
+            link = soup.new_tag('link', rel='preconnect', href=origin)
+            if crossorigin:
+                link['crossorigin'] = ''
+            preconnected.add(origin)
+        elif rank < max_preconnect + max_dns_prefetch:
+            if origin in preconnected or origin in hints['dns-prefetch']:
+                continue
+            link = soup.new_tag('link', rel='dns-prefetch', href=origin)
+            hints['dns-prefetch'].add(origin)
+        else:
+            break
+        new_links.append(link)
+        print(f"  Added {'preconnect' if rank < max_preconnect else 'dns-prefetch'} {origin}"
+              f"{' (crossorigin)' if link.has_attr('crossorigin') else ''}")
+
+    start = hint_position(soup.head)
+    for position, link in enumerate(new_links):
+        soup.head.insert(start + position, link)
+    return bool(new_links)
+
+def modify_html_file(file_path, site_root=None):
+    """
+    Modifies a single HTML file to add the resource hints after the <head> tag.
+    Returns True if it was modified, or None on errors.
     """
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
@@ -27,65 +312,43 @@ def modify_html_file(file_path):
         print(f"Error decoding file {file_path} as UTF-8: {e}. Skipping.")
         return
 
-
-    # 1. Check if the tags (or significant parts of them) already exist
-    already_exists = all(check_str in content for check_str in CHECK_STRINGS)
-    if already_exists:
-        print(f"Skipped (tags likely already exist): {file_path}")
-        return
-
-    # 2. Find the opening <head> tag (case-insensitive, handles attributes)
-    # Regex: (<head\b[^>]*>)
-    # - <head\b : Matches "<head" followed by a word boundary (to not match <header>)
-    # - [^>]*  : Matches any character except '>' zero or more times (for attributes)
-    # - >      : Matches the closing '>'
-    # - (...)  : Capturing group for the entire matched <head ...> tag
-    head_regex = re.compile(r'(<head\b[^>]*>)', re.IGNORECASE)
-    match = head_regex.search(content)
-
-    if not match:
+    soup = BeautifulSoup(content, 'html.parser')
+    if soup.head is None:
         print(f"Skipped (no <head> tag found): {file_path}")
-        return
+        return False
+    if not insert_resource_hints(soup, file_path, site_root):
+        print(f"Skipped (hints already exist): {file_path}")
+        return False
+
+    try:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(str(soup))
+        print(f"Modified: {file_path}")
+    except IOError as e:
+        print(f"Error writing to file {file_path}: {e}")
+        return None
+    return True
 
-    # The full opening <head ...> tag
-    original_head_tag = match.group(1)
-    
-    # Construct the new content to insert right after the original <head> tag
-    # We add a newline after the original tag, then our tags, then another newline
-    # for better readability in the source HTML.
-    insertion_string = f"\n{TAGS_TO_INSERT}\n"
-    
-    # Replace the first occurrence of the original_head_tag with itself + new tags
-    # Using a lambda function with re.sub ensures we only modify the first match
-    # and correctly insert after the captured group.
-    modified_content, num_replacements = head_regex.subn(
-        lambda m: m.group(1) + insertion_string,
-        content,
-        count=1 # Replace only the first occurrence
-    )
 
-    if num_replacements > 0:
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(modified_content)
-            print(f"Modified: {file_path}")
-        except IOError as e:
-            print(f"Error writing to file {file_path}: {e}")
-    else:
-        # This case should technically be caught by "if not match" earlier,
-        # but it's a good safeguard.
-        print(f"Skipped (head tag found but no replacement made, unexpected): {file_path}")
+def process_file(file_path, site_root=None):
+    """Processes one file with the same progress output as a serial run."""
+    print(f"Processing: {file_path}")
+    modified = modify_html_file(file_path, site_root)
+    print("-" * 20)
+    return modified
 
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Adds Google Fonts preconnect links to HTML files in a folder."
+        description="Adds preconnect and dns-prefetch links for the third-party origins each HTML file uses."
     )
     parser.add_argument(
         "folder_path",
         type=str,
         help="The path to the folder containing HTML files."
     )
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
     args = parser.parse_args()
 
     folder_path = args.folder_path
@@ -96,15 +359,17 @@ def main():
 
     print(f"Scanning folder: {folder_path}\n")
 
+    file_paths = []
     for root, _, files in os.walk(folder_path):
         for filename in files:
             if filename.lower().endswith((".html", ".htm")):
-                file_path = os.path.join(root, filename)
-                print(f"Processing: {file_path}")
-                modify_html_file(file_path)
-                print("-" * 20)
+                file_paths.append(os.path.join(root, filename))
+
+    run_incremental(partial(process_file, site_root=folder_path), sorted(file_paths), args.jobs,
+                    manifest_from_args(args), 'add_preconnect', tool_version(sys.modules[__name__], css_rules),
+                    config={'max_preconnect': MAX_PRECONNECT, 'max_dns_prefetch': MAX_DNS_PREFETCH})
 
     print("\nScript finished.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import argparse
+from functools import partial
+
+from parallel import run_in_pool, add_jobs_argument
+from build_manifest import file_hash
+from fingerprint_assets import REFERENCE_PATTERN, resolve_reference
+from site_paths import site_relative
+
+# Default graph location (kept outside the publish directory so it is never deployed)
+DEFAULT_GRAPH_PATH = ".asset-graph.json"
+
+GRAPH_FORMAT_VERSION = 1
+
+# File kinds by extension; html, css and js files are scanned for references
+KIND_EXTENSIONS = {
+    'html': ('.html', '.htm'),
+    'css': ('.css',),
+    'js': ('.js',),
+    'image': ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg', '.ico'),
+    'font': ('.woff2', '.woff', '.ttf', '.otf', '.eot'),
+}
+SCANNED_KINDS = ('html', 'css', 'js')
+
+# Kinds that count as orphaned when no page reaches them
+ASSET_KINDS = ('css', 'js', 'image', 'font')
+
+def file_kind(path):
+    """Returns the kind of a file from its extension ('html', 'css', ..., or 'other')."""
+    lower = path.lower()
+    for kind, extensions in KIND_EXTENSIONS.items():
+        if lower.endswith(extensions):
+            return kind
+    return 'other'
+
+def scan_file(file_path, site_root):
+    """
+    Returns (local, external) references of an HTML, CSS or JS file: the
+    site-relative paths of the local files it references (existing or
+    not; for JS, only existing ones, as most path-like strings in scripts
+    are fragments rather than fetches) and the external URLs, both sorted.
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    is_script = file_kind(file_path) == 'js'
+    local, external = set(), set()
+    for match in REFERENCE_PATTERN.finditer(text):
+        url = match.group('url').replace('\\/', '/')
+        local_path = resolve_reference(url, file_path, site_root)
+        if local_path and is_script and not os.path.isfile(local_path):
+            continue
+        if local_path:
+            local.add(site_relative(local_path, site_root))
+        elif url.startswith(('http://', 'https://', '//')):
+            external.add(url)
+    return sorted(local), sorted(external)
+
+def _scan_item(item, site_root):
+    relative, digest = item
+    return relative, digest, scan_file(os.path.join(site_root, *relative.split('/')), site_root)
+
+
+class AssetGraph:
+    """
+    Persistent graph of the references between the files of the publish
+    directory: page -> stylesheet/script/image/font, stylesheet -> image/
+    font/stylesheet (url() and @import), script -> image.
+
+    Stored per file: {kind, hash, refs, external}; only html, css and js
+    files are hashed and scanned, and update() rescans just the ones whose
+    content changed. Reverse lookups are derived on load.
+    """
+
+    def __init__(self, graph_path=DEFAULT_GRAPH_PATH):
+        self.graph_path = graph_path
+        self.site_root = None
+        self.files = {}
+        if os.path.exists(graph_path):
+            try:
+                with open(graph_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == GRAPH_FORMAT_VERSION:
+                    self.site_root = data.get('site_root')
+                    self.files = data.get('files', {})
+                else:
+                    print(f"Warning: Ignoring asset graph '{graph_path}' with unknown format version.", file=sys.stderr)
+            except (IOError, ValueError) as e:
+                print(f"Warning: Could not read asset graph '{graph_path}', starting fresh. Error: {e}", file=sys.stderr)
+        self._index()
+
+    def _index(self):
+        self.referrers_of = {}
+        for source, entry in self.files.items():
+            for target in entry.get('refs', ()):
+                self.referrers_of.setdefault(target, set()).add(source)
+
+    def update(self, site_root, jobs=None):
+        """
+        Brings the graph up to date with site_root: adds and drops files,
+        and rescans the html, css and js files whose content changed.
+        Returns the number of files rescanned.
+        """
+        if self.site_root != os.path.abspath(site_root):
+            self.files = {}
+        self.site_root = os.path.abspath(site_root)
+
+        current, stale = {}, []
+        for root, _, file_names in os.walk(site_root):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                relative = site_relative(path, site_root)
+                kind = file_kind(relative)
+                entry = {'kind': kind}
+                if kind in SCANNED_KINDS:
+                    digest = file_hash(path)
+                    previous = self.files.get(relative)
+                    if previous and previous.get('hash') == digest:
+                        entry = previous
+                    else:
+                        stale.append((relative, digest))
+                current[relative] = entry
+
+        for result in run_in_pool(partial(_scan_item, site_root=site_root), stale, jobs):
+            if result:
+                relative, digest, (local, external) = result
+                current[relative] = {'kind': current[relative]['kind'], 'hash': digest,
+                                     'refs': local, 'external': external}
+        self.files = current
+        self._index()
+        return len(stale)
+
+    def save(self):
+        """Writes the graph atomically."""
+        tmp_path = self.graph_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': GRAPH_FORMAT_VERSION, 'site_root': self.site_root, 'files': self.files},
+                      f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.graph_path)
+
+    # --- START OF QUERIES ---
+    def references(self, path):
+        """Site-relative paths referenced directly by path."""
+        return sorted(self.files.get(path, {}).get('refs', ()))
+
+    def referrers(self, path):
+        """Files referencing path directly."""
+        return sorted(self.referrers_of.get(path, ()))
+
+    def pages_using(self, path):
+        """
+        The pages that use path directly or through their stylesheets and
+        scripts, i.e. the pages to rebuild when it changes (a page itself
+        included).
+        """
+        pages = {path} if self.files.get(path, {}).get('kind') == 'html' else set()
+        seen, stack = {path}, [path]
+        while stack:
+            for source in self.referrers_of.get(stack.pop(), ()):
+                if source in seen:
+                    continue
+                seen.add(source)
+                if self.files[source]['kind'] == 'html':
+                    pages.add(source)
+                stack.append(source)
+        return sorted(pages)
+
+    def reachable(self):
+        """Every file reachable from a page, pages included."""
+        seen = {path for path, entry in self.files.items() if entry['kind'] == 'html'}
+        stack = list(seen)
+        while stack:
+            for target in self.files.get(stack.pop(), {}).get('refs', ()):
+                if target not in seen and target in self.files:
+                    seen.add(target)
+                    stack.append(target)
+        return seen
+
+    def orphans(self):
+        """Stylesheets, scripts, images and fonts no page reaches."""
+        reachable = self.reachable()
+        return sorted(path for path, entry in self.files.items()
+                      if entry['kind'] in ASSET_KINDS and path not in reachable)
+
+    def broken(self):
+        """(source, target) for every reference to a local file that doesn't exist."""
+        return sorted((source, target) for source, entry in self.files.items()
+                      for target in entry.get('refs', ()) if target not in self.files)
+    # --- END OF QUERIES ---
+
+
+def load_graph(site_root, graph_path=DEFAULT_GRAPH_PATH, jobs=None):
+    """Returns the graph of site_root, updated and saved. The entry point for other tools."""
+    graph = AssetGraph(graph_path)
+    rescanned = graph.update(site_root, jobs)
+    print(f"Asset graph: {len(graph.files)} file(s), {rescanned} rescanned.")
+    graph.save()
+    return graph
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Update the graph of references between the site's pages and assets, and query it."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--graph", default=DEFAULT_GRAPH_PATH,
+                        help=f"Where the graph is kept between runs (default: {DEFAULT_GRAPH_PATH}).")
+    query = parser.add_mutually_exclusive_group()
+    query.add_argument("--orphans", action="store_true", help="List assets no page references, directly or indirectly.")
+    query.add_argument("--broken", action="store_true", help="List references to local files that don't exist.")
+    query.add_argument("--references", metavar="PATH", help="List the files PATH references.")
+    query.add_argument("--referrers", metavar="PATH", help="List the files referencing PATH.")
+    query.add_argument("--pages-for", metavar="PATH", nargs='+',
+                       help="List the pages to rebuild when any of these files change.")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    graph = load_graph(args.site_root, args.graph, args.jobs)
+
+    def relative(path):
+        # Accept paths given from the current directory as well as site-relative ones
+        if os.path.exists(path) and os.path.abspath(path).startswith(graph.site_root + os.sep):
+            return site_relative(os.path.abspath(path), graph.site_root)
+        return path.replace(os.sep, '/').lstrip('/')
+
+    if args.orphans:
+        lines = graph.orphans()
+    elif args.broken:
+        lines = [f"{source} -> {target}" for source, target in graph.broken()]
+    elif args.references:
+        lines = graph.references(relative(args.references))
+    elif args.referrers:
+        lines = graph.referrers(relative(args.referrers))
+    elif args.pages_for:
+        lines = sorted({page for path in args.pages_for for page in graph.pages_using(relative(path))})
+    else:
+        return
+    for line in lines:
+        print(line)
+    print(f"{len(lines)} result(s).", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import os
+import csv
+import posixpath
+import sys
+import argparse
+import tempfile
+from functools import partial
+from bs4 import BeautifulSoup
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow is only needed to encode, see main()
+    Image = features = None
+
+import lazy
+from parallel import run_in_pool, add_jobs_argument
+from build_manifest import (run_cached, run_incremental, tool_version, file_hash, config_hash,
+                            add_manifest_arguments, manifest_from_args)
+from site_paths import resolve_url, strip_query, site_relative
+from prefilter import image_tags
+
+DEFAULT_QUALITY = 60
+
+RASTER_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Originals an existing .webp may have been converted from, best first
+ORIGINAL_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# --- START OF PATH HELPERS ---
+def sibling(path, extension):
+    """Returns path with its extension replaced (photo.jpg -> photo.avif)."""
+    return os.path.splitext(path)[0] + extension
+
+def encode_source_for(local_path):
+    """
+    Returns the best file to encode an AVIF of local_path from: the original
+    raster a .webp was converted from if it is still around, else the file itself.
+    """
+    if local_path.lower().endswith('.webp'):
+        for extension in ORIGINAL_EXTENSIONS:
+            if os.path.isfile(sibling(local_path, extension)):
+                return sibling(local_path, extension)
+    return local_path
+
+def fallback_path_for(local_path):
+    """The file a browser without AVIF gets: the .webp sibling if any, else the file itself."""
+    webp_path = sibling(local_path, '.webp')
+    return webp_path if os.path.isfile(webp_path) else local_path
+
+def usable_avif(local_path):
+    """Returns the AVIF path for local_path if it exists and beats its fallback, else None."""
+    avif_path = sibling(local_path, '.avif')
+    if os.path.isfile(avif_path) and os.path.getsize(avif_path) < os.path.getsize(fallback_path_for(local_path)):
+        return avif_path
+    return None
+
+def swap_extension(url, extension):
+    """Returns url (query string dropped) pointing to the sibling with another extension."""
+    return os.path.splitext(strip_query(url))[0] + extension
+# --- END OF PATH HELPERS ---
+
+
+# --- START OF ENCODING ---
+def encode_avif(item, quality=DEFAULT_QUALITY):
+    """
+    Encodes one (source_path, avif_path, fallback_path) item, keeping the
+    AVIF only if it is smaller than the fallback.
+    Returns (fallback_bytes, avif_bytes, kept).
+    """
+    source_path, avif_path, fallback_path = item
+    with Image.open(source_path) as image:
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(avif_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'AVIF', quality=quality)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    avif_bytes = os.path.getsize(tmp_path)
+    fallback_bytes = os.path.getsize(fallback_path)
+    if avif_bytes >= fallback_bytes:
+        os.remove(tmp_path)
+        if os.path.exists(avif_path):
+            os.remove(avif_path)
+        return fallback_bytes, avif_bytes, False
+    os.replace(tmp_path, avif_path)
+    return fallback_bytes, avif_bytes, True
+
+def collect_images(file_path, site_root):
+    """Returns the local raster images used by <img> src/srcset in one HTML file."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    images = set()
+    for img in soup.find_all('img'):
+        for url, _ in img_candidates(img):
+            local_path = resolve_url(url, file_path, site_root)
+            if local_path and local_path.lower().endswith(RASTER_EXTENSIONS) and os.path.isfile(local_path):
+                images.add(local_path)
+    return sorted(images)
+
+def encode_images(site_root, html_files, quality=DEFAULT_QUALITY, jobs=None, manifest=None):
+    """
+    Encodes AVIF siblings for every image used by html_files in a process
+    pool. Outputs are cached by source hash; so are rejections (AVIF not
+    smaller than the fallback), so those images are not re-encoded either.
+    Returns report rows of (image_path, fallback_path, fallback_bytes, avif_bytes, kept, cached).
+    """
+    per_file_images = run_in_pool(partial(collect_images, site_root=site_root), html_files, jobs)
+    images = sorted({path for paths in per_file_images if paths for path in paths})
+
+    version = tool_version(sys.modules[__name__])
+    config = {'quality': quality}
+    rows, items, seen_targets = [], [], set()
+    for local_path in images:
+        item = (encode_source_for(local_path), sibling(local_path, '.avif'), fallback_path_for(local_path))
+        # photo.jpg and its photo.webp share one photo.avif
+        if item[1] in seen_targets:
+            continue
+        seen_targets.add(item[1])
+        rejected_bytes = (manifest.rejected_bytes('avif_encoder', item[1], file_hash(item[0]), version, config_hash(config))
+                          if manifest else None)
+        if rejected_bytes is not None:
+            rows.append((item[0], item[2], os.path.getsize(item[2]), rejected_bytes, False, True))
+            continue
+        items.append(item)
+
+    results, cached_items = run_cached(partial(encode_avif, quality=quality), items, jobs, manifest,
+                                       'avif_encoder', version, config=config)
+    cached = set(cached_items)
+    stale_items = [item for item in items if item not in cached]
+    for item in cached_items:
+        rows.append((item[0], item[2], os.path.getsize(item[2]), os.path.getsize(item[1]), True, True))
+    for item, result in zip(stale_items, results):
+        if result is None:
+            continue
+        fallback_bytes, avif_bytes, kept = result
+        rows.append((item[0], item[2], fallback_bytes, avif_bytes, kept, False))
+        if not kept and manifest is not None:
+            manifest.record_rejection('avif_encoder', item[1], file_hash(item[0]), version, config_hash(config), avif_bytes)
+    if manifest is not None:
+        manifest.save()
+    return sorted(rows)
+# --- END OF ENCODING ---
+
+
+# --- START OF HTML PROCESSING ---
+def img_candidates(img):
+    """
+    Returns [(url, descriptor)] for an <img> (a tag, or the attributes of a
+    raw one): its srcset entries, or its src alone.
+    """
+    srcset = img.get('srcset')
+    if srcset:
+        candidates = []
+        for part in srcset.split(','):
+            pieces = part.strip().split(None, 1)
+            if pieces:
+                candidates.append((pieces[0], pieces[1] if len(pieces) > 1 else ''))
+        return candidates
+    src = img.get('src')
+    return [(src, '')] if src else []
+
+def _sibling_srcset(img, file_path, site_root, extension, usable):
+    """
+    Builds a srcset pointing every candidate of img to its sibling with
+    extension, or returns None unless usable(local_path) holds for all of them.
+    """
+    parts = []
+    for url, descriptor in img_candidates(img):
+        local_path = resolve_url(url, file_path, site_root)
+        if not local_path or not local_path.lower().endswith(RASTER_EXTENSIONS) or not usable(local_path):
+            return None
+        parts.append(f"{swap_extension(url, extension)} {descriptor}".strip())
+    return ', '.join(parts) if parts else None
+
+def _has_unused_avif(data, file_path, site_root):
+    """
+    True if an <img> of the raw page has usable AVIF siblings for all of its
+    candidates (as apply_picture_fallbacks() requires) and the page doesn't
+    reference every one of them yet.
+    """
+    for name, _, attributes in image_tags(data):
+        avif_srcset = _sibling_srcset(attributes, file_path, site_root, '.avif', usable_avif) if name == 'img' else None
+        if avif_srcset and any(data.find(posixpath.basename(part.split()[0]).encode('utf-8')) == -1
+                               for part in avif_srcset.split(', ')):
+            return True
+    return False
+
+# Pages whose images have no AVIF sibling to add, or reference it already,
+# have nothing to wrap in a <picture> (see prefilter.py)
+AVIF_TRIGGER = _has_unused_avif
+
+def apply_picture_fallbacks(soup, file_path, site_root):
+    """
+    Wraps every <img> that has usable AVIF siblings in a <picture> with
+    AVIF -> WebP -> original sources (or adds the AVIF source to an existing
+    <picture>). Returns True if changed.
+    """
+    changed = False
+    for img in soup.find_all('img'):
+        picture = img.parent if img.parent is not None and img.parent.name == 'picture' else None
+        if picture is not None and picture.find('source', attrs={'type': 'image/avif'}):
+            continue
+
+        avif_srcset = _sibling_srcset(img, file_path, site_root, '.avif', usable_avif)
+        if not avif_srcset:
+            continue
+
+        sources = [('image/avif', avif_srcset)]
+        src = img.get('src') or ''
+        has_webp_source = picture is not None and picture.find('source', attrs={'type': 'image/webp'})
+        if not strip_query(src).lower().endswith('.webp') and not has_webp_source:
+            webp_srcset = _sibling_srcset(img, file_path, site_root, '.webp',
+                                          lambda path: os.path.isfile(sibling(path, '.webp')))
+            if webp_srcset:
+                sources.append(('image/webp', webp_srcset))
+
+        if picture is None:
+            picture = soup.new_tag('picture')
+            img.wrap(picture)
+        for position, (mime_type, srcset) in enumerate(sources):
+            source = soup.new_tag('source', attrs={'type': mime_type, 'srcset': srcset})
+            if img.get('sizes'):
+                source['sizes'] = img['sizes']
+            picture.insert(position, source)
+        changed = True
+    return changed
+
+def process_html_file(file_path, site_root):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        if apply_picture_fallbacks(soup, file_path, site_root):
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(str(soup))
+            print(f"Modified: {file_path}")
+            return True
+        return False
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+# --- END OF HTML PROCESSING ---
+
+
+def print_report(rows, site_root, report_path=None):
+    """Prints the AVIF vs fallback size comparison and optionally writes it as CSV."""
+    total_fallback = total_avif = kept_count = 0
+    for source_path, fallback_path, fallback_bytes, avif_bytes, kept, cached in rows:
+        print(f"  {site_relative(source_path, site_root)}: {os.path.splitext(fallback_path)[1][1:]} {fallback_bytes / 1024:.1f} KB, "
+              f"avif {avif_bytes / 1024:.1f} KB -> {'kept' if kept else 'dropped (not smaller)'}"
+              f"{' [cached]' if cached else ''}")
+        if kept:
+            kept_count += 1
+            total_fallback += fallback_bytes
+            total_avif += avif_bytes
+    print(f"\nKept {kept_count}/{len(rows)} AVIF file(s), saving {(total_fallback - total_avif) / 1024:.1f} KB "
+          f"over their WebP/original fallbacks.")
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['source', 'fallback', 'fallback_bytes', 'avif_bytes', 'kept'])
+            for source_path, fallback_path, fallback_bytes, avif_bytes, kept, _ in rows:
+                writer.writerow([site_relative(source_path, site_root), site_relative(fallback_path, site_root),
+                                 fallback_bytes, avif_bytes, 'yes' if kept else 'no'])
+        print(f"Wrote size report to {report_path}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Encode AVIF versions of the images used by <img> tags and wrap them in <picture> "
+                    "with AVIF -> WebP -> original fallbacks, keeping AVIF only where it is smaller."
+    )
+    parser.add_argument("site_root", help="The root of the mirrored site (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help=f"AVIF quality 0-100 (default: {DEFAULT_QUALITY}).")
+    parser.add_argument("--report", help="Also write the size comparison to this CSV file.")
+    parser.add_argument("--no-rewrite", action="store_true", help="Only encode images, do not rewrite HTML.")
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    args = parser.parse_args()
+
+    if Image is None or not features.check('avif'):
+        print("Error: Pillow with AVIF support is required (pip install 'Pillow>=11.3').", file=sys.stderr)
+        sys.exit(1)
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    manifest = manifest_from_args(args)
+    html_files = lazy.find_html_files(args.site_root)
+    rows = encode_images(args.site_root, html_files, args.quality, args.jobs, manifest)
+    print_report(rows, args.site_root, args.report)
+
+    if not args.no_rewrite:
+        print("\nWrapping images in <picture>...")
+        # Which AVIF files exist is an input of the rewrite, so it is part of the config
+        avif_files = sorted(
+            site_relative(os.path.join(root, name), args.site_root)
+            for root, _, files in os.walk(args.site_root)
+            for name in files if name.lower().endswith('.avif')
+        )
+        run_incremental(partial(process_html_file, site_root=args.site_root), html_files, args.jobs, manifest,
+                        'avif_encoder:html', tool_version(sys.modules[__name__]), config={'avif_files': avif_files})
+
+if __name__ == "__main__":
+    main()
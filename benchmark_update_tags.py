@@ -0,0 +1,79 @@
+import io
+import os
+import time
+import argparse
+import statistics
+from bs4 import BeautifulSoup
+
+import update_tags
+
+def tree_rewrite(html_content):
+    """The BeautifulSoup path of update_tags.process_html_file, in memory."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    update_tags.update_soup_image_references(soup)
+    return str(soup)
+
+def streaming_rewrite(html_content):
+    """The streaming path of update_tags.process_html_file_streaming, in memory."""
+    destination = io.StringIO()
+    update_tags.rewrite_html_stream(io.StringIO(html_content), destination)
+    return destination.getvalue()
+
+def time_call(func, argument, repeat):
+    """Returns the median wall-clock time of func(argument) over repeat runs."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(argument)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the tree-based and streaming HTML rewriters of update_tags on the largest pages."
+    )
+    parser.add_argument("folder", nargs="?", default="evolves/www.evolves.tech", help="The folder to take pages from.")
+    parser.add_argument("--top", type=int, default=5, help="Number of largest HTML pages to benchmark (default: 5).")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per page and path; the median is reported (default: 5).")
+    parser.add_argument(
+        "--keep-webp",
+        action="store_true",
+        help="Benchmark pages as they are. By default .webp references are turned back into .jpg first, "
+             "since the mirror is already converted and the rewriters would otherwise have nothing to change."
+    )
+    args = parser.parse_args()
+
+    html_files = sorted(
+        update_tags.find_files(args.folder),
+        key=lambda path: os.path.getsize(path),
+        reverse=True
+    )
+    html_files = [path for path in html_files if path.endswith('.html')][:args.top]
+    if not html_files:
+        print(f"No HTML files found in {args.folder}")
+        return
+
+    total_tree = total_streaming = 0.0
+    print(f"{'page':<60} {'KB':>7} {'tree ms':>9} {'stream ms':>10} {'speedup':>8} {'same DOM':>9}")
+    for file_path in html_files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+        if not args.keep_webp:
+            html_content = html_content.replace('.webp', '.jpg')
+
+        # The streaming output must parse to the same document the tree path writes
+        same_dom = str(BeautifulSoup(streaming_rewrite(html_content), 'html.parser')) == tree_rewrite(html_content)
+
+        tree_time = time_call(tree_rewrite, html_content, args.repeat)
+        streaming_time = time_call(streaming_rewrite, html_content, args.repeat)
+        total_tree += tree_time
+        total_streaming += streaming_time
+        print(f"{os.path.relpath(file_path, args.folder):<60} {len(html_content) / 1024:>7.0f} "
+              f"{tree_time * 1000:>9.1f} {streaming_time * 1000:>10.1f} {tree_time / streaming_time:>7.1f}x "
+              f"{'yes' if same_dom else 'NO':>9}")
+
+    print(f"\nTotal: tree {total_tree * 1000:.1f} ms, streaming {total_streaming * 1000:.1f} ms, "
+          f"speedup {total_tree / total_streaming:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import sys
+import json
+import hashlib
+import inspect
+
+from parallel import run_in_pool
+
+# Default manifest location (kept outside the publish directory so it is never deployed)
+DEFAULT_MANIFEST_PATH = ".optimize-manifest.json"
+
+MANIFEST_FORMAT_VERSION = 1
+
+def file_hash(file_path):
+    """Returns the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def config_hash(config):
+    """Returns a stable hash of a JSON-serializable stage configuration."""
+    encoded = json.dumps(config, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+def tool_version(*modules):
+    """
+    Returns a version string for a tool derived from the source of the
+    modules it runs, so editing any of them invalidates earlier results.
+    """
+    digest = hashlib.sha256()
+    for module in modules:
+        with open(inspect.getsourcefile(module), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+class BuildManifest:
+    """
+    Persistent record of processed files, per tool:
+    path -> {input_hash, tool_version, config_hash, output_hash}, plus
+    rejected_bytes for outputs that were produced and then discarded.
+
+    A file is up to date when its current content hashes to the output
+    recorded for it and neither the tool version nor its configuration
+    has changed since.
+    """
+
+    def __init__(self, manifest_path=DEFAULT_MANIFEST_PATH):
+        self.manifest_path = manifest_path
+        self.tools = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_FORMAT_VERSION:
+                    self.tools = data.get('tools', {})
+                else:
+                    print(f"Warning: Ignoring manifest '{manifest_path}' with unknown format version.", file=sys.stderr)
+            except (IOError, ValueError) as e:
+                print(f"Warning: Could not read manifest '{manifest_path}', starting fresh. Error: {e}", file=sys.stderr)
+
+    def _key(self, file_path):
+        return os.path.abspath(file_path)
+
+    def get(self, tool, file_path):
+        return self.tools.get(tool, {}).get(self._key(file_path))
+
+    def is_up_to_date(self, tool, file_path, current_hash, version, config_digest):
+        entry = self.get(tool, file_path)
+        return (
+            entry is not None
+            and entry.get('output_hash') == current_hash
+            and entry.get('tool_version') == version
+            and entry.get('config_hash') == config_digest
+        )
+
+    def has_output(self, tool, output_path, input_hash, version, config_digest):
+        """
+        True if output_path was already produced from an input with the same
+        hash, tool version and configuration, and is still intact.
+        For tools that write separate files; entries are keyed by output path.
+        """
+        entry = self.get(tool, output_path)
+        return (
+            entry is not None
+            and entry.get('input_hash') == input_hash
+            and entry.get('tool_version') == version
+            and entry.get('config_hash') == config_digest
+            and os.path.isfile(output_path)
+            and file_hash(output_path) == entry.get('output_hash')
+        )
+
+    def record(self, tool, file_path, input_hash, version, config_digest, output_hash):
+        self.tools.setdefault(tool, {})[self._key(file_path)] = {
+            'input_hash': input_hash,
+            'tool_version': version,
+            'config_hash': config_digest,
+            'output_hash': output_hash,
+        }
+
+    def record_rejection(self, tool, output_path, input_hash, version, config_digest, rejected_bytes):
+        """
+        Records that output_path was produced from the input and then
+        discarded (e.g. for not being smaller than the file it would
+        replace), along with the size it had.
+        """
+        self.tools.setdefault(tool, {})[self._key(output_path)] = {
+            'input_hash': input_hash,
+            'tool_version': version,
+            'config_hash': config_digest,
+            'output_hash': None,
+            'rejected_bytes': rejected_bytes,
+        }
+
+    def rejected_bytes(self, tool, output_path, input_hash, version, config_digest):
+        """
+        Returns the size of output_path recorded by record_rejection() if it
+        was rejected for an input with the same hash, tool version and
+        configuration, else None.
+        """
+        entry = self.get(tool, output_path)
+        if (entry is not None
+                and entry.get('input_hash') == input_hash
+                and entry.get('tool_version') == version
+                and entry.get('config_hash') == config_digest):
+            return entry.get('rejected_bytes')
+        return None
+
+    def save(self):
+        """Writes the manifest atomically."""
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_FORMAT_VERSION, 'tools': self.tools}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def add_manifest_arguments(parser):
+    """Adds the shared --manifest / --no-manifest options to an argparse parser."""
+    parser.add_argument(
+        "--manifest",
+        default=DEFAULT_MANIFEST_PATH,
+        help=f"Build manifest used to skip files unchanged since the last run (default: {DEFAULT_MANIFEST_PATH})."
+    )
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="Process every file and do not read or update the build manifest."
+    )
+
+def manifest_from_args(args):
+    """Returns the BuildManifest selected by the parsed arguments, or None."""
+    if args.no_manifest:
+        return None
+    return BuildManifest(args.manifest)
+
+def run_incremental(func, file_paths, jobs, manifest, tool, version, config=None):
+    """
+    Runs func over the files whose content, tool version or configuration
+    changed since the last recorded run (all files when manifest is None),
+    then records the new output hashes. func returns None for a file it
+    failed on (the tools print their own errors), which is left unrecorded
+    so the next run retries it. Returns the results of the files that were
+    processed, in order.
+    """
+    file_paths = list(file_paths)
+    if manifest is None:
+        return run_in_pool(func, file_paths, jobs)
+
+    config_digest = config_hash(config or {})
+    stale_paths, input_hashes = [], {}
+    for file_path in file_paths:
+        current_hash = file_hash(file_path)
+        if manifest.is_up_to_date(tool, file_path, current_hash, version, config_digest):
+            continue
+        stale_paths.append(file_path)
+        input_hashes[file_path] = current_hash
+
+    print(f"Manifest: {len(file_paths) - len(stale_paths)} unchanged file(s) skipped, {len(stale_paths)} to process.")
+    results = run_in_pool(func, stale_paths, jobs)
+
+    for file_path, result in zip(stale_paths, results):
+        if result is not None and os.path.exists(file_path):
+            manifest.record(tool, file_path, input_hashes[file_path], version, config_digest, file_hash(file_path))
+    manifest.save()
+    return results
+
+def run_cached(func, items, jobs, manifest, tool, version, config=None):
+    """
+    Like run_incremental, for tools that derive separate output files from
+    their inputs. items are tuples starting with (input_path, output_path)
+    (one input may feed several outputs); func(item) is only run for items whose output is
+    missing or was produced from a different input, tool version or
+    configuration.
+    Returns (results of the processed items in order, list of cached items).
+    """
+    items = list(items)
+    if manifest is None:
+        return run_in_pool(func, items, jobs), []
+
+    config_digest = config_hash(config or {})
+    stale_items, cached_items, input_hashes = [], [], {}
+    for item in items:
+        input_path, output_path = item[:2]
+        if input_path not in input_hashes:
+            input_hashes[input_path] = file_hash(input_path)
+        if manifest.has_output(tool, output_path, input_hashes[input_path], version, config_digest):
+            cached_items.append(item)
+        else:
+            stale_items.append(item)
+
+    print(f"Manifest: {len(cached_items)} cached output(s) reused, {len(stale_items)} to produce.")
+    results = run_in_pool(func, stale_items, jobs)
+
+    for item in stale_items:
+        input_path, output_path = item[:2]
+        if os.path.isfile(output_path):
+            manifest.record(tool, output_path, input_hashes[input_path], version, config_digest, file_hash(output_path))
+    manifest.save()
+    return results, cached_items
@@ -0,0 +1,297 @@
+import os
+import re
+import sys
+import hashlib
+import argparse
+from functools import partial, lru_cache
+from bs4 import BeautifulSoup
+
+import lazy
+import css_rules
+from parallel import run_in_pool, add_jobs_argument
+from site_paths import resolve_url, site_relative
+
+# Bundles are written here, relative to the publish directory
+BUNDLE_DIR = "bundles"
+
+HASH_LENGTH = 10
+
+# A bundle replaces at least this many tags, or it saves nothing
+MIN_BUNDLE_ASSETS = 2
+
+# Stylesheet media values that apply everywhere; other media stay separate
+# so the browser can still skip them
+BUNDLE_MEDIA = (None, '', 'all')
+
+# Attributes a tag may carry and still be replaced by a bundle; anything
+# else (integrity, crossorigin, data-*) means the tag is left alone
+STYLESHEET_ATTRIBUTES = {'rel', 'href', 'id', 'media', 'type'}
+SCRIPT_ATTRIBUTES = {'src', 'id', 'type', 'defer'}
+
+CLASSIC_SCRIPT_TYPES = (None, '', 'text/javascript', 'application/javascript')
+
+CHARSET_PATTERN = re.compile(r'@charset\s+[^;]*;\s*', re.IGNORECASE)
+IMPORT_PATTERN = re.compile(r'@import\b', re.IGNORECASE)
+# A "use strict" directive only applies at the very start of a script
+STRICT_DIRECTIVE_PATTERN = re.compile(r'''^(?:\s+|/\*.*?\*/|//[^\n]*)*(['"])use strict\1''', re.DOTALL)
+SOURCE_MAP_COMMENT_PATTERN = re.compile(r'(?://[#@] sourceMappingURL=[^\n]*|/\*[#@] sourceMappingURL=[^*]*\*/)')
+
+# --- START OF RUN DETECTION ---
+@lru_cache(maxsize=None)
+def _bundleable_file(local_path):
+    """
+    False for files that break when concatenated: stylesheets with @import
+    (only valid at the top of a file), scripts locating themselves through
+    currentScript (however they reach document) and scripts opening with
+    a "use strict" directive, which stops being one anywhere but at the
+    start of the bundle.
+    """
+    with open(local_path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    if local_path.endswith('.css'):
+        return not IMPORT_PATTERN.search(css_rules.strip_comments(text))
+    return 'currentScript' not in text and not STRICT_DIRECTIVE_PATTERN.match(text.lstrip('\ufeff'))
+
+def _local_asset(url, file_path, site_root):
+    local_path = resolve_url(url or '', file_path, site_root)
+    if local_path and os.path.isfile(local_path) and _bundleable_file(local_path):
+        relative = site_relative(local_path, site_root)
+        if not relative.startswith(BUNDLE_DIR + '/'):
+            return relative
+    return None
+
+def page_runs(soup, file_path, site_root):
+    """
+    Returns the runs of a page: [(kind, [(tag, asset)])], where kind is
+    'css', 'js' (classic scripts) or 'js-defer', and each run lists local
+    assets that can be concatenated without changing cascade or execution
+    order. A run ends at anything else of its kind in between: an inline
+    <style> or another stylesheet for CSS, any other script run during
+    parsing for classic scripts, any other deferred or module script for
+    deferred ones. Async scripts and tags inside <noscript> are ignored.
+    """
+    runs, current = [], {}
+
+    def close(kind):
+        if current.get(kind):
+            runs.append((kind, current.pop(kind)))
+        current.pop(kind, None)
+
+    for tag in soup.find_all(['link', 'style', 'script']):
+        if tag.find_parent('noscript'):
+            continue
+        if tag.name == 'style':
+            close('css')
+            continue
+        if tag.name == 'link':
+            rels = {rel.lower() for rel in tag.get('rel') or []}
+            if 'stylesheet' not in rels and not ('preload' in rels and tag.get('as') == 'style'):
+                continue
+            asset = None
+            if rels == {'stylesheet'} and set(tag.attrs) <= STYLESHEET_ATTRIBUTES and tag.get('media') in BUNDLE_MEDIA:
+                asset = _local_asset(tag.get('href'), file_path, site_root)
+            if asset is None:
+                close('css')
+            else:
+                current.setdefault('css', []).append((tag, asset))
+            continue
+
+        script_type = (tag.get('type') or '').strip().lower()
+        if tag.has_attr('async') or (script_type not in CLASSIC_SCRIPT_TYPES and script_type != 'module'):
+            continue  # async scripts keep no order; data blocks and templates don't run
+        deferred = script_type == 'module' or (tag.has_attr('defer') and tag.get('src'))
+        kind = 'js-defer' if deferred else 'js'
+        asset = None
+        if tag.get('src') and script_type != 'module' and set(tag.attrs) <= SCRIPT_ATTRIBUTES:
+            asset = _local_asset(tag['src'], file_path, site_root)
+        if asset is None:
+            close(kind)
+        else:
+            current.setdefault(kind, []).append((tag, asset))
+    for kind in list(current):
+        close(kind)
+    return runs
+
+def collect_runs(file_path, site_root):
+    """Returns the runs of one page as [(kind, [asset])]."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    return [(kind, [asset for _, asset in members]) for kind, members in page_runs(soup, file_path, site_root)]
+# --- END OF RUN DETECTION ---
+
+
+# --- START OF BUNDLE PLANNING ---
+def plan_bundles(page_run_lists):
+    """
+    Splits every run into segments of consecutive assets used by exactly
+    the same pages, so each segment is shared by all those pages: the
+    assets on every page form the core bundle, those of one template a
+    template bundle, and so on. Segments of MIN_BUNDLE_ASSETS or more
+    become bundles. page_run_lists maps page -> [(kind, [asset])].
+    Returns {(kind, assets): pages using the bundle}.
+    """
+    used_by = {}
+    for page, runs in page_run_lists.items():
+        for kind, assets in runs:
+            for asset in assets:
+                used_by.setdefault((kind, asset), set()).add(page)
+
+    bundles = {}
+    for page, runs in page_run_lists.items():
+        for kind, assets in runs:
+            for segment in _segments(kind, assets, used_by):
+                if len(segment) >= MIN_BUNDLE_ASSETS:
+                    bundles.setdefault((kind, segment), set()).add(page)
+    return bundles
+
+def _segments(kind, assets, used_by):
+    segments, current, signature = [], [], None
+    for asset in assets:
+        pages = used_by[(kind, asset)]
+        if current and pages != signature:
+            segments.append(tuple(current))
+            current = []
+        current.append(asset)
+        signature = pages
+    if current:
+        segments.append(tuple(current))
+    return segments
+
+def bundle_text(kind, assets, site_root, bundle_path):
+    """
+    Concatenates the assets of a bundle in order. CSS loses its @charset
+    and gets its url()s relocated to the bundle; each script starts with
+    ';' so it can't merge with the previous one. That ';' would also turn a
+    leading "use strict" into a plain string and silently drop the
+    script's strict mode, which is why such scripts are never bundled
+    (see _bundleable_file()).
+    """
+    parts = []
+    for asset in assets:
+        local_path = os.path.join(site_root, *asset.split('/'))
+        text = SOURCE_MAP_COMMENT_PATTERN.sub('', css_rules.read_stylesheet(local_path))
+        if kind == 'css':
+            text = css_rules.relocate_urls(CHARSET_PATTERN.sub('', text), local_path, site_root, bundle_path)
+            parts.append(f"/* {asset} */\n{text}")
+        else:
+            parts.append(f";/* {asset} */\n{text}")
+    return '\n'.join(parts) + '\n'
+
+def write_bundles(bundles, site_root):
+    """
+    Writes every planned bundle to BUNDLE_DIR, named by the hash of its
+    content so unchanged bundles keep their URL (and their cache entries).
+    Returns {(kind, assets): bundle path relative to site_root}.
+    """
+    bundle_dir = os.path.join(site_root, BUNDLE_DIR)
+    os.makedirs(bundle_dir, exist_ok=True)
+    paths = {}
+    for kind, assets in sorted(bundles):
+        extension = '.css' if kind == 'css' else '.js'
+        # url()s are relocated relative to the bundle directory, so the name doesn't matter yet
+        text = bundle_text(kind, assets, site_root, os.path.join(bundle_dir, 'bundle' + extension))
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:HASH_LENGTH]
+        bundle_path = os.path.join(bundle_dir, f"{kind}-{digest}{extension}")
+        if not os.path.exists(bundle_path):
+            tmp_path = f"{bundle_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, bundle_path)
+        paths[(kind, assets)] = site_relative(bundle_path, site_root)
+    return paths
+# --- END OF BUNDLE PLANNING ---
+
+
+# --- START OF HTML REWRITING ---
+def apply_bundles(soup, file_path, site_root, bundle_paths):
+    """
+    Replaces the tags of every bundled segment of the page with one tag
+    for the bundle: stylesheets and deferred scripts at the position of
+    their first tag, classic scripts at the position of their last one (so
+    the bundle still runs after the markup its last script expected).
+    Returns (tags before, tags after).
+    """
+    runs = page_runs(soup, file_path, site_root)
+    tags_before = tags_after = 0
+    for kind, members in runs:
+        tags_before += len(members)
+        position = 0
+        while position < len(members):
+            match = None
+            for (bundle_kind, assets), bundle_path in bundle_paths.items():
+                if bundle_kind == kind and tuple(asset for _, asset in members[position:position + len(assets)]) == assets:
+                    if match is None or len(assets) > len(match[0]):
+                        match = (assets, bundle_path)
+            if match is None:
+                tags_after += 1
+                position += 1
+                continue
+            assets, bundle_path = match
+            tags = [tag for tag, _ in members[position:position + len(assets)]]
+            url = os.path.relpath(os.path.join(site_root, *bundle_path.split('/')),
+                                  os.path.dirname(file_path)).replace(os.sep, '/')
+            if kind == 'css':
+                bundle_tag = soup.new_tag('link', rel='stylesheet', href=url)
+                anchor = tags[0]
+            else:
+                bundle_tag = soup.new_tag('script', src=url)
+                if kind == 'js-defer':
+                    bundle_tag['defer'] = ''
+                anchor = tags[0] if kind == 'js-defer' else tags[-1]
+            anchor.insert_before(bundle_tag)
+            for tag in tags:
+                if tag.contents:
+                    # A stray </link> made html.parser nest the following tags inside this one
+                    tag.unwrap()
+                else:
+                    tag.decompose()
+            tags_after += 1
+            position += len(assets)
+    return tags_before, tags_after
+
+def process_html_file(file_path, site_root, bundle_paths):
+    """Rewrites one page to use the bundles. Returns (tags before, tags after)."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        tags_before, tags_after = apply_bundles(soup, file_path, site_root, bundle_paths)
+        if tags_after < tags_before:
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(str(soup))
+            print(f"Modified: {file_path} ({tags_before} -> {tags_after} stylesheet/script tags)")
+        return tags_before, tags_after
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+# --- END OF HTML REWRITING ---
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Concatenate the stylesheets and scripts pages share into a few cacheable bundles and link those instead."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    html_files = lazy.find_html_files(args.site_root)
+    results = run_in_pool(partial(collect_runs, site_root=args.site_root), html_files, args.jobs)
+    page_run_lists = {page: runs for page, runs in zip(html_files, results) if runs}
+
+    bundles = plan_bundles(page_run_lists)
+    bundle_paths = write_bundles(bundles, args.site_root)
+    for (kind, assets), pages in sorted(bundles.items(), key=lambda item: -len(item[1])):
+        print(f"  {bundle_paths[(kind, assets)]}: {len(assets)} file(s), used by {len(pages)} page(s)")
+
+    results = run_in_pool(partial(process_html_file, site_root=args.site_root, bundle_paths=bundle_paths),
+                          html_files, args.jobs)
+    results = [result for result in results if result]
+    print(f"\nWrote {len(bundle_paths)} bundle(s); stylesheet/script tags per page: "
+          f"{sum(r[0] for r in results)} -> {sum(r[1] for r in results)} in total.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from functools import partial, lru_cache
+from bs4 import BeautifulSoup
+import soupsieve
+
+import lazy
+import css_rules
+from parallel import add_jobs_argument
+from build_manifest import file_hash, run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from site_paths import resolve_url, site_relative
+
+# Critical CSS computed for a (page template, stylesheet hashes) key, shared
+# by all pages and runs; delete the directory to start over
+CACHE_DIR = ".critical-css-cache"
+
+CRITICAL_STYLE_ID = "critical-css"
+
+# Past this size inlining costs more than the blocking requests it saves
+# (Elementor CSS compresses about 7:1, so this is ~14 KB on the wire)
+MAX_CRITICAL_BYTES = 96 * 1024
+
+# Stylesheet media values that block rendering on every device
+BLOCKING_MEDIA = (None, '', 'all', 'screen')
+
+DEFER_ONLOAD = "this.onload=null;this.rel='stylesheet'"
+
+# Pages linking no stylesheet have nothing to inline, pages with the
+# critical <style> were done on an earlier run (see prefilter.py); pages
+# whose critical CSS is over MAX_CRITICAL_BYTES are looked at again each run
+STYLESHEET_PATTERN = re.compile(rb'stylesheet', re.IGNORECASE)
+
+def _lacks_critical_css(data, file_path, site_root):
+    return STYLESHEET_PATTERN.search(data) is not None and data.find(CRITICAL_STYLE_ID.encode('ascii')) == -1
+
+CRITICAL_TRIGGER = _lacks_critical_css
+
+# --- START OF FOLD DETECTION ---
+def template_signature(elements):
+    """
+    Hashes the structure of the above-the-fold markup (nesting, tag names,
+    ids, classes), ignoring text, so pages built from the same template and
+    content blocks share a signature.
+    """
+    digest = hashlib.sha256()
+    for element in elements:
+        depth = sum(1 for _ in element.parents)
+        digest.update(f"{depth} {element.name} {element.get('id', '')} {' '.join(element.get('class') or [])} "
+                      f"{element.get('type', '')}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+class FoldMatcher:
+    """Answers whether a selector matches any of the given (above-the-fold) elements."""
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.tokens = css_rules.document_tokens(self.elements)
+        self.index = {}
+        for element in self.elements:
+            keys = [('tag', element.name.lower())] + [('class', name) for name in element.get('class') or []]
+            if element.get('id'):
+                keys.append(('id', element['id']))
+            for key in keys:
+                self.index.setdefault(key, []).append(element)
+
+    def _candidates(self, selector):
+        """The fold elements that can be the subject of selector (its last compound)."""
+        compound = re.split(r'[\s>+~]+', selector)[-1]
+        tags, classes, ids = css_rules.required_tokens(compound)
+        keys = [('id', name) for name in ids] + [('class', name) for name in classes] + [('tag', name) for name in tags]
+        if not keys:
+            return self.elements
+        return min((self.index.get(key, []) for key in keys), key=len)
+
+    def matches(self, selector):
+        if not css_rules.selector_may_match(selector, self.tokens):
+            return False
+        try:
+            matchable = css_rules.matchable_selector(selector)
+            compiled = soupsieve.compile(matchable)
+            return any(compiled.match(element) for element in self._candidates(matchable))
+        except Exception:
+            # Selectors soupsieve can't evaluate are kept, to be safe
+            return True
+# --- END OF FOLD DETECTION ---
+
+
+# --- START OF CRITICAL CSS ---
+@lru_cache(maxsize=None)
+def _parsed_stylesheet(path, digest):
+    return css_rules.parse_stylesheet(css_rules.read_stylesheet(path))
+
+def critical_rules(rules, matcher):
+    """
+    Keeps the style rules with a selector matching above the fold, every
+    @font-face (fonts only download when used) and the @keyframes the kept
+    rules refer to.
+    """
+    kept = css_rules.filter_rules(rules, lambda rule: (
+        rule['type'] == 'style' and any(matcher.matches(selector) for selector in css_rules.split_selectors(rule['selector']))
+        or rule.get('keyword') == 'font-face'
+    ))
+    kept_text = css_rules.serialize_rules(kept)
+    keyframes = css_rules.filter_rules(rules, lambda rule: (
+        rule.get('keyword', '').endswith('keyframes') and rule['prelude'] and rule['prelude'] in kept_text
+    ))
+    return kept + keyframes
+
+def critical_css_for(stylesheets, matcher, site_root):
+    """Returns the critical CSS of the (local_path, media) stylesheets, in document order."""
+    parts = []
+    for local_path, media in stylesheets:
+        rules = _parsed_stylesheet(local_path, file_hash(local_path))
+        css = css_rules.relocate_urls(css_rules.serialize_rules(critical_rules(rules, matcher)), local_path, site_root)
+        if css:
+            parts.append(css if media in BLOCKING_MEDIA else f"@media {media}{{{css}}}")
+    return '\n'.join(parts)
+
+def _cache_key(signature, stylesheets, site_root):
+    version = tool_version(sys.modules[__name__], css_rules, lazy)
+    sheets = [(site_relative(path, site_root), file_hash(path), media) for path, media in stylesheets]
+    payload = json.dumps([signature, sheets, version, lazy.FOLD_MARGIN_ELEMENTS, lazy.FOLD_ELEMENT_COUNT])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def cached_critical_css(soup, stylesheets, site_root):
+    """
+    Returns (css, cache_hit). Pages with the same template signature and
+    the same stylesheet contents reuse the critical CSS computed first.
+    """
+    elements = lazy.fold_elements(soup)
+    key = _cache_key(template_signature(elements), stylesheets, site_root)
+    cache_path = os.path.join(CACHE_DIR, f"{key}.css")
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return f.read(), True
+
+    css = critical_css_for(stylesheets, FoldMatcher(elements), site_root)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(css)
+    os.replace(tmp_path, cache_path)
+    return css, False
+# --- END OF CRITICAL CSS ---
+
+
+# --- START OF HTML PROCESSING ---
+def blocking_stylesheets(soup, file_path, site_root):
+    """Returns [(link_tag, local_path)] for the local render-blocking stylesheets in <head>."""
+    head = soup.head or soup
+    stylesheets = []
+    for link in head.find_all('link', rel='stylesheet'):
+        if link.get('media') == 'print' or link.find_parent('noscript'):
+            continue
+        local_path = resolve_url(link.get('href') or '', file_path, site_root)
+        if local_path and os.path.isfile(local_path):
+            stylesheets.append((link, local_path))
+    return stylesheets
+
+def defer_stylesheet(soup, link):
+    """Turns a blocking <link rel="stylesheet"> into a preload applied on load, with a <noscript> fallback."""
+    fallback = soup.new_tag('link', rel='stylesheet', href=link['href'])
+    if link.get('media'):
+        fallback['media'] = link['media']
+    noscript = soup.new_tag('noscript')
+    noscript.append(fallback)
+    link['rel'] = 'preload'
+    link['as'] = 'style'
+    link['onload'] = DEFER_ONLOAD
+    if link.contents:
+        # A stray </link> makes html.parser nest the following tags inside
+        # this one; keep the fallback right after its start tag regardless
+        link.insert(0, noscript)
+    else:
+        link.insert_after(noscript)
+
+def inline_critical_css(soup, file_path, site_root):
+    """
+    Inlines the above-the-fold subset of the page's blocking stylesheets
+    into <head> and defers the full stylesheets. Returns True if changed.
+    """
+    if soup.find('style', id=CRITICAL_STYLE_ID):
+        return False
+    stylesheets = blocking_stylesheets(soup, file_path, site_root)
+    if not stylesheets:
+        return False
+
+    css, cache_hit = cached_critical_css(soup, [(path, link.get('media')) for link, path in stylesheets], site_root)
+    size = len(css.encode('utf-8'))
+    if not css or size > MAX_CRITICAL_BYTES:
+        print(f"  Skipped critical CSS: {size / 1024:.1f} KB (limit {MAX_CRITICAL_BYTES // 1024} KB)")
+        return False
+
+    style = soup.new_tag('style', id=CRITICAL_STYLE_ID)
+    style.string = css
+    stylesheets[0][0].insert_before(style)
+    for link, _ in stylesheets:
+        defer_stylesheet(soup, link)
+    print(f"  Inlined {size / 1024:.1f} KB of critical CSS{' (cached)' if cache_hit else ''}, "
+          f"deferred {len(stylesheets)} stylesheet(s).")
+    return True
+
+def process_html_file(file_path, site_root):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        if inline_critical_css(soup, file_path, site_root):
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(str(soup))
+            print(f"Modified: {file_path}")
+            return True
+        return False
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+# --- END OF HTML PROCESSING ---
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inline the above-the-fold CSS of every page and load its full stylesheets without blocking render."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    html_files = lazy.find_html_files(args.site_root)
+    run_incremental(partial(process_html_file, site_root=args.site_root), html_files, args.jobs,
+                    manifest_from_args(args), 'critical_css', tool_version(sys.modules[__name__], css_rules, lazy),
+                    config={'fold_margin': lazy.FOLD_MARGIN_ELEMENTS, 'fold_count': lazy.FOLD_ELEMENT_COUNT,
+                            'max_bytes': MAX_CRITICAL_BYTES})
+
+if __name__ == "__main__":
+    main()
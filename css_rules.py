@@ -0,0 +1,260 @@
+import os
+import re
+
+from site_paths import resolve_url, site_relative
+
+# At-rules whose block holds further rules rather than declarations
+NESTED_AT_RULES = ('media', 'supports', 'document', '-moz-document', 'layer', 'container')
+
+# Pseudo-classes and pseudo-elements that depend on interaction or generate
+# content; an element matching the rest of the selector is enough to keep the rule
+STATEFUL_PSEUDO_PATTERN = re.compile(
+    r'(?<!\\)::?(?:-[\w-]+|before|after|first-letter|first-line|selection|placeholder|marker|backdrop|'
+    r'hover|focus|focus-within|focus-visible|active|visited|link|target|checked|disabled|enabled|'
+    r'invalid|valid|required|optional|indeterminate|placeholder-shown|autofill|default|in-range|out-of-range)'
+    r'(?![\w-])(?:\([^()]*\))?'
+)
+
+CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]*?)\1\s*\)', re.IGNORECASE)
+
+_IDENTIFIER = r'(?:\\.|[\w-])+'
+_CLASS_PATTERN = re.compile(r'\.(' + _IDENTIFIER + ')')
+_ID_PATTERN = re.compile(r'#(' + _IDENTIFIER + ')')
+_TAG_PATTERN = re.compile(r'(?:^|[\s>+~(])([a-zA-Z][\w-]*)')
+_ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+# --- START OF PARSING ---
+def _skip_string(text, i):
+    """Returns the index after the string literal starting at text[i]."""
+    quote, i = text[i], i + 1
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+            continue
+        if text[i] == quote:
+            return i + 1
+        i += 1
+    return len(text)
+
+def _skip_comment(text, i):
+    end = text.find('*/', i + 2)
+    return len(text) if end == -1 else end + 2
+
+def _scan_to(text, i, stops):
+    """
+    Returns the index of the first character in stops at nesting level 0,
+    skipping strings, comments and (), [] groups; len(text) if there is none.
+    """
+    depth = 0
+    while i < len(text):
+        c = text[i]
+        if c in '"\'':
+            i = _skip_string(text, i)
+            continue
+        if text.startswith('/*', i):
+            i = _skip_comment(text, i)
+            continue
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth = max(0, depth - 1)
+        elif depth == 0 and c in stops:
+            return i
+        i += 1
+    return len(text)
+
+def _block_end(text, i):
+    """Returns the index after the '}' matching the '{' at text[i]."""
+    depth = 0
+    while i < len(text):
+        c = text[i]
+        if c in '"\'':
+            i = _skip_string(text, i)
+            continue
+        if text.startswith('/*', i):
+            i = _skip_comment(text, i)
+            continue
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return len(text)
+
+def strip_comments(text):
+    out, i, start = [], 0, 0
+    while i < len(text):
+        if text[i] in '"\'':
+            i = _skip_string(text, i)
+        elif text.startswith('/*', i):
+            out.append(text[start:i])
+            i = start = _skip_comment(text, i)
+        else:
+            i += 1
+    out.append(text[start:])
+    return ''.join(out)
+
+def parse_stylesheet(css_text):
+    """
+    Splits a stylesheet into a list of rule dicts, in source order:
+      {'type': 'style', 'selector': str, 'body': str}
+      {'type': 'at', 'keyword': str, 'prelude': str, 'rules': [...]}  (@media, @supports, ...)
+      {'type': 'at', 'keyword': str, 'prelude': str, 'body': str}     (@font-face, @keyframes, ...)
+      {'type': 'at', 'keyword': str, 'prelude': str, 'body': None}    (@import, @charset, ...)
+    Bodies are kept verbatim; comments outside them are dropped.
+    """
+    rules, i = [], 0
+    while i < len(css_text):
+        end = _scan_to(css_text, i, '{;}')
+        prelude = strip_comments(css_text[i:end]).strip()
+        if end >= len(css_text) or css_text[end] in ';}':
+            if prelude.startswith('@'):
+                keyword, _, rest = prelude[1:].partition(' ')
+                rules.append({'type': 'at', 'keyword': keyword.lower(), 'prelude': rest.strip(), 'body': None})
+            i = end + 1
+            continue
+
+        block_end = _block_end(css_text, end)
+        body = css_text[end + 1:block_end - 1]
+        if prelude.startswith('@'):
+            match = re.match(r'@([\w-]+)\s*(.*)', prelude, re.DOTALL)
+            keyword, rest = (match.group(1).lower(), match.group(2).strip()) if match else (prelude[1:], '')
+            if keyword in NESTED_AT_RULES:
+                rules.append({'type': 'at', 'keyword': keyword, 'prelude': rest, 'rules': parse_stylesheet(body)})
+            else:
+                rules.append({'type': 'at', 'keyword': keyword, 'prelude': rest, 'body': body})
+        elif prelude:
+            rules.append({'type': 'style', 'selector': prelude, 'body': body})
+        i = block_end
+    return rules
+
+def serialize_rules(rules):
+    """Writes rule dicts back as compact CSS text."""
+    out = []
+    for rule in rules:
+        if rule['type'] == 'style':
+            out.append(f"{rule['selector']}{{{rule['body'].strip()}}}")
+        elif 'rules' in rule:
+            inner = serialize_rules(rule['rules'])
+            if inner:
+                out.append(f"@{rule['keyword']} {rule['prelude']}{{{inner}}}")
+        elif rule['body'] is None:
+            out.append(f"@{rule['keyword']} {rule['prelude']};".replace(' ;', ';'))
+        else:
+            prelude = f" {rule['prelude']}" if rule['prelude'] else ''
+            out.append(f"@{rule['keyword']}{prelude}{{{rule['body'].strip()}}}")
+    return '\n'.join(out)
+
+def filter_rules(rules, keep):
+    """
+    Returns a copy of rules keeping only the style rules for which
+    keep(rule) is true (looking inside @media/@supports); other at-rules
+    are kept when keep(rule) is true for them as well.
+    """
+    kept = []
+    for rule in rules:
+        if 'rules' in rule:
+            inner = filter_rules(rule['rules'], keep)
+            if inner:
+                kept.append(dict(rule, rules=inner))
+        elif keep(rule):
+            kept.append(rule)
+    return kept
+# --- END OF PARSING ---
+
+
+# --- START OF SELECTORS ---
+def split_selectors(selector_text):
+    """Splits a selector list on its top-level commas."""
+    selectors, i = [], 0
+    while i <= len(selector_text):
+        end = _scan_to(selector_text, i, ',')
+        selector = selector_text[i:end].strip()
+        if selector:
+            selectors.append(selector)
+        i = end + 1
+    return selectors
+
+def _without_functional_arguments(selector):
+    """Removes the arguments of :not(), :is(), :has(), ... and attribute selectors."""
+    out, depth = [], 0
+    for c in selector:
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth = max(0, depth - 1)
+            continue
+        if depth == 0:
+            out.append(c)
+    return ''.join(out)
+
+def required_tokens(selector):
+    """
+    Returns (tags, classes, ids): the element names, classes and ids that
+    must all be present in a document for selector to match anything.
+    Arguments of functional pseudo-classes are ignored, which only ever
+    makes the answer more permissive.
+    """
+    simple = _without_functional_arguments(selector)
+    simple = re.sub(r'(?<!\\)::?[\w-]+', ' ', simple)
+    classes = {_ESCAPE_PATTERN.sub(r'\1', name) for name in _CLASS_PATTERN.findall(simple)}
+    ids = {_ESCAPE_PATTERN.sub(r'\1', name) for name in _ID_PATTERN.findall(simple)}
+    no_classes = _ID_PATTERN.sub(' ', _CLASS_PATTERN.sub(' ', simple))
+    tags = {name.lower() for name in _TAG_PATTERN.findall(no_classes)}
+    return tags, classes, ids
+
+def matchable_selector(selector):
+    """
+    Drops interaction-dependent pseudo-classes and pseudo-elements, so the
+    result selects the elements the rule would style at some point.
+    """
+    stripped = STATEFUL_PSEUDO_PATTERN.sub('', selector).lstrip()
+    stripped = re.sub(r'\s*([>+~])\s*', r'\1', stripped)
+    # A compound left empty (":hover > a" -> "> a") matches any element
+    stripped = re.sub(r'(^|[\s>+~(,])(?=[\s>+~),]|$)', r'\1*', stripped)
+    return stripped.replace(':not(*)', '').strip() or '*'
+
+def document_tokens(elements):
+    """Returns the (tags, classes, ids) sets used by an iterable of bs4 tags."""
+    tags, classes, ids = set(), set(), set()
+    for element in elements:
+        tags.add(element.name.lower())
+        classes.update(element.get('class') or [])
+        if element.get('id'):
+            ids.add(element['id'])
+    return tags, classes, ids
+
+def selector_may_match(selector, tokens):
+    """Cheap test: False only if selector can't match a document with these tokens."""
+    tags, classes, ids = required_tokens(selector)
+    return tags <= tokens[0] and classes <= tokens[1] and ids <= tokens[2]
+# --- END OF SELECTORS ---
+
+
+def relocate_urls(css_text, stylesheet_path, site_root, target_path=None):
+    """
+    Rewrites the relative url() references of css_text, taken from the file
+    stylesheet_path, as root-relative URLs, so the CSS can be moved to
+    another file or inlined into a page. With target_path (the file the
+    CSS moves to), they are rewritten relative to it instead.
+    """
+    def replace(match_obj):
+        url = match_obj.group(2).strip()
+        if not url or url.startswith(('/', '#', 'data:')) or re.match(r'[a-zA-Z][\w+.-]*:', url):
+            return match_obj.group(0)
+        local_path = resolve_url(url, stylesheet_path, site_root)
+        if not local_path:
+            return match_obj.group(0)
+        query = url[len(url.split('?', 1)[0].split('#', 1)[0]):]
+        if target_path is not None:
+            relative = os.path.relpath(local_path, os.path.dirname(target_path)).replace(os.sep, '/')
+            return f"url({match_obj.group(1)}{relative}{query}{match_obj.group(1)})"
+        return f"url({match_obj.group(1)}/{site_relative(local_path, site_root)}{query}{match_obj.group(1)})"
+
+    return CSS_URL_PATTERN.sub(replace, css_text)
+
+def read_stylesheet(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return f.read()
@@ -0,0 +1,351 @@
+import os
+import re
+import sys
+import csv
+import hashlib
+import argparse
+from functools import partial
+from bs4 import BeautifulSoup
+
+from parallel import run_in_pool, add_jobs_argument
+from site_paths import SITE_ORIGINS, resolve_url, site_relative, page_url
+
+# Files compared for exact duplicates; only HTML pages are also compared for near-duplicates
+DUPLICATE_EXTENSIONS = ('.html', '.htm', '.php', '.json', '.xml')
+HTML_EXTENSIONS = ('.html', '.htm')
+
+# HTTrack names query-string variants of a URL indexXXXX.html/.php/.json;
+# they lose to any other copy when a group's canonical page is chosen
+QUERY_VARIANT_PATTERN = re.compile(r'(?:^|/)index[0-9a-f]{4}\.[a-z]+$')
+
+# HTTrack comments carry the mirroring date, so identical pages differ by them
+COMMENT_PATTERN = re.compile(r'<!--.*?-->', re.DOTALL)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+WORD_PATTERN = re.compile(r'\w+')
+REFRESH_PATTERN = re.compile(r'^\s*\d+\s*;\s*url\s*=\s*[\'"]?([^\'"]+)', re.IGNORECASE)
+
+# Words per text shingle and tags per DOM shingle
+TEXT_SHINGLE_SIZE = 5
+DOM_SHINGLE_SIZE = 4
+
+# Pages are near-duplicates when both their text and their DOM shingles overlap this much (Jaccard)
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_DOM_THRESHOLD = 0.8
+
+# Pages with fewer text shingles than this are only merged when exactly equal
+MIN_SHINGLES = 20
+
+# Markup not part of a page's own content: removed before shingling so the
+# header, footer and menus every page shares don't make all pages alike
+NON_CONTENT_TAGS = ['script', 'style', 'noscript', 'template', 'svg', 'header', 'footer', 'nav']
+NON_CONTENT_SELECTOR = '[data-elementor-type="header"], [data-elementor-type="footer"], [data-elementor-type="popup"]'
+
+REDIRECTS_FILE = "_redirects"
+REDIRECT_STATUS = "301!"  # forced: Netlify ignores unforced rules for paths that still exist
+BLOCK_START = "# --- START OF dedupe_pages ---"
+BLOCK_END = "# --- END OF dedupe_pages ---"
+
+MODES = ('redirects', 'canonical')
+
+# --- START OF FINGERPRINTING ---
+def _shingles(tokens, size):
+    """Hashes every run of size tokens to a 64-bit integer (stable across processes, unlike hash())."""
+    runs = [tokens[i:i + size] for i in range(len(tokens) - size + 1)] or ([tokens] if tokens else [])
+    return frozenset(
+        int.from_bytes(hashlib.blake2b(' '.join(run).encode('utf-8'), digest_size=8).digest(), 'big')
+        for run in runs
+    )
+
+def fingerprint_file(file_path, site_root):
+    """
+    Returns the fingerprint of one file as a dict:
+      'digest'     hash of the content with comments dropped and whitespace collapsed
+      'text'       shingles of the page's own visible text (HTML only)
+      'dom'        shingles of the tag structure of its body (HTML only)
+      'refresh'    the page a meta refresh stub sends to, if it is one
+      'canonical'  the page its rel=canonical points to
+      'title'      its <title>, whitespace collapsed
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        content = f.read()
+    normalized = WHITESPACE_PATTERN.sub(' ', COMMENT_PATTERN.sub('', content)).strip()
+    fingerprint = {'digest': hashlib.sha256(normalized.encode('utf-8')).hexdigest(),
+                   'text': frozenset(), 'dom': frozenset(), 'refresh': None, 'canonical': None, 'title': None}
+    if not file_path.lower().endswith(HTML_EXTENSIONS):
+        return fingerprint
+
+    soup = BeautifulSoup(content, 'html.parser')
+    for meta in soup.find_all('meta', attrs={'http-equiv': re.compile('^refresh$', re.IGNORECASE)}):
+        match = REFRESH_PATTERN.match(meta.get('content') or '')
+        target = match and resolve_url(match.group(1), file_path, site_root)
+        if target and os.path.isfile(target):
+            fingerprint['refresh'] = site_relative(target, site_root)
+    for link in soup.find_all('link', rel='canonical'):
+        target = resolve_url(link.get('href') or '', file_path, site_root)
+        if target and os.path.isfile(target):
+            fingerprint['canonical'] = site_relative(target, site_root)
+
+    if soup.title:
+        fingerprint['title'] = WHITESPACE_PATTERN.sub(' ', soup.title.get_text()).strip()
+
+    body = soup.body or soup
+    for tag in body.select(NON_CONTENT_SELECTOR) + body.find_all(NON_CONTENT_TAGS):
+        if not tag.decomposed:
+            tag.decompose()
+    words = WORD_PATTERN.findall(body.get_text(' ').lower())
+    fingerprint['text'] = _shingles(words, TEXT_SHINGLE_SIZE)
+    fingerprint['dom'] = _shingles([tag.name for tag in body.find_all(True)], DOM_SHINGLE_SIZE)
+    return fingerprint
+
+def _fingerprint_item(relative, site_root):
+    return fingerprint_file(os.path.join(site_root, *relative.split('/')), site_root)
+
+def find_candidate_files(site_root):
+    """Returns the site-relative paths of every page-like file under site_root, sorted."""
+    return sorted(
+        site_relative(os.path.join(root, file_name), site_root)
+        for root, _, files in os.walk(site_root)
+        for file_name in files
+        if file_name.lower().endswith(DUPLICATE_EXTENSIONS)
+    )
+# --- END OF FINGERPRINTING ---
+
+
+# --- START OF GROUPING ---
+def jaccard(a, b):
+    """Jaccard similarity of two shingle sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+def near_duplicate_pairs(fingerprints, threshold=DEFAULT_THRESHOLD, dom_threshold=DEFAULT_DOM_THRESHOLD):
+    """
+    Yields (a, b, text similarity) for every pair of HTML pages with the
+    same title whose text and DOM shingles are at least threshold and
+    dom_threshold alike (posts of a theme's demo content share their body).
+    Pages are sorted by shingle count: a Jaccard similarity of t needs the
+    smaller set to be at least t times the larger, so each page is only
+    compared with the next ones until that fails.
+    """
+    pages = sorted((len(fp['text']), path) for path, fp in fingerprints.items()
+                   if len(fp['text']) >= MIN_SHINGLES and not fp['refresh'])
+    for i, (size, a) in enumerate(pages):
+        for other_size, b in pages[i + 1:]:
+            if size < threshold * other_size:
+                break
+            if fingerprints[a]['title'] != fingerprints[b]['title']:
+                continue
+            similarity = jaccard(fingerprints[a]['text'], fingerprints[b]['text'])
+            if similarity >= threshold and jaccard(fingerprints[a]['dom'], fingerprints[b]['dom']) >= dom_threshold:
+                yield a, b, similarity
+
+def canonical_key(path, votes):
+    """
+    Sort key choosing a group's canonical page: not a query variant, then
+    the page most rel=canonical links of the group point to, then the
+    shortest path.
+    """
+    return (bool(QUERY_VARIANT_PATTERN.search(path)), -votes.get(path, 0), len(path), path)
+
+def group_duplicates(fingerprints, threshold=DEFAULT_THRESHOLD, dom_threshold=DEFAULT_DOM_THRESHOLD):
+    """
+    Groups exact duplicates, near-duplicate pages and meta refresh stubs
+    with the page they send to. Returns [(canonical, [(duplicate, reason)])]
+    for every group of two or more files, largest groups first; reason is
+    'exact', 'near (similarity)' or 'refresh'.
+    """
+    parent = {path: path for path in fingerprints}
+    reasons = {}
+
+    def find(path):
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    def union(a, b, reason):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[root_b] = root_a
+        reasons.setdefault(b, reason)
+        reasons.setdefault(a, reason)
+
+    by_digest = {}
+    for path, fp in fingerprints.items():
+        if fp['refresh'] and fp['refresh'] in fingerprints:
+            union(fp['refresh'], path, 'refresh')
+        else:
+            by_digest.setdefault(fp['digest'], []).append(path)
+    for paths in by_digest.values():
+        for path in paths[1:]:
+            union(paths[0], path, 'exact')
+
+    # One page per exact group is enough for the pairwise comparison
+    representatives = {paths[0]: fingerprints[paths[0]] for paths in by_digest.values()
+                       if paths[0].lower().endswith(HTML_EXTENSIONS)}
+    for a, b, similarity in near_duplicate_pairs(representatives, threshold, dom_threshold):
+        union(a, b, f'near ({similarity:.2f})')
+
+    members = {}
+    for path in fingerprints:
+        members.setdefault(find(path), []).append(path)
+    groups = []
+    for paths in members.values():
+        if len(paths) < 2:
+            continue
+        votes = {}
+        for path in paths:
+            target = fingerprints[path]['canonical']
+            if target in paths and target != path:
+                votes[target] = votes.get(target, 0) + 1
+        # Stubs only point somewhere; they never become the page that is kept
+        candidates = [path for path in paths if not fingerprints[path]['refresh']] or paths
+        canonical = min(candidates, key=lambda path: canonical_key(path, votes))
+        duplicates = sorted((path, 'refresh' if fingerprints[path]['refresh'] else reasons.get(path, 'exact'))
+                            for path in paths if path != canonical)
+        groups.append((canonical, duplicates))
+    return sorted(groups, key=lambda group: (-len(group[1]), group[0]))
+# --- END OF GROUPING ---
+
+
+# --- START OF OUTPUT ---
+def redirect_rules(groups):
+    """Returns the _redirects lines sending every duplicate to its canonical page."""
+    lines = []
+    for canonical, duplicates in groups:
+        target = page_url(canonical)
+        for duplicate, _ in duplicates:
+            sources = [page_url(duplicate)]
+            if sources[0].endswith('/'):
+                sources.append('/' + duplicate)
+            lines.extend(f"{source} {target} {REDIRECT_STATUS}" for source in sources)
+    return lines
+
+def _served_file(site_root, url):
+    relative = url.lstrip('/')
+    return os.path.join(site_root, *(relative + 'index.html' if not relative or relative.endswith('/') else relative).split('/'))
+
+def write_redirects(site_root, lines):
+    """
+    Writes the rules into the _redirects file of site_root, between
+    BLOCK_START and BLOCK_END so a rerun replaces them and hand-written
+    rules are kept. Rules of an earlier run whose duplicate has since been
+    removed are carried over, as nothing would find that duplicate again.
+    """
+    redirects_path = os.path.join(site_root, REDIRECTS_FILE)
+    existing = ''
+    if os.path.exists(redirects_path):
+        with open(redirects_path, 'r', encoding='utf-8') as f:
+            existing = f.read()
+    block = re.compile(re.escape(BLOCK_START) + r'\n(.*?)' + re.escape(BLOCK_END) + r'\n?', re.DOTALL)
+    sources = {line.split()[0] for line in lines}
+    carried = [line for match in block.finditer(existing) for line in match.group(1).splitlines()
+               if line.split() and line.split()[0] not in sources
+               and not os.path.exists(_served_file(site_root, line.split()[0]))]
+    kept = block.sub('', existing).rstrip('\n')
+    # Netlify applies the first matching rule, so generated rules go after hand-written ones
+    text = (kept + '\n\n' if kept else '') + '\n'.join([BLOCK_START] + carried + lines + [BLOCK_END]) + '\n'
+    with open(redirects_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    print(f"Wrote {len(carried) + len(lines)} redirect rule(s) to {redirects_path}"
+          + (f" ({len(carried)} kept from the last run)" if carried else ""))
+
+def set_canonical_link(file_path, canonical_url):
+    """Points the rel=canonical link of a page at canonical_url, adding one if missing. True if changed."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        links = soup.find_all('link', rel='canonical')
+        if len(links) == 1 and links[0].get('href') == canonical_url:
+            return False
+        for link in links[1:]:
+            link.decompose()
+        if links:
+            links[0]['href'] = canonical_url
+        else:
+            head = soup.head or soup
+            head.append(soup.new_tag('link', rel='canonical', href=canonical_url))
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(str(soup))
+        print(f"Modified: {file_path} (canonical: {canonical_url})")
+        return True
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return False
+
+def write_report(groups, report_path):
+    """Writes one CSV row per duplicate: duplicate, canonical, reason."""
+    with open(report_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['duplicate', 'canonical', 'reason'])
+        for canonical, duplicates in groups:
+            for duplicate, reason in duplicates:
+                writer.writerow([duplicate, canonical, reason])
+    print(f"Wrote duplicate report to {report_path}")
+# --- END OF OUTPUT ---
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find exact and near-duplicate pages in the publish directory and redirect or canonicalize them to one copy."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--mode", choices=MODES, default='redirects',
+                        help=f"redirects: write {REDIRECTS_FILE} rules (default); "
+                             "canonical: point the rel=canonical link of duplicate pages at the kept page.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Text similarity from which pages are near-duplicates (default: {DEFAULT_THRESHOLD}).")
+    parser.add_argument("--dom-threshold", type=float, default=DEFAULT_DOM_THRESHOLD,
+                        help=f"DOM structure similarity they also need (default: {DEFAULT_DOM_THRESHOLD}).")
+    parser.add_argument("--remove-duplicates", action="store_true",
+                        help="With --mode redirects, also delete the duplicates so later passes and the deploy skip them.")
+    parser.add_argument("--report", help="Also write every duplicate and its canonical page to this CSV file.")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the groups found.")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+    if args.remove_duplicates and args.mode != 'redirects':
+        print("Error: --remove-duplicates needs --mode redirects, or the duplicates' URLs would break.", file=sys.stderr)
+        sys.exit(1)
+
+    candidates = find_candidate_files(args.site_root)
+    print(f"Fingerprinting {len(candidates)} file(s)...")
+    results = run_in_pool(partial(_fingerprint_item, site_root=args.site_root), candidates, args.jobs)
+    fingerprints = {path: fp for path, fp in zip(candidates, results) if fp}
+
+    groups = group_duplicates(fingerprints, args.threshold, args.dom_threshold)
+    duplicate_count = sum(len(duplicates) for _, duplicates in groups)
+    duplicate_bytes = sum(os.path.getsize(os.path.join(args.site_root, *path.split('/')))
+                          for _, duplicates in groups for path, _ in duplicates)
+    for canonical, duplicates in groups:
+        print(f"  {canonical}")
+        for duplicate, reason in duplicates:
+            print(f"    <- {duplicate} [{reason}]")
+    print(f"{len(groups)} group(s), {duplicate_count} duplicate(s), {duplicate_bytes / 1024:.1f} KB.")
+
+    if args.report:
+        write_report(groups, args.report)
+    if args.dry_run or (not groups and args.mode != 'redirects'):
+        return
+
+    if args.mode == 'redirects':
+        write_redirects(args.site_root, redirect_rules(groups))
+        if args.remove_duplicates:
+            for _, duplicates in groups:
+                for duplicate, _ in duplicates:
+                    os.remove(os.path.join(args.site_root, *duplicate.split('/')))
+            print(f"Removed {duplicate_count} duplicate file(s).")
+    else:
+        changed = 0
+        for canonical, duplicates in groups:
+            canonical_url = SITE_ORIGINS[0] + page_url(canonical)
+            for duplicate, _ in duplicates:
+                if duplicate.lower().endswith(HTML_EXTENSIONS):
+                    changed += set_canonical_link(os.path.join(args.site_root, *duplicate.split('/')), canonical_url)
+        print(f"Updated the canonical link of {changed} page(s); non-HTML duplicates need --mode redirects.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+from functools import partial
+
+import lazy
+from parallel import run_in_pool, add_jobs_argument
+from site_paths import resolve_url, site_relative
+
+# Where the original -> fingerprinted path map (and the copies of earlier runs
+# it superseded) is written, outside the publish directory; generate_headers
+# reads it to mark only these files immutable
+FINGERPRINT_MANIFEST = "fingerprints.json"
+
+# Assets that get content-hashed names
+ASSET_EXTENSIONS = ('.css', '.js', '.woff2', '.woff', '.ttf', '.eot', '.otf',
+                    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.svg', '.ico')
+
+# Assets whose own content references other assets (rewritten before hashing)
+TEXT_ASSET_EXTENSIONS = ('.css', '.js')
+
+HASH_LENGTH = 10
+
+# Pre-compressed siblings (see precompress.py) removed along with a superseded copy
+PRECOMPRESSED_SUFFIXES = ('.br', '.gz')
+
+# name.0123456789.ext: already fingerprinted, never hashed again
+HASHED_NAME_PATTERN = re.compile(r'\.[0-9a-f]{%d}\.[A-Za-z0-9]+$' % HASH_LENGTH)
+
+# Any URL-like token ending in an asset extension, in HTML attributes, CSS url()/@import
+# or JS string literals. JSON-escaped slashes (\/) are part of the token.
+# Group 'url': the path up to the extension; group 'query': optional ?query or #fragment
+REFERENCE_PATTERN = re.compile(
+    r'(?P<url>[^\s"\'`()<>,=;{}\[\]]+?\.(?:css|js|woff2?|ttf|eot|otf|png|jpe?g|gif|webp|avif|svg|ico))'
+    r'(?P<query>[?#][^\s"\'`()<>,;\\]*)?'
+    r'(?=[\s"\'`()<>,;]|\\|$)',
+    re.IGNORECASE
+)
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+def fingerprinted_path(path, digest):
+    """style.css -> style.<digest>.css"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{digest}{ext}"
+
+def find_assets(site_root):
+    """Returns the sorted list of not yet fingerprinted assets under site_root."""
+    assets = []
+    for root, _, files in os.walk(site_root):
+        for file_name in files:
+            if file_name.lower().endswith(ASSET_EXTENSIONS) and not HASHED_NAME_PATTERN.search(file_name):
+                assets.append(os.path.join(root, file_name))
+    return sorted(assets)
+
+def resolve_reference(url, file_path, site_root):
+    """
+    Resolves a referenced URL from file_path. Scripts build URLs relative to
+    the page rather than to themselves, so JS falls back to the site root.
+    """
+    local_path = resolve_url(url, file_path, site_root)
+    if (local_path is None or not os.path.isfile(local_path)) and file_path.endswith('.js'):
+        relative = url
+        while relative.startswith(('./', '../')):
+            relative = relative.split('/', 1)[1]
+        local_path = resolve_url('/' + relative.lstrip('/'), file_path, site_root)
+    return local_path
+
+def referenced_assets(text, file_path, site_root):
+    """Returns the set of local files referenced from text (the content of file_path)."""
+    referenced = set()
+    for match in REFERENCE_PATTERN.finditer(text):
+        local_path = resolve_reference(match.group('url'), file_path, site_root)
+        if local_path and os.path.isfile(local_path):
+            referenced.add(os.path.normpath(local_path))
+    return referenced
+
+def rewrite_references(text, file_path, site_root, renamed):
+    """
+    Replaces the file name of every reference to a renamed asset with its
+    fingerprinted name, keeping the rest of the token (directories, origin,
+    escaping, query string) as written. renamed maps normalized local paths
+    to fingerprinted local paths. Returns (new_text, replacements).
+    """
+    replacements = 0
+
+    def replace(match_obj):
+        nonlocal replacements
+        url = match_obj.group('url')
+        local_path = resolve_reference(url, file_path, site_root)
+        target = renamed.get(os.path.normpath(local_path)) if local_path else None
+        if not target:
+            return match_obj.group(0)
+        replacements += 1
+        return url[:url.rfind('/') + 1] + os.path.basename(target) + (match_obj.group('query') or '')
+
+    return REFERENCE_PATTERN.sub(replace, text), replacements
+
+def _text_asset_order(text_assets, site_root):
+    """
+    Orders CSS/JS assets so that every asset comes after the assets it
+    references (e.g. an @import-ed stylesheet before the importing one),
+    since a referrer's hash depends on the fingerprinted names it contains.
+    Reference cycles are broken arbitrarily.
+    """
+    dependencies = {}
+    for path in text_assets:
+        with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            dependencies[path] = referenced_assets(f.read(), path, site_root) & text_assets
+
+    ordered, state = [], {}
+    def visit(path):
+        if state.get(path):
+            return
+        state[path] = 'visiting'
+        for dependency in sorted(dependencies[path]):
+            visit(dependency)
+        state[path] = 'done'
+        ordered.append(path)
+
+    for path in sorted(text_assets):
+        visit(path)
+    return ordered
+
+def fingerprint_assets(site_root):
+    """
+    Writes a content-hashed copy of every asset (binary assets first, then
+    CSS/JS in dependency order with their own references rewritten).
+    Returns the map of normalized original path -> fingerprinted path.
+    """
+    assets = [os.path.normpath(path) for path in find_assets(site_root)]
+    text_assets = {path for path in assets if path.lower().endswith(TEXT_ASSET_EXTENSIONS)}
+    renamed = {}
+
+    for path in assets:
+        if path in text_assets:
+            continue
+        with open(path, 'rb') as f:
+            digest = content_hash(f.read())
+        target = fingerprinted_path(path, digest)
+        if not os.path.exists(target):
+            shutil.copy2(path, target)
+        renamed[path] = target
+
+    for path in _text_asset_order(text_assets, site_root):
+        with open(path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            text, _ = rewrite_references(f.read(), path, site_root, renamed)
+        data = text.encode('utf-8', errors='surrogateescape')
+        target = fingerprinted_path(path, content_hash(data))
+        if not os.path.exists(target):
+            with open(target, 'wb') as f:
+                f.write(data)
+            shutil.copystat(path, target)
+        renamed[path] = target
+
+    return renamed
+
+def superseded_copies(previous, superseded_before, renamed, site_root):
+    """
+    Maps the fingerprinted copies of earlier runs whose original now hashes
+    differently to the current fingerprinted path, so pages still pointing at
+    an old hash can be rewritten. previous is the last run's site-relative
+    original -> fingerprinted map, superseded_before the recorded
+    superseded copy -> original map. Keys and values are normalized local paths.
+    """
+    def local(relative):
+        return os.path.normpath(os.path.join(site_root, *relative.split('/')))
+
+    superseded = {}
+    pairs = [(hashed, original) for original, hashed in previous.items()] + list(superseded_before.items())
+    for hashed, original in pairs:
+        target = renamed.get(local(original))
+        if target and local(hashed) != target:
+            superseded[local(hashed)] = target
+    return superseded
+
+def process_html_file(file_path, site_root, renamed):
+    """Points the references of one page at the fingerprinted assets."""
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            content = f.read()
+        new_content, replacements = rewrite_references(content, file_path, site_root, renamed)
+        if replacements:
+            with open(file_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                f.write(new_content)
+            print(f"Modified: {file_path} ({replacements} reference(s))")
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+
+def load_fingerprints(manifest_path=FINGERPRINT_MANIFEST, section='files'):
+    """
+    Returns the site-relative original -> fingerprinted path map, or {} if
+    there is none. With section='superseded', returns the map of the
+    fingerprinted copies of earlier runs to their original instead.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f).get(section, {})
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Give CSS, JS, fonts and images content-hashed file names and rewrite every reference to them."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--manifest-out", default=FINGERPRINT_MANIFEST,
+                        help=f"Where to write the original -> fingerprinted path map (default: {FINGERPRINT_MANIFEST}).")
+    parser.add_argument("--remove-originals", action="store_true",
+                        help="Delete the original assets once all references were rewritten. By default they are kept, "
+                             "so references built at runtime keep working (with short-lived caching).")
+    parser.add_argument("--remove-superseded", action="store_true",
+                        help="Delete the fingerprinted copies of earlier runs whose original has changed since "
+                             "(and their pre-compressed siblings). By default they are only listed.")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    renamed = fingerprint_assets(args.site_root)
+    print(f"Fingerprinted {len(renamed)} asset(s).")
+
+    # References to the hashed names of earlier runs are moved to the new hashes
+    files = load_fingerprints(args.manifest_out)
+    superseded_before = load_fingerprints(args.manifest_out, 'superseded')
+    superseded = superseded_copies(files, superseded_before, renamed, args.site_root)
+
+    html_files = lazy.find_html_files(args.site_root)
+    run_in_pool(partial(process_html_file, site_root=args.site_root, renamed={**renamed, **superseded}),
+                html_files, args.jobs)
+
+    superseded_names = {site_relative(path, args.site_root) for path in superseded}
+    superseded_before.update({hashed: original for original, hashed in files.items() if hashed in superseded_names})
+    files.update({site_relative(path, args.site_root): site_relative(target, args.site_root)
+                  for path, target in renamed.items()})
+    with open(args.manifest_out, 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'files': dict(sorted(files.items())),
+                   'superseded': dict(sorted(superseded_before.items()))}, f, indent=1)
+    print(f"Wrote {args.manifest_out}")
+
+    stale_copies = [path for path in sorted(superseded) if os.path.exists(path)]
+    if stale_copies and args.remove_superseded:
+        for path in stale_copies:
+            for sibling in [path] + [path + suffix for suffix in PRECOMPRESSED_SUFFIXES]:
+                if os.path.exists(sibling):
+                    os.remove(sibling)
+        print(f"Removed {len(stale_copies)} superseded fingerprinted copy(ies).")
+    elif stale_copies:
+        print(f"{len(stale_copies)} superseded fingerprinted copy(ies) are no longer referenced "
+              f"(rerun with --remove-superseded to delete them):")
+        for path in stale_copies:
+            print(f"  {site_relative(path, args.site_root)}")
+
+    if args.remove_originals:
+        for path in renamed:
+            os.remove(path)
+        print(f"Removed {len(renamed)} original asset(s).")
+
+if __name__ == "__main__":
+    main()
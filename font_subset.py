@@ -0,0 +1,338 @@
+import os
+import re
+import sys
+import argparse
+import posixpath
+from functools import partial
+from bs4 import BeautifulSoup
+
+try:
+    from fontTools import subset as font_subsetter
+except ImportError:  # fontTools is only needed to subset, see main()
+    font_subsetter = None
+
+import lazy
+import css_rules
+import prune_css
+from html_translator import TranslationMemory, DEFAULT_MEMORY_PATH
+from parallel import run_in_pool, add_jobs_argument
+from site_paths import resolve_url, strip_query, site_relative
+
+# Formats fontTools can read and write, with the flavor to save them in
+FONT_FLAVORS = {'.woff2': 'woff2', '.woff': 'woff', '.ttf': None, '.otf': None}
+
+# Subsets are written next to their font as <name>.subset<ext>
+SUBSET_SUFFIX = '.subset'
+
+# Always kept in text fonts: text inserted by scripts or typed into forms
+# is not in the markup (the translations of every locale are added too)
+ALWAYS_KEEP = ''.join(chr(codepoint) for codepoint in range(0x20, 0x7F))
+
+# Netlify headers file, whose font preload Link headers follow the subsets too
+HEADERS_FILE = '_headers'
+
+FONT_FACE_PATTERN = re.compile(r'@font-face\s*\{[^}]*\}', re.IGNORECASE)
+CONTENT_PATTERN = re.compile(r'(?:^|[;{\s])content\s*:([^;}]*)', re.IGNORECASE)
+CSS_STRING_PATTERN = re.compile(r'''(['"])((?:\\.|(?!\1)[^\\])*)\1''', re.DOTALL)
+CSS_ESCAPE_PATTERN = re.compile(r'\\([0-9a-fA-F]{1,6})\s?|\\(.)', re.DOTALL)
+
+LINK_TAG_PATTERN = re.compile(r'<link\b[^>]*>', re.IGNORECASE)
+PRELOAD_REL_PATTERN = re.compile(r'''\brel\s*=\s*["']?preload\b''', re.IGNORECASE)
+FONT_AS_PATTERN = re.compile(r'''\bas\s*=\s*["']?font\b''', re.IGNORECASE)
+HREF_PATTERN = re.compile(r'''(\bhref\s*=\s*)(["']?)([^"'\s>]+)\2''', re.IGNORECASE)
+HEADER_FONT_LINK_PATTERN = re.compile(r'<([^<>\s]+)>(?=;\s*rel=preload;\s*as=font\b)', re.IGNORECASE)
+
+# Attributes whose text is drawn in the page's fonts
+TEXT_ATTRIBUTES = ('placeholder', 'value')
+
+# --- START OF GLYPH COLLECTION ---
+def _unescape_css(text):
+    def replace(match_obj):
+        if match_obj.group(1):
+            codepoint = int(match_obj.group(1), 16)
+            return chr(codepoint) if 0 < codepoint <= 0x10FFFF else ''
+        return '' if match_obj.group(2) == '\n' else match_obj.group(2)
+    return CSS_ESCAPE_PATTERN.sub(replace, text)
+
+def content_characters(declarations):
+    """Returns the characters of the quoted strings in the content: values of a declaration block."""
+    characters = set()
+    for value in CONTENT_PATTERN.findall(declarations):
+        for _, string in CSS_STRING_PATTERN.findall(value):
+            characters.update(_unescape_css(string))
+    return characters
+
+def _style_rules(rules):
+    for rule in rules:
+        if rule['type'] == 'style':
+            yield rule
+        elif rule.get('rules'):
+            yield from _style_rules(rule['rules'])
+
+def used_content_characters(css_text, index, safelist=()):
+    """
+    Returns the characters inserted by content: in the style rules of
+    css_text that may match something on the site, e.g. the codepoints of
+    the icons a page actually uses.
+    """
+    characters = set()
+    for rule in _style_rules(css_rules.parse_stylesheet(css_text)):
+        if 'content' in rule['body'] and any(
+            prune_css.selector_used(selector, index, safelist) for selector in css_rules.split_selectors(rule['selector'])
+        ):
+            characters |= content_characters(rule['body'])
+    return characters
+
+def page_glyphs(file_path):
+    """
+    Returns (characters, inline_css) for one page: every character of its
+    text and text attributes, and the contents of its <style> tags.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    inline_css = [style.string for style in soup.find_all('style') if style.string]
+    for tag in soup.find_all(['script', 'style', 'template']):
+        tag.decompose()
+    characters = set(soup.get_text())
+    for tag in soup.find_all(True):
+        for attribute in TEXT_ATTRIBUTES:
+            if isinstance(tag.get(attribute), str):
+                characters.update(tag[attribute])
+    return characters, inline_css
+
+def translated_characters(memory_path):
+    """Returns the characters of the translations of every locale in the translation memory at memory_path."""
+    if not memory_path or not os.path.exists(memory_path):
+        return set()
+    memory = TranslationMemory(memory_path)
+    try:
+        characters = set()
+        for locale in memory.locales():
+            for translation in memory.translations(locale).values():
+                characters.update(translation)
+        return characters
+    finally:
+        memory.close()
+
+def collect_glyphs(site_root, jobs=None, safelist=(), memory_path=DEFAULT_MEMORY_PATH):
+    """
+    Returns the set of characters the site can draw: the text of every
+    page (in upper and lower case, for text-transform), ALWAYS_KEEP, the
+    translations of every locale (whether or not its pages were generated
+    yet), and the content: characters of the used rules of every stylesheet
+    and inline <style>.
+    """
+    html_files = lazy.find_html_files(site_root)
+    index = prune_css.build_selector_index(site_root, jobs)
+    characters = set(ALWAYS_KEEP) | translated_characters(memory_path)
+    css_texts = []
+    for result in run_in_pool(page_glyphs, html_files, jobs):
+        if result:
+            page_characters, inline_css = result
+            characters |= page_characters
+            css_texts.extend(inline_css)
+    css_texts.extend(css_rules.read_stylesheet(path) for path in prune_css.find_stylesheets(site_root))
+
+    for css_text in css_texts:
+        characters |= used_content_characters(css_text, index, safelist)
+    characters |= {variant for character in characters for variant in (character.upper(), character.lower())
+                   if len(variant) == 1}
+    return {character for character in characters if ord(character) >= 0x20}
+# --- END OF GLYPH COLLECTION ---
+
+
+# --- START OF SUBSETTING ---
+def subset_path_for(font_path):
+    stem, extension = os.path.splitext(font_path)
+    return f"{stem}{SUBSET_SUFFIX}{extension}"
+
+def find_fonts(site_root):
+    """Returns the sorted list of subsettable fonts under site_root (not the subsets themselves)."""
+    return sorted(
+        os.path.join(root, file_name)
+        for root, _, files in os.walk(site_root)
+        for file_name in files
+        if os.path.splitext(file_name)[1].lower() in FONT_FLAVORS
+        and not os.path.splitext(file_name)[0].endswith(SUBSET_SUFFIX)
+    )
+
+def subset_font(font_path, codepoints):
+    """
+    Writes the subset of font_path holding only the given codepoints next
+    to it, in the same format. The subset is removed again if it is not
+    smaller. Returns (font_bytes, subset_bytes, kept).
+    """
+    options = font_subsetter.Options()
+    options.flavor = FONT_FLAVORS[os.path.splitext(font_path)[1].lower()]
+    options.layout_features = ['*']
+    options.notdef_outline = True
+    options.ignore_missing_unicodes = True
+
+    font = font_subsetter.load_font(font_path, options)
+    try:
+        subsetter = font_subsetter.Subsetter(options)
+        subsetter.populate(unicodes=codepoints)
+        subsetter.subset(font)
+        subset_path = subset_path_for(font_path)
+        tmp_path = f"{subset_path}.{os.getpid()}.tmp"
+        font_subsetter.save_font(font, tmp_path, options)
+        os.replace(tmp_path, subset_path)
+    finally:
+        font.close()
+
+    font_bytes, subset_bytes = os.path.getsize(font_path), os.path.getsize(subset_path)
+    if subset_bytes >= font_bytes:
+        os.remove(subset_path)
+        return font_bytes, subset_bytes, False
+    return font_bytes, subset_bytes, True
+# --- END OF SUBSETTING ---
+
+
+# --- START OF @FONT-FACE REWRITING ---
+def subset_url_for(url, file_path, site_root, subsets):
+    """Returns url (found in file_path) pointed at the subset of its font, or None if the font has none in subsets."""
+    local_path = resolve_url(url, file_path, site_root)
+    if local_path is None or os.path.normpath(local_path) not in subsets:
+        return None
+    path = strip_query(url)
+    return posixpath.join(posixpath.dirname(path), os.path.basename(subset_path_for(local_path))) + url[len(path):]
+
+def rewrite_font_faces(text, file_path, site_root, subsets):
+    """
+    Points the url()s of the @font-face rules in text (a stylesheet or a
+    page, found at file_path) at the subsets of the fonts in subsets, and
+    adds font-display: swap to the rules that don't set font-display.
+    Returns (new_text, number_of_urls_rewritten).
+    """
+    rewritten = 0
+
+    def replace_url(match_obj):
+        nonlocal rewritten
+        quote, url = match_obj.group(1), match_obj.group(2)
+        subset_url = subset_url_for(url, file_path, site_root, subsets)
+        if subset_url is None:
+            return match_obj.group(0)
+        rewritten += 1
+        return f"url({quote}{subset_url}{quote})"
+
+    def replace_rule(match_obj):
+        rule = css_rules.CSS_URL_PATTERN.sub(replace_url, match_obj.group(0))
+        if not re.search(r'font-display\s*:', rule, re.IGNORECASE):
+            rule = rule[:-1].rstrip().rstrip(';') + ';font-display:swap}'
+        return rule
+
+    return FONT_FACE_PATTERN.sub(replace_rule, text), rewritten
+
+def rewrite_font_preloads(text, file_path, site_root, subsets):
+    """
+    Points the <link rel="preload" as="font"> tags of a page, or the font
+    preload Link headers of a _headers file, at the subsets of the fonts in
+    subsets, so the preloaded file is the one @font-face asks for.
+    Returns (new_text, number_of_urls_rewritten).
+    """
+    rewritten = 0
+
+    def replace_header_link(match_obj):
+        nonlocal rewritten
+        subset_url = subset_url_for(match_obj.group(1), file_path, site_root, subsets)
+        if subset_url is None:
+            return match_obj.group(0)
+        rewritten += 1
+        return f"<{subset_url}>"
+
+    def replace_href(match_obj):
+        nonlocal rewritten
+        subset_url = subset_url_for(match_obj.group(3), file_path, site_root, subsets)
+        if subset_url is None:
+            return match_obj.group(0)
+        rewritten += 1
+        return f"{match_obj.group(1)}{match_obj.group(2)}{subset_url}{match_obj.group(2)}"
+
+    def replace_link(match_obj):
+        tag = match_obj.group(0)
+        if PRELOAD_REL_PATTERN.search(tag) and FONT_AS_PATTERN.search(tag):
+            return HREF_PATTERN.sub(replace_href, tag, count=1)
+        return tag
+
+    if os.path.basename(file_path) == HEADERS_FILE:
+        return HEADER_FONT_LINK_PATTERN.sub(replace_header_link, text), rewritten
+    return LINK_TAG_PATTERN.sub(replace_link, text), rewritten
+
+def rewrite_file(file_path, site_root, subsets):
+    """
+    Rewrites the @font-face rules and font preloads of one stylesheet, page
+    or _headers file in place. Returns the urls rewritten.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    new_text, rewritten = text, 0
+    if '@font-face' in text:
+        new_text, rewritten = rewrite_font_faces(new_text, file_path, site_root, subsets)
+    if 'font' in text:
+        new_text, preloads = rewrite_font_preloads(new_text, file_path, site_root, subsets)
+        rewritten += preloads
+    if new_text != text:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(new_text)
+        print(f"Modified: {file_path} ({rewritten} font url(s) rewritten)")
+    return rewritten
+# --- END OF @FONT-FACE REWRITING ---
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Subset every local font to the characters and icons the site uses and point @font-face at the subsets."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--keep", default="", metavar="TEXT",
+                        help="Extra characters to keep in every subset (e.g. for text only scripts insert).")
+    parser.add_argument("--safelist", action="append", default=[], metavar="REGEX",
+                        help="Treat classes and ids matching this pattern as used (repeatable), e.g. for icons added at runtime.")
+    parser.add_argument("--memory", default=DEFAULT_MEMORY_PATH,
+                        help=f"Translation memory whose translations are kept in every subset (default: {DEFAULT_MEMORY_PATH}).")
+    parser.add_argument("--no-rewrite", action="store_true",
+                        help="Only write the subsets, do not rewrite @font-face rules and font preloads.")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if font_subsetter is None:
+        print("Error: fontTools is required (pip install fonttools).", file=sys.stderr)
+        sys.exit(1)
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    safelist = [re.compile(pattern) for pattern in args.safelist]
+    characters = collect_glyphs(args.site_root, args.jobs, safelist, args.memory) | set(args.keep)
+    codepoints = sorted(ord(character) for character in characters)
+    print(f"Collected {len(codepoints)} codepoint(s) used on the site.")
+
+    fonts = find_fonts(args.site_root)
+    results = run_in_pool(partial(subset_font, codepoints=codepoints), fonts, args.jobs)
+    subsets = set()
+    total_font, total_subset = 0, 0
+    for font_path, result in zip(fonts, results):
+        if not result:
+            continue
+        font_bytes, subset_bytes, kept = result
+        print(f"  {site_relative(font_path, args.site_root)}: {font_bytes / 1024:.1f} KB -> {subset_bytes / 1024:.1f} KB"
+              + ("" if kept else " (not smaller, kept the full font)"))
+        total_font += font_bytes
+        total_subset += subset_bytes if kept else font_bytes
+        if kept:
+            subsets.add(os.path.normpath(font_path))
+    if total_font:
+        print(f"\nSubset {len(subsets)} of {len(fonts)} font(s): {total_font / 1024:.1f} KB -> {total_subset / 1024:.1f} KB "
+              f"({(total_font - total_subset) / total_font * 100:.0f}% removed).")
+
+    if not args.no_rewrite:
+        print("\nRewriting @font-face rules and font preloads...")
+        targets = prune_css.find_stylesheets(args.site_root) + lazy.find_html_files(args.site_root)
+        headers_path = os.path.join(args.site_root, HEADERS_FILE)
+        if os.path.isfile(headers_path):
+            targets.append(headers_path)
+        rewritten = run_in_pool(partial(rewrite_file, site_root=args.site_root, subsets=subsets), targets, args.jobs)
+        print(f"Rewrote {sum(filter(None, rewritten))} font url(s).")
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,32 @@
 import os
 import re
 from collections import defaultdict
+from functools import lru_cache
+from bs4 import BeautifulSoup
+
+import lazy
+import css_rules
+import critical_css
+from add_preconnect import font_face_url
+from build_manifest import file_hash
+from parallel import run_in_pool
+from site_paths import resolve_url, strip_query, site_relative, page_url
+from fingerprint_assets import FINGERPRINT_MANIFEST, load_fingerprints
 
 # Base directory to scan
 BASE_DIR = "evolves/www.evolves.tech"
 
 # File extensions and their cache settings
 CACHE_SETTINGS = {
-    # Static assets that rarely change - long cache
+    # Static assets that rarely change, but may under the same name - longer cache, then revalidate
     'long': {
-        'extensions': ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.eot', '.otf'],
-        'cache_control': 'public, max-age=31536000, immutable'  # 1 year
+        'extensions': ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.eot', '.otf'],
+        'cache_control': 'public, max-age=86400, must-revalidate'  # 1 day
     },
-    # Code assets that might change with each deployment - use cache busting
+    # Code assets that might change with each deployment under the same name - revalidate
     'code': {
         'extensions': ['.css', '.js', '.json'],
-        'cache_control': 'public, max-age=31536000, immutable'  # 1 year (assuming cache busting)
+        'cache_control': 'public, max-age=3600, must-revalidate'  # 1 hour
     },
     # HTML and XML - short cache with revalidation
     'content': {
@@ -25,26 +36,288 @@ CACHE_SETTINGS = {
     }
 }
 
-# Default headers for all paths
+# Files with a content hash in their name (written by fingerprint_assets.py) never change
+FINGERPRINTED_CACHE_CONTROL = 'public, max-age=31536000, immutable'  # 1 year
+
+# Pre-compressed siblings written by precompress.py (e.g. style.css.br)
+PRECOMPRESSED_ENCODINGS = {
+    '.br': 'br',
+    '.gz': 'gzip'
+}
+
+# Content types of the files that may have pre-compressed siblings
+CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.htm': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+    '.svg': 'image/svg+xml'
+}
+
+# Per-page Link preload headers (sent by the edge as 103 Early Hints).
+# Only the first few blocking stylesheets are hinted; the rest would compete
+# with the HTML itself for bandwidth
+MAX_PRELOAD_STYLESHEETS = 8
+
+# Stylesheet media values that block rendering on every device
+BLOCKING_MEDIA = (None, '', 'all', 'screen')
+
+# Fonts past the first few compete with the stylesheets for the first round trips
+MAX_PRELOAD_FONTS = 4
+
+# Declarations deciding which web font an element renders with; custom
+# properties are kept when their name mentions fonts (Elementor's
+# --e-global-typography-*-font-family/-font-weight)
+FONT_DECLARATION_PATTERN = re.compile(r'^\s*(font-family|font-weight|font|--[\w-]*font[\w-]*)\s*:(.*)$',
+                                      re.IGNORECASE | re.DOTALL)
+CSS_VAR_PATTERN = re.compile(r'var\(\s*(--[\w-]+)\s*(?:,([^()]*))?\)')
+# The family list of the font shorthand follows its size (and /line-height)
+FONT_SHORTHAND_FAMILY_PATTERN = re.compile(r'(?:^|\s)[\d.]+[a-z%]*(?:\s*/\s*[\w.%-]+)?\s+(.+)$', re.IGNORECASE)
+FONT_WEIGHT_NAMES = {'normal': 400, 'bold': 700}
+
+# Default headers for all paths. Netlify applies every rule matching a
+# path, so a Cache-Control here would be added to every file's own; files no
+# rule below matches get Netlify's default (max-age=0, must-revalidate)
 DEFAULT_HEADERS = """/*
-  Cache-Control: max-age=3600, must-revalidate
   X-Content-Type-Options: nosniff
   X-Frame-Options: DENY
   X-XSS-Protection: 1; mode=block
 """
 
-# Default "no cache" rule for anything not matched
-DEFAULT_NO_CACHE = """# Default for anything not matched: no cache, to be safe
-/*
-  Cache-Control: no-cache, no-store, must-revalidate
-  Pragma: no-cache
-  Expires: 0
-"""
+# --- START OF PRELOAD HEADERS ---
+def _root_relative(url, file_path):
+    """Returns url as a root-relative path (query kept) if it is a local file, else None."""
+    local_path = resolve_url(url, file_path, BASE_DIR)
+    if not local_path or not os.path.isfile(local_path):
+        return None
+    return "/" + site_relative(local_path, BASE_DIR) + url.strip()[len(strip_query(url.strip())):]
+
+def _root_relative_srcset(srcset, file_path):
+    candidates = []
+    for candidate in srcset.split(','):
+        parts = candidate.split()
+        url = _root_relative(parts[0], file_path) if parts else None
+        if not url:
+            return None
+        candidates.append(" ".join([url] + parts[1:]))
+    return ", ".join(candidates)
+
+def _image_link(tag, file_path, srcset_attr, sizes_attr):
+    url = _root_relative(tag.get('href') or tag.get('src') or '', file_path)
+    srcset = _root_relative_srcset(tag[srcset_attr], file_path) if tag.get(srcset_attr) else None
+    if not url and srcset:
+        # A Link header needs a URL; browsers without imagesrcset support fetch it
+        url = srcset.split(',')[0].split()[0]
+    if not url:
+        return None
+    link = f"<{url}>; rel=preload; as=image"
+    if srcset:
+        link += f'; imagesrcset="{srcset}"'
+        if tag.get(sizes_attr):
+            link += f'; imagesizes="{tag[sizes_attr]}"'
+    return link
+
+def _declarations(body):
+    """Returns the font-related (name, value) declarations of a rule body."""
+    declarations = []
+    for declaration in body.split(';'):
+        match = FONT_DECLARATION_PATTERN.match(declaration)
+        if match:
+            # Custom property names are case-sensitive, the others are not
+            name = match.group(1) if match.group(1).startswith('--') else match.group(1).lower()
+            value = re.sub(r'!\s*important\s*$', '', match.group(2).strip(), flags=re.IGNORECASE).strip()
+            declarations.append((name, value))
+    return declarations
+
+def _font_weight(value):
+    value = (value or '').strip().lower()
+    return FONT_WEIGHT_NAMES.get(value, int(value) if value.isdigit() else None)
+
+def font_rules(css_text, referrer_path):
+    """
+    Returns (style_rules, faces) of CSS text taken from referrer_path (the
+    stylesheet, or the page for inline CSS): the [(selectors, declarations)]
+    of the style rules setting fonts or font variables, in any @media, and
+    the [(family, (min_weight, max_weight), url)] of its @font-face rules,
+    with url root-relative.
+    """
+    style_rules, faces = [], []
+    def visit(rules):
+        for rule in rules:
+            if 'rules' in rule:
+                visit(rule['rules'])
+            elif rule['type'] == 'style' and 'font' in rule['body']:
+                declarations = _declarations(rule['body'])
+                if declarations:
+                    style_rules.append((css_rules.split_selectors(rule['selector']), declarations))
+            elif rule.get('keyword') == 'font-face' and rule['body']:
+                descriptors = dict(_declarations(rule['body']))
+                url = font_face_url(rule['body'])
+                url = _root_relative(url, referrer_path) if url else None
+                family = descriptors.get('font-family', '').strip('\'" ').lower()
+                weights = [_font_weight(weight) for weight in descriptors.get('font-weight', 'normal').split()]
+                weights = [weight for weight in weights if weight] or [400]
+                if url and family:
+                    faces.append((family, (weights[0], weights[-1]), url))
+    visit(css_rules.parse_stylesheet(css_text))
+    return style_rules, faces
+
+@lru_cache(maxsize=None)
+def _stylesheet_font_rules(path, digest):
+    return font_rules(css_rules.read_stylesheet(path), path)
+
+def _resolve_vars(value, variables, depth=5):
+    """Substitutes var(--name, fallback) references from variables."""
+    for _ in range(depth):
+        if 'var(' not in value:
+            break
+        value = CSS_VAR_PATTERN.sub(lambda m: variables.get(m.group(1), m.group(2) or ''), value)
+    return value
+
+def fold_fonts(soup, file_path):
+    """
+    Returns the root-relative URLs of the web fonts the above-the-fold
+    elements of a page render with: the @font-face sources, in the page's
+    inline and blocking stylesheets, of the first family with a web font in
+    each font-family (or font) declaration whose selector matches above the
+    fold, at the declared weight (custom properties resolved the same way).
+    """
+    matcher = critical_css.FoldMatcher(lazy.fold_elements(soup))
+    style_rules, faces = [], []
+    for tag in soup.find_all(['link', 'style']):
+        if tag.find_parent('noscript'):
+            continue
+        if tag.name == 'style':
+            rules = font_rules(tag.string or '', file_path)
+        elif 'stylesheet' in (tag.get('rel') or []) and tag.get('media') in BLOCKING_MEDIA:
+            local_path = resolve_url(tag.get('href') or '', file_path, BASE_DIR)
+            if not local_path or not os.path.isfile(local_path):
+                continue
+            rules = _stylesheet_font_rules(local_path, file_hash(local_path))
+        else:
+            continue
+        style_rules.extend(rules[0])
+        faces.extend(rules[1])
+    if not faces:
+        return []
+
+    variables, used = {}, []
+    for selectors, declarations in style_rules:
+        if not any(matcher.matches(selector) for selector in selectors):
+            continue
+        for name, value in declarations:
+            if name.startswith('--'):
+                variables[name] = value
+            else:
+                used.append((name, value, dict(declarations).get('font-weight')))
+
+    families = {family for family, _, _ in faces}
+    urls = []
+    for name, value, weight in used:
+        value = _resolve_vars(value, variables)
+        if name == 'font':
+            match = FONT_SHORTHAND_FAMILY_PATTERN.search(value)
+            value = match.group(1) if match else ''
+        elif name != 'font-family':
+            continue
+        family = next((family for family in (part.strip('\'" ').lower() for part in value.split(','))
+                       if family in families), None)
+        if not family:
+            continue
+        weight = _font_weight(_resolve_vars(weight, variables) if weight else None) or 400
+        family_faces = [face for face in faces if face[0] == family]
+        matching = [url for _, (low, high), url in family_faces if low <= weight <= high]
+        urls.extend(matching or [family_faces[0][2]])
+    return list(dict.fromkeys(urls))[:MAX_PRELOAD_FONTS]
+
+def page_preloads(file_path):
+    """
+    Returns the Link header values for the render-critical resources of one
+    page: its blocking stylesheets, the web fonts used above the fold (or,
+    failing those, the fonts it already preloads), and the image it
+    preloads or else the <img fetchpriority="high"> LCP candidate.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    head = soup.head or soup
+    links = []
+
+    stylesheets = []
+    for tag in head.find_all('link', rel='stylesheet'):
+        url = _root_relative(tag.get('href') or '', file_path)
+        if url and tag.get('media') in BLOCKING_MEDIA and url not in stylesheets:
+            stylesheets.append(url)
+    links.extend(f"<{url}>; rel=preload; as=style" for url in stylesheets[:MAX_PRELOAD_STYLESHEETS])
+
+    preloaded_fonts, image_link = [], None
+    for tag in head.find_all('link', rel='preload'):
+        if tag.get('as') == 'font':
+            url = _root_relative(tag.get('href') or '', file_path)
+            if url:
+                preloaded_fonts.append(url)
+        elif tag.get('as') == 'image' and not image_link:
+            image_link = _image_link(tag, file_path, 'imagesrcset', 'imagesizes')
+
+    fonts = fold_fonts(soup, file_path) or preloaded_fonts
+    links.extend(f"<{url}>; rel=preload; as=font; crossorigin" for url in fonts)
+
+    if not image_link:
+        img = soup.find('img', fetchpriority='high')
+        if img:
+            image_link = _image_link(img, file_path, 'srcset', 'sizes')
+    if image_link:
+        links.append(image_link)
+
+    return list(dict.fromkeys(links))
+# --- END OF PRELOAD HEADERS ---
+
+
+def glob_is_safe(rel_path, suffix, hashed_paths):
+    """
+    True if the /<rel_path>/*<suffix> glob matches none of the fingerprinted
+    paths. Netlify applies every rule matching a path, so a fingerprinted
+    file under such a glob would get both Cache-Control values.
+    """
+    prefix = f"/{rel_path}/" if rel_path else "/"
+    return not any(path.startswith(prefix) and path.endswith(suffix) for path in hashed_paths)
+
+def cache_rule_paths(rel_path, suffix, file_names, hashed_paths):
+    """
+    Returns the _headers paths for the unhashed files of one directory
+    ending in suffix: a single glob where that is safe, else one exact path
+    per file.
+    """
+    if glob_is_safe(rel_path, suffix, hashed_paths):
+        return [f"/{rel_path}/*{suffix}" if rel_path else f"/*{suffix}"]
+    return [f"/{rel_path}/{name}" if rel_path else f"/{name}" for name in file_names]
+
+def without_covered_globs(paths):
+    """
+    Drops the /<dir>/*<suffix> globs a glob of a parent directory already
+    covers: Netlify's * also matches "/", and the headers of every matching
+    rule are combined, so each file would get the Cache-Control value twice.
+    """
+    globs = {path for path in paths if '/*' in path}
+    def covered(path):
+        directory, separator, suffix = path.rpartition('/*')
+        while separator and directory:
+            directory = directory.rpartition('/')[0]
+            if f"{directory}/*{suffix}" in globs:
+                return True
+        return False
+    return [path for path in paths if not covered(path)]
 
 def generate_headers_file():
     """Scan directory and generate _headers file with appropriate caching rules."""
-    # Dictionary to store all found paths by cache type
-    found_paths = defaultdict(set)
+    # (cache category, directory, extension) -> unhashed file names
+    found_files = defaultdict(list)
+    # (directory, original extension, sibling extension) -> unhashed pre-compressed file names
+    precompressed_files = defaultdict(list)
+    # Exact paths of fingerprinted files and of their pre-compressed siblings
+    fingerprinted = set(load_fingerprints(FINGERPRINT_MANIFEST).values()) | set(load_fingerprints(FINGERPRINT_MANIFEST, 'superseded'))
+    fingerprinted_paths = set()
+    fingerprinted_precompressed = {}
     
     # Check if base directory exists
     if not os.path.exists(BASE_DIR):
@@ -53,6 +326,7 @@ def generate_headers_file():
     
     # Walk through all directories and files
     for root, dirs, files in os.walk(BASE_DIR):
+        dirs.sort()
         rel_path = os.path.relpath(root, BASE_DIR)
         if rel_path == ".":
             rel_path = ""
@@ -61,38 +335,104 @@ def generate_headers_file():
         rel_path = rel_path.replace("\\", "/")
         
         # Process each file
-        for file in files:
+        for file in sorted(files):
             _, ext = os.path.splitext(file)
             ext = ext.lower()
+            file_path = f"{rel_path}/{file}" if rel_path else file
+
+            # Pre-compressed sibling: keyed on the extension of the original
+            if ext in PRECOMPRESSED_ENCODINGS:
+                original_ext = os.path.splitext(file[:-len(ext)])[1].lower()
+                if original_ext in CONTENT_TYPES:
+                    if file_path[:-len(ext)] in fingerprinted:
+                        fingerprinted_precompressed[f"/{file_path}"] = (PRECOMPRESSED_ENCODINGS[ext], original_ext)
+                    else:
+                        precompressed_files[(rel_path, original_ext, ext)].append(file)
+                continue
+
+            # Fingerprinted file: gets its own immutable rule
+            if file_path in fingerprinted:
+                fingerprinted_paths.add(f"/{file_path}")
+                continue
             
             # Determine cache category
-            cache_category = None
             for category, settings in CACHE_SETTINGS.items():
                 if ext in settings['extensions']:
-                    cache_category = category
+                    found_files[(category, rel_path, ext)].append(file)
                     break
-            
-            if cache_category:
-                # Create the relative path pattern
-                if rel_path:
-                    path_pattern = f"/{rel_path}/*.{ext[1:]}"
-                else:
-                    path_pattern = f"/*.{ext[1:]}"
-                
-                found_paths[cache_category].add(path_pattern)
     
     # Generate the _headers file content
     headers_content = [DEFAULT_HEADERS]
     
-    # Add rules for each category
+    # Add rules for each category; globs are replaced by exact paths where
+    # they would also match fingerprinted files
+    rule_count = 0
     for category, settings in CACHE_SETTINGS.items():
-        paths = sorted(found_paths[category])
+        paths = without_covered_globs(sorted({
+            path
+            for (file_category, rel_path, ext), file_names in found_files.items() if file_category == category
+            for path in cache_rule_paths(rel_path, ext, file_names, fingerprinted_paths)
+        }))
         if paths:
             headers_content.append(f"# Cache {category} files")
             for path in paths:
                 headers_content.append(f"{path}")
                 headers_content.append(f"  Cache-Control: {settings['cache_control']}")
             headers_content.append("")
+            rule_count += len(paths)
+    
+    # Add rules for fingerprinted files; no other Cache-Control rule matches them
+    if fingerprinted_paths:
+        headers_content.append("# Fingerprinted (content-hashed) files")
+        for path in sorted(fingerprinted_paths):
+            headers_content.append(path)
+            headers_content.append(f"  Cache-Control: {FINGERPRINTED_CACHE_CONTROL}")
+        headers_content.append("")
+    
+    # Add rules for pre-compressed siblings: they must be served with the
+    # encoding and type of the original, and every variant varies on Accept-Encoding
+    precompressed_paths = {}
+    for (rel_path, original_ext, ext), file_names in precompressed_files.items():
+        hashed_siblings = {path for path in fingerprinted_precompressed if path.endswith(ext)}
+        for path in cache_rule_paths(rel_path, f"{original_ext}{ext}", file_names, hashed_siblings):
+            cache_control = next(
+                (settings['cache_control'] for settings in CACHE_SETTINGS.values() if original_ext in settings['extensions']),
+                None
+            )
+            precompressed_paths[path] = (PRECOMPRESSED_ENCODINGS[ext], original_ext, cache_control)
+    for path, (encoding, original_ext) in fingerprinted_precompressed.items():
+        precompressed_paths[path] = (encoding, original_ext, FINGERPRINTED_CACHE_CONTROL)
+    precompressed_paths = {path: precompressed_paths[path] for path in without_covered_globs(list(precompressed_paths))}
+    if precompressed_paths:
+        headers_content.append("# Pre-compressed files")
+        original_paths = without_covered_globs(sorted({os.path.splitext(path)[0] for path in precompressed_paths}))
+        for path in original_paths:
+            headers_content.append(path)
+            headers_content.append("  Vary: Accept-Encoding")
+        for path in sorted(precompressed_paths):
+            encoding, original_ext, cache_control = precompressed_paths[path]
+            headers_content.append(path)
+            headers_content.append(f"  Content-Encoding: {encoding}")
+            headers_content.append(f"  Content-Type: {CONTENT_TYPES[original_ext]}")
+            headers_content.append("  Vary: Accept-Encoding")
+            if cache_control:
+                headers_content.append(f"  Cache-Control: {cache_control}")
+        headers_content.append("")
+    
+    # Add per-page preload hints for the edge's 103 Early Hints
+    html_files = lazy.find_html_files(BASE_DIR)
+    page_links = run_in_pool(page_preloads, html_files)
+    routes = {}
+    for file_path, links in zip(html_files, page_links):
+        if links:
+            routes.setdefault(page_url(site_relative(file_path, BASE_DIR)), links)
+    if routes:
+        headers_content.append("# Preload render-critical resources (Early Hints)")
+        for route in sorted(routes):
+            headers_content.append(route)
+            for link in routes[route]:
+                headers_content.append(f"  Link: {link}")
+        headers_content.append("")
     
     # Add Netlify's immutable assets rules
     headers_content.append("# Netlify's immutable assets (often hashed)")
@@ -102,15 +442,14 @@ def generate_headers_file():
     headers_content.append("  Cache-Control: public, max-age=31536000, immutable")
     headers_content.append("")
     
-    # Add default "no cache" rule
-    headers_content.append(DEFAULT_NO_CACHE)
-    
     # Write to _headers file in the publish directory
     headers_file_path = os.path.join(BASE_DIR, "_headers")
     with open(headers_file_path, "w") as f:
         f.write("\n".join(headers_content))
     
-    print(f"Generated _headers file in {headers_file_path} with {sum(len(paths) for paths in found_paths.values())} cache rules.")
+    print(f"Generated _headers file in {headers_file_path} with {rule_count} cache rules, "
+          f"{len(fingerprinted_paths)} fingerprinted file rules, {len(precompressed_paths)} pre-compressed file rules "
+          f"and {len(routes)} page preload rules.")
 
 if __name__ == "__main__":
     generate_headers_file() 
\ No newline at end of file
@@ -1,6 +1,18 @@
 from bs4 import BeautifulSoup, NavigableString
+from bs4.element import PreformattedString
 import os
 import re # Import the regular expression module
+import sys
+import hashlib
+import sqlite3
+import argparse
+
+import lazy
+from parallel import run_in_pool, add_jobs_argument
+from build_manifest import file_hash
+
+# Text inside these tags is never translated
+IGNORE_TAGS = ['script', 'style', 'head', 'title', 'meta', '[document]']
 
 def clean_internal_spacing(text):
     """Replaces multiple whitespace characters with a single space."""
@@ -10,31 +22,24 @@ def clean_internal_spacing(text):
         return text.strip() # Also strip leading/trailing again after cleaning
     return text
 
-def extract_texts_for_translation(html_filepath, output_text_filepath):
+# Marks the text slots while a page template is serialized; private-use
+# code points, so the formatter leaves them alone and pages don't contain them
+SLOT_START = ''
+SLOT_END = ''
+SLOT_PATTERN = re.compile(SLOT_START + r'(\d+)' + SLOT_END)
+
+def collect_text_nodes(soup):
     """
-    Extracts visible text from an HTML file, cleans internal spacing,
-    and saves it for translation.
-    Returns a list of (NavigableString_object, original_full_text_of_node, cleaned_stripped_text_of_node)
-    and a list of unique cleaned stripped texts that were written to the file.
+    Returns the translatable text nodes of a parsed document, in order, as
+    (NavigableString_object, original_full_text_of_node, cleaned_stripped_text_of_node).
+    Whitespace-only nodes, comments, doctypes and text inside IGNORE_TAGS
+    are skipped.
     """
-    try:
-        with open(html_filepath, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-    except FileNotFoundError:
-        print(f"Error: HTML file not found at {html_filepath}")
-        return None, None
-
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    ignore_tags = ['script', 'style', 'head', 'title', 'meta', '[document]']
-    
-    text_nodes_info = [] # To store (NavigableString_object, original_full_text_of_node, cleaned_stripped_text_of_node)
-    all_cleaned_stripped_texts_in_order = [] # Stores cleaned text for each node, in order of appearance
-
+    text_nodes_info = []
     for string_node in soup.find_all(string=True):
-        if string_node.parent.name in ignore_tags:
+        if string_node.parent.name in IGNORE_TAGS or isinstance(string_node, PreformattedString):
             continue
-        
+
         original_full_text_of_node = str(string_node)
         stripped_text = original_full_text_of_node.strip() # Initial strip
 
@@ -46,35 +51,147 @@ def extract_texts_for_translation(html_filepath, output_text_filepath):
 
         if not cleaned_stripped_text_of_node: # Skip if it becomes empty after internal cleaning
             continue
-        
+
         text_nodes_info.append((string_node, original_full_text_of_node, cleaned_stripped_text_of_node))
-        all_cleaned_stripped_texts_in_order.append(cleaned_stripped_text_of_node)
+    return text_nodes_info
+
+def node_anchor(node):
+    """
+    Returns a stable anchor for a node: the child indexes leading to it from
+    the document root, e.g. '1/3/0'. _anchor_with_hash() appends the short
+    hash of its text that locate_anchor() checks ('1/3/0:9f2c01ab').
+    """
+    path = []
+    while node.parent is not None:
+        # By identity: equal strings compare equal, so list.index() could pick a sibling
+        path.append(next(i for i, child in enumerate(node.parent.contents) if child is node))
+        node = node.parent
+    return '/'.join(str(i) for i in reversed(path))
+
+def _anchor_with_hash(node, text):
+    return f"{node_anchor(node)}:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:8]}"
+
+def locate_anchor(soup, anchor):
+    """Returns the text node of soup at anchor, or None if the tree or the text differs."""
+    path, _, text_hash = anchor.rpartition(':')
+    node = soup
+    for index in path.split('/') if path else []:
+        contents = getattr(node, 'contents', None)
+        if contents is None or int(index) >= len(contents):
+            return None
+        node = contents[int(index)]
+    if not isinstance(node, NavigableString) or hashlib.sha256(str(node).encode('utf-8')).hexdigest()[:8] != text_hash:
+        return None
+    return node
+
+def with_original_spacing(original_full_text_of_node, translated_text_core):
+    """Wraps a translation in the leading and trailing whitespace of the text it replaces."""
+    stripped = original_full_text_of_node.strip()
+    if not stripped:
+        return translated_text_core
+    start_index = original_full_text_of_node.index(stripped[0])
+    end_index = len(original_full_text_of_node.rstrip())
+    return original_full_text_of_node[:start_index] + translated_text_core + original_full_text_of_node[end_index:]
+
+
+class PageTemplate:
+    """
+    A page parsed once and serialized around its translatable text nodes.
+
+    pieces holds the serialized HTML between the nodes (one more piece
+    than there are slots); slots holds (anchor, original_full_text,
+    cleaned_stripped_text) per node, in document order. render() joins
+    them with translated texts, so any number of locales is produced from
+    one parse without walking or re-parsing the tree.
+    """
+
+    def __init__(self, soup):
+        nodes = collect_text_nodes(soup)
+        self.slots = [(_anchor_with_hash(node, original), original, cleaned) for node, original, cleaned in nodes]
+        markers = []
+        for i, (node, _, _) in enumerate(nodes):
+            marker = NavigableString(f"{SLOT_START}{i}{SLOT_END}")
+            node.replace_with(marker)
+            markers.append(marker)
+        serialized = str(soup)
+        for marker, (node, _, _) in zip(markers, nodes):
+            marker.replace_with(node)  # The caller gets its tree back unchanged
+        parts = SLOT_PATTERN.split(serialized)
+        self.pieces = parts[0::2]
+        if [int(i) for i in parts[1::2]] != list(range(len(nodes))):
+            raise ValueError("The page already contains the private-use characters marking text slots.")
+
+    @classmethod
+    def from_file(cls, html_filepath):
+        with open(html_filepath, 'r', encoding='utf-8') as f:
+            return cls(BeautifulSoup(f.read(), 'html.parser'))
+
+    def texts(self):
+        """The cleaned text of every slot, in order."""
+        return [cleaned for _, _, cleaned in self.slots]
+
+    def render(self, translation_map):
+        """
+        Returns the page with every slot whose cleaned text is in
+        translation_map replaced, keeping the node's surrounding whitespace.
+        """
+        output = [self.pieces[0]]
+        for (_, original, cleaned), piece in zip(self.slots, self.pieces[1:]):
+            translated = translation_map.get(cleaned)
+            text = original if translated is None else with_original_spacing(original, translated)
+            output.append(NavigableString(text).output_ready())
+            output.append(piece)
+        return ''.join(output)
+
+    def patch(self, soup, translation_map):
+        """
+        Applies translation_map to another parse of the same page (e.g. a
+        tree a pipeline stage already holds), finding each node by its
+        anchor. Returns (replaced, not found).
+        """
+        replaced = missing = 0
+        for anchor, original, cleaned in self.slots:
+            if cleaned not in translation_map:
+                continue
+            node = locate_anchor(soup, anchor)
+            if node is None:
+                missing += 1
+                continue
+            node.replace_with(NavigableString(with_original_spacing(original, translation_map[cleaned])))
+            replaced += 1
+        return replaced, missing
+
+
+def extract_texts_for_translation(html_filepath, output_text_filepath):
+    """
+    Extracts visible text from an HTML file, cleans internal spacing,
+    and saves it for translation.
+    Returns the PageTemplate of the file (its slots hold every occurrence)
+    and a list of unique cleaned stripped texts that were written to the file.
+    """
+    try:
+        template = PageTemplate.from_file(html_filepath)
+    except FileNotFoundError:
+        print(f"Error: HTML file not found at {html_filepath}")
+        return None, None
 
     # Create a list of unique texts to write to the file, preserving order of first appearance
-    unique_cleaned_texts_for_file = []
-    seen_texts = set()
-    for text in all_cleaned_stripped_texts_in_order:
-        if text not in seen_texts:
-            unique_cleaned_texts_for_file.append(text)
-            seen_texts.add(text)
-    
+    unique_cleaned_texts_for_file = list(dict.fromkeys(template.texts()))
+
     with open(output_text_filepath, 'w', encoding='utf-8') as f:
         for text in unique_cleaned_texts_for_file:
             f.write(text + '\n')
             
     print(f"Extracted {len(unique_cleaned_texts_for_file)} unique text segments to {output_text_filepath}")
-    # text_nodes_info contains all nodes.
-    # unique_cleaned_texts_for_file is what's in the translation file.
-    return text_nodes_info, unique_cleaned_texts_for_file
+    return template, unique_cleaned_texts_for_file
 
 
-def apply_translations_to_html(original_html_filepath, translated_text_filepath, 
-                               output_html_filepath, text_nodes_info, 
+def apply_translations_to_html(template, translated_text_filepath, output_html_filepath,
                                original_unique_cleaned_stripped_texts):
     """
     Applies translated texts back into the HTML structure.
     original_unique_cleaned_stripped_texts are the unique texts that were written to the translation file.
-    text_nodes_info contains (node_object, original_full_text_of_node, cleaned_stripped_text_of_node) for ALL occurrences.
+    template is the PageTemplate returned by extract_texts_for_translation; the page is not parsed again.
     """
     try:
         with open(translated_text_filepath, 'r', encoding='utf-8') as f:
@@ -89,112 +206,187 @@ def apply_translations_to_html(original_html_filepath, translated_text_filepath,
         return
 
     # Create a mapping from the original cleaned & stripped unique text to its translation
-    translation_map = {}
-    for i, original_text in enumerate(original_unique_cleaned_stripped_texts):
-        translation_map[original_text] = translated_lines[i]
+    translation_map = dict(zip(original_unique_cleaned_stripped_texts, translated_lines))
 
-    # --- IMPORTANT: Re-parse the HTML to get a fresh soup object for modification ---
-    # This avoids issues with modifying a soup object that might have been altered
-    # or whose node references are stale.
-    try:
-        with open(original_html_filepath, 'r', encoding='utf-8') as f:
-            fresh_html_content = f.read()
-        current_soup = BeautifulSoup(fresh_html_content, 'html.parser')
-    except FileNotFoundError:
-        print(f"Error: Original HTML file not found at {original_html_filepath} during re-parse.")
-        return
-    # --- End of re-parse ---
+    with open(output_html_filepath, 'w', encoding='utf-8') as f:
+        f.write(template.render(translation_map))
+    replaced_count = sum(1 for text in template.texts() if text in translation_map)
+    print(f"Created translated HTML file: {output_html_filepath} ({replaced_count} text nodes replaced)")
 
-    replaced_count = 0
-    
-    # We need to find the nodes in the *current_soup* that correspond to text_nodes_info.
-    # This is the most complex part. The original text_nodes_info contains direct references
-    # to nodes in the *first* soup object. These references are not valid for current_soup.
-    # We will iterate through current_soup and try to match based on original content.
-
-    current_text_nodes_in_fresh_soup = []
-    for string_node in current_soup.find_all(string=True):
-        if string_node.parent.name in ['script', 'style', 'head', 'title', 'meta', '[document]']:
-            continue
-        original_full_text = str(string_node)
-        stripped_text = original_full_text.strip()
-        if not stripped_text:
-            continue
-        cleaned_stripped_text = clean_internal_spacing(stripped_text)
-        if not cleaned_stripped_text:
-            continue
-        current_text_nodes_in_fresh_soup.append(
-            (string_node, original_full_text, cleaned_stripped_text)
-        )
-    
-    # Now, iterate through these found nodes and replace them
-    # This assumes the order of text nodes found in fresh_soup is the same as initially extracted.
-    # This is generally true for static HTML unless the parser behaves very differently.
-
-    if len(current_text_nodes_in_fresh_soup) != len(text_nodes_info):
-        print(f"Warning: Number of text nodes re-identified ({len(current_text_nodes_in_fresh_soup)}) "
-              f"differs from initially extracted ({len(text_nodes_info)}). "
-              "This might lead to incorrect replacements. Proceeding with caution.")
-        # Heuristic: if significantly different, maybe abort or use a more complex matching.
-        # For now, we'll try to proceed, but it's a potential issue.
-
-    for node_to_replace_fresh, original_full_text_of_node, cleaned_stripped_text_of_node in current_text_nodes_in_fresh_soup:
-        if cleaned_stripped_text_of_node in translation_map:
-            translated_text_core = translation_map[cleaned_stripped_text_of_node]
-            
-            # Attempt to preserve original leading/trailing whitespace from the *full original text of this node*
-            try:
-                start_index = -1
-                for i_char, char_val in enumerate(original_full_text_of_node):
-                    if not char_val.isspace():
-                        start_index = i_char
-                        break
-                
-                end_index = -1
-                for i_char, char_val in enumerate(reversed(original_full_text_of_node)):
-                    if not char_val.isspace():
-                        end_index = len(original_full_text_of_node) - 1 - i_char
-                        break
-
-                if start_index != -1 and end_index != -1 and start_index <= end_index :
-                    leading_ws = original_full_text_of_node[:start_index]
-                    trailing_ws = original_full_text_of_node[end_index+1:]
-                    new_full_text_for_node = leading_ws + translated_text_core + trailing_ws
-                elif start_index == -1: # Original was all whitespace (should have been skipped earlier)
-                    new_full_text_for_node = translated_text_core # Should not happen if pre-filtered
-                else: # Fallback for unusual cases
-                    new_full_text_for_node = translated_text_core
-
-            except Exception as e_ws:
-                print(f"Warning: Could not robustly re-apply whitespace for '{cleaned_stripped_text_of_node[:30]}...'. Using translated text directly. Error: {e_ws}")
-                new_full_text_for_node = translated_text_core
-
-            try:
-                if node_to_replace_fresh.parent: 
-                    node_to_replace_fresh.replace_with(NavigableString(new_full_text_for_node))
-                    replaced_count += 1
-                else:
-                    print(f"Warning: Node for '{cleaned_stripped_text_of_node[:30]}...' (original: '{original_full_text_of_node[:30]}...') is detached in fresh soup. Skipping.")
-            except Exception as e_replace:
-                print(f"Error replacing node for '{cleaned_stripped_text_of_node[:30]}...': {e_replace}")
+
+# --- START OF TRANSLATION MEMORY ---
+# Default translation memory location (kept outside the publish directory so it is never deployed)
+DEFAULT_MEMORY_PATH = ".translation-memory.sqlite"
+
+# SQLite's limit on the parameters of one statement is 999 in older builds
+LOOKUP_CHUNK_SIZE = 500
+
+def segment_key(text):
+    """Returns the hash a segment is stored under: of its text with whitespace collapsed."""
+    return hashlib.sha256(clean_internal_spacing(text).encode('utf-8')).hexdigest()
+
+
+class TranslationMemory:
+    """
+    SQLite store of translated segments, keyed by (segment hash, locale),
+    so a segment is translated once for the whole site and every later run.
+
+    It also keeps the segments last extracted from each page with the
+    page's content hash, so pages that didn't change are not parsed again.
+    """
+
+    def __init__(self, memory_path=DEFAULT_MEMORY_PATH):
+        self.memory_path = memory_path
+        self.connection = sqlite3.connect(memory_path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS segments (
+                segment_hash TEXT NOT NULL,
+                locale TEXT NOT NULL,
+                source TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                PRIMARY KEY (segment_hash, locale)
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                path TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                segments TEXT NOT NULL
+            );
+        """)
+
+    def lookup(self, texts, locale):
+        """Returns {text: translation} for the texts already translated to locale."""
+        keys = {segment_key(text): text for text in texts}
+        hashes = list(keys)
+        translations = {}
+        for start in range(0, len(hashes), LOOKUP_CHUNK_SIZE):
+            chunk = hashes[start:start + LOOKUP_CHUNK_SIZE]
+            rows = self.connection.execute(
+                f"SELECT segment_hash, translation FROM segments WHERE locale = ? "
+                f"AND segment_hash IN ({', '.join('?' * len(chunk))})",
+                [locale] + chunk
+            )
+            for segment_hash, translation in rows:
+                translations[keys[segment_hash]] = translation
+        return translations
+
+    def add(self, pairs, locale):
+        """Stores (source text, translation) pairs for locale, replacing earlier translations."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO segments (segment_hash, locale, source, translation) VALUES (?, ?, ?, ?)",
+                [(segment_key(source), locale, clean_internal_spacing(source), translation)
+                 for source, translation in pairs]
+            )
+
+    def translations(self, locale):
+        """Returns {source text: translation} for every segment translated to locale."""
+        return dict(self.connection.execute("SELECT source, translation FROM segments WHERE locale = ?", (locale,)))
+
+    def locales(self):
+        """The locales the memory holds translations for."""
+        return sorted(row[0] for row in self.connection.execute("SELECT DISTINCT locale FROM segments"))
+
+    def cached_segments(self, html_filepath, content_hash):
+        """The segments extracted from a page, or None if it changed since (or was never seen)."""
+        row = self.connection.execute(
+            "SELECT content_hash, segments FROM pages WHERE path = ?", (os.path.abspath(html_filepath),)
+        ).fetchone()
+        if row is None or row[0] != content_hash:
+            return None
+        # Segments never contain newlines (clean_internal_spacing collapses them)
+        return row[1].split('\n') if row[1] else []
+
+    def store_segments(self, html_filepath, content_hash, segments):
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages (path, content_hash, segments) VALUES (?, ?, ?)",
+                (os.path.abspath(html_filepath), content_hash, '\n'.join(segments))
+            )
+
+    def close(self):
+        self.connection.close()
+# --- END OF TRANSLATION MEMORY ---
+
+
+# --- START OF BATCH MODE ---
+def extract_page_segments(html_filepath):
+    """Returns the cleaned text segments of one page in order of appearance, repeats included."""
+    with open(html_filepath, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    return [cleaned for _, _, cleaned in collect_text_nodes(soup)]
+
+def extract_site_segments(site_root, memory, jobs=None):
+    """
+    Returns {page: [segments]} for every page under site_root. Pages are
+    parsed in parallel, and only those whose content changed since the
+    memory last saw them.
+    """
+    html_files = lazy.find_html_files(site_root)
+    page_segments, stale = {}, []
+    for html_filepath in html_files:
+        content_hash = file_hash(html_filepath)
+        segments = memory.cached_segments(html_filepath, content_hash)
+        if segments is None:
+            stale.append((html_filepath, content_hash))
         else:
-            # This means a text node was found in the HTML that wasn't in the original unique list.
-            # This could happen if the HTML structure is very dynamic or if our cleaning/uniqueness logic had an edge case.
-            # Or, more likely, if the text content itself is not what we expected for matching.
-            # For robustness, it's usually okay to leave these untranslated if no map entry exists.
-            pass # print(f"Debug: No translation map entry for cleaned text: '{cleaned_stripped_text_of_node[:50]}...'")
+            page_segments[html_filepath] = segments
 
+    results = run_in_pool(extract_page_segments, [html_filepath for html_filepath, _ in stale], jobs)
+    for (html_filepath, content_hash), segments in zip(stale, results):
+        if segments is not None:
+            memory.store_segments(html_filepath, content_hash, segments)
+            page_segments[html_filepath] = segments
+    print(f"Extracted text from {len(stale)} page(s); {len(html_files) - len(stale)} unchanged since the last run.")
+    return {html_filepath: page_segments[html_filepath] for html_filepath in html_files if html_filepath in page_segments}
 
-    expected_replacements = sum(1 for _, _, cleaned_text_orig in text_nodes_info if cleaned_text_orig in translation_map)
-    if replaced_count == 0 and expected_replacements > 0:
-         print("Critical Warning: No text nodes were replaced, but translations were expected. "
-               "This indicates a fundamental issue with re-identifying nodes for replacement.")
-    elif replaced_count < expected_replacements:
-        print(f"Warning: Not all expected text nodes were replaced. Expected (approx based on initial scan) {expected_replacements}, actually replaced {replaced_count}.")
+def write_pending_segments(page_segments, memory, locale, output_text_filepath):
+    """
+    Writes every segment of the site the memory has no translation of in
+    locale yet, once, one per line, most repeated first (menus, header and
+    footer). Returns the list of segments written.
+    """
+    counts = {}
+    for segments in page_segments.values():
+        for text in segments:
+            counts[text] = counts.get(text, 0) + 1
+    known = memory.lookup(counts, locale)
+    # sorted() is stable, so segments repeated equally often keep their order of first appearance
+    pending = sorted((text for text in counts if text not in known), key=lambda text: -counts[text])
 
-    with open(output_html_filepath, 'w', encoding='utf-8') as f:
-        f.write(str(current_soup)) # Use the modified current_soup
-    print(f"Created translated HTML file: {output_html_filepath}")
+    with open(output_text_filepath, 'w', encoding='utf-8') as f:
+        for text in pending:
+            f.write(text + '\n')
+
+    print(f"{sum(counts.values())} text segments on {len(page_segments)} page(s), {len(counts)} unique; "
+          f"{len(known)} already translated to '{locale}'.")
+    print(f"Wrote {len(pending)} segment(s) still to translate to {output_text_filepath}")
+    return pending
+
+def import_translations(memory, locale, original_text_filepath, translated_text_filepath):
+    """
+    Stores each line of translated_text_filepath as the locale translation
+    of the same line of original_text_filepath (as written by
+    write_pending_segments). Returns the number of segments stored.
+    """
+    try:
+        with open(original_text_filepath, 'r', encoding='utf-8') as f:
+            original_lines = [line.strip() for line in f.readlines()]
+        with open(translated_text_filepath, 'r', encoding='utf-8') as f:
+            translated_lines = [line.strip() for line in f.readlines()]
+    except FileNotFoundError as e:
+        print(f"Error: {e.filename} not found.")
+        return 0
+
+    if len(translated_lines) != len(original_lines):
+        print(f"Error: Mismatch in number of text segments. Original texts: {len(original_lines)}, Translated lines: {len(translated_lines)}")
+        print("Please ensure each line in the translated file corresponds to a line in the original text file.")
+        return 0
+
+    pairs = [(original, translated) for original, translated in zip(original_lines, translated_lines) if original and translated]
+    memory.add(pairs, locale)
+    print(f"Stored {len(pairs)} '{locale}' translation(s) from {translated_text_filepath} in {memory.memory_path}")
+    return len(pairs)
+# --- END OF BATCH MODE ---
 
 
 # --- Configuration ---
@@ -203,14 +395,14 @@ TEXT_FOR_TRANSLATION_FILE = 'texts_to_translate.txt'
 TRANSLATED_TEXT_FILE = 'translated_texts.txt' # You'll create this file
 OUTPUT_HTML_FILE = 'translated_index.html'
 
-def main():
+def translate_single_file():
     # --- Part 1: Extract texts ---
     print(f"Step 1: Extracting texts from {INPUT_HTML_FILE}...")
-    # `nodes_info_initial_scan` contains (node_ref, original_full, cleaned_stripped) from the first parse
+    # `template` is the page parsed once, with an anchored slot per text node
     # `unique_original_texts` is the list of unique cleaned texts written to the translation file
-    nodes_info_initial_scan, unique_original_texts = extract_texts_for_translation(INPUT_HTML_FILE, TEXT_FOR_TRANSLATION_FILE)
+    template, unique_original_texts = extract_texts_for_translation(INPUT_HTML_FILE, TEXT_FOR_TRANSLATION_FILE)
     
-    if nodes_info_initial_scan is None:
+    if template is None:
         return
 
     print(f"\nTexts extracted to '{TEXT_FOR_TRANSLATION_FILE}'.")
@@ -227,13 +419,58 @@ def main():
 
     print(f"\nStep 2: Applying translations from '{TRANSLATED_TEXT_FILE}' to create '{OUTPUT_HTML_FILE}'...")
     apply_translations_to_html(
-        INPUT_HTML_FILE, 
+        template, # The page as parsed in step 1
         TRANSLATED_TEXT_FILE, 
         OUTPUT_HTML_FILE,
-        nodes_info_initial_scan, # Pass the node info from the initial scan
         unique_original_texts # Pass the unique texts that were translated
     )
     print("\nProcess complete.")
 
+def translate_site(args):
+    memory = TranslationMemory(args.memory)
+    try:
+        if args.import_translations:
+            import_translations(memory, args.locale, args.pending_file, args.translated_file)
+        page_segments = extract_site_segments(args.batch, memory, args.jobs)
+        pending = write_pending_segments(page_segments, memory, args.locale, args.pending_file)
+    finally:
+        memory.close()
+    if pending:
+        print(f"\nTranslate '{args.pending_file}' line by line into '{args.translated_file}', "
+              f"then run again with --import-translations.")
+    else:
+        print(f"\nEvery segment of the site has a '{args.locale}' translation.")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"Extract the visible text of HTML pages for translation. Without --batch, translates "
+                    f"{INPUT_HTML_FILE} interactively."
+    )
+    parser.add_argument("--batch", metavar="SITE_ROOT",
+                        help="Extract the text of every page under SITE_ROOT and list only the segments "
+                             "the translation memory has no translation of yet.")
+    parser.add_argument("--locale", help="Target locale of the translations, e.g. bg (required with --batch).")
+    parser.add_argument("--memory", default=DEFAULT_MEMORY_PATH,
+                        help=f"SQLite translation memory (default: {DEFAULT_MEMORY_PATH}).")
+    parser.add_argument("--import-translations", action="store_true",
+                        help="First store the lines of --translated-file as translations of the lines of --pending-file.")
+    parser.add_argument("--pending-file", default=TEXT_FOR_TRANSLATION_FILE,
+                        help=f"Where segments still to translate are written (default: {TEXT_FOR_TRANSLATION_FILE}).")
+    parser.add_argument("--translated-file", default=TRANSLATED_TEXT_FILE,
+                        help=f"Translations of --pending-file, line by line (default: {TRANSLATED_TEXT_FILE}).")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if not args.batch:
+        translate_single_file()
+        return
+    if not os.path.isdir(args.batch):
+        print(f"Error: The path '{args.batch}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+    if not args.locale:
+        print("Error: --batch needs a target --locale.", file=sys.stderr)
+        sys.exit(1)
+    translate_site(args)
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,40 @@
+import re
+from functools import lru_cache
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow only SVG sizes can be read
+    Image = None
+
+SVG_ROOT_PATTERN = re.compile(r'<svg\b[^>]*>', re.IGNORECASE | re.DOTALL)
+SVG_LENGTH_PATTERN = r'\b{}\s*=\s*["\']\s*([\d.]+)\s*(?:px)?\s*["\']'
+SVG_VIEWBOX_PATTERN = re.compile(r'\bviewBox\s*=\s*["\']\s*[-\d.]+[\s,]+[-\d.]+[\s,]+([\d.]+)[\s,]+([\d.]+)\s*["\']', re.IGNORECASE)
+
+def _svg_size(path):
+    """Reads the size of an SVG from its root width/height, or else its viewBox."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        match = SVG_ROOT_PATTERN.search(f.read(16384))
+    if not match:
+        return None
+    root = match.group(0)
+    width = re.search(SVG_LENGTH_PATTERN.format('width'), root)
+    height = re.search(SVG_LENGTH_PATTERN.format('height'), root)
+    if width and height:
+        return round(float(width.group(1))), round(float(height.group(1)))
+    viewbox = SVG_VIEWBOX_PATTERN.search(root)
+    if viewbox:
+        return round(float(viewbox.group(1))), round(float(viewbox.group(2)))
+    return None
+
+@lru_cache(maxsize=None)
+def image_size(path):
+    """Returns (width, height) of a local image, or None if it can't be read."""
+    try:
+        if path.lower().endswith('.svg'):
+            return _svg_size(path)
+        if Image is None:
+            return None
+        with Image.open(path) as image:
+            return image.size
+    except (IOError, OSError, ValueError):
+        return None
@@ -1,9 +1,51 @@
 import os
+import re
+import csv
+import sys
 import argparse
 import minify_html
+from functools import partial
 from bs4 import BeautifulSoup
-import cssmin
-import jsmin
+from parallel import add_jobs_argument
+from build_manifest import run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from site_paths import resolve_url, site_relative
+from prefilter import partition_files, print_skipped, without_noscript
+import image_dimensions
+import script_scheduler
+
+# The fold ends this many elements after the first <h1> or
+# <img fetchpriority="high"> (which sit in the first screen of every template);
+# without either, it is the first FOLD_ELEMENT_COUNT elements of <body>
+FOLD_MARGIN_ELEMENTS = 150
+FOLD_ELEMENT_COUNT = 600
+
+# Set on the image classify_images() itself marks fetchpriority="high", so
+# later runs don't take it for a fold marker of the source and move the fold
+LCP_MARKER_ATTRIBUTE = 'data-lcp'
+
+# Smallest rendered area (in CSS pixels) for an image to be the LCP candidate;
+# logos and icons are never the largest paint
+MIN_LCP_AREA = 200 * 200
+
+# Work left on a page with an image, inline style or script (see
+# prefilter.py): it isn't minified yet (minify-html drops the optional
+# </head> and </body> end tags), or it has an <img> without a loading
+# attribute and no image classify_images() marked. minify-html also drops
+# loading="eager" as the default, so only the lazy and LCP marks survive a run
+OPTIMIZABLE_PATTERN = re.compile(rb'<(?:img|style|script)\b', re.IGNORECASE)
+UNMINIFIED_PATTERN = re.compile(rb'</(?:head|body)\s*>', re.IGNORECASE)
+UNMARKED_IMG_PATTERN = re.compile(rb'<img\b(?![^>]*\bloading\s*=)', re.IGNORECASE)
+MARKED_IMG_PATTERN = re.compile(rb'''<img\b[^>]*\b(?:loading\s*=\s*["']?lazy|fetchpriority\s*=)''', re.IGNORECASE)
+
+def _has_lazy_work(data, file_path, site_root):
+    if OPTIMIZABLE_PATTERN.search(data) is None:
+        return False
+    if UNMINIFIED_PATTERN.search(data) is not None:
+        return True
+    data = without_noscript(data)
+    return UNMARKED_IMG_PATTERN.search(data) is not None and MARKED_IMG_PATTERN.search(data) is None
+
+LAZY_TRIGGER = _has_lazy_work
 
 def find_html_files(folder_path):
     """
@@ -14,64 +56,209 @@ def find_html_files(folder_path):
         for file in files:
             if file.endswith(".html") or file.endswith(".htm"):
                 html_files.append(os.path.join(root, file))
-    return html_files
+    return sorted(html_files)
+
+def fold_elements(soup, margin=FOLD_MARGIN_ELEMENTS):
+    """Returns the <html> and <body> tags plus the body elements above the fold, in document order."""
+    body = soup.body or soup
+    elements = body.find_all(True)
+    markers = [i for i, element in enumerate(elements)
+               if element.name == 'h1' or (element.name == 'img' and element.get('fetchpriority') == 'high'
+                                           and not element.has_attr(LCP_MARKER_ATTRIBUTE))]
+    count = markers[0] + margin if markers else FOLD_ELEMENT_COUNT
+    roots = [tag for tag in (soup.find('html'), soup.body) if tag is not None]
+    return roots + elements[:count]
+
+# --- START OF IMAGE LOADING ---
+def _dimension(value):
+    value = str(value or '').strip().lower()
+    if value.endswith('px'):
+        value = value[:-2]
+    return int(value) if value.isdigit() else None
 
-def optimize_html_file(file_path):
+def add_intrinsic_dimensions(img, local_path):
     """
-    Optimizes the given HTML file by minifying its content, adding lazy loading to images,
-    minifying inline CSS and JS, and deferring external scripts.
+    Sets missing width/height attributes from the image file (keeping its
+    aspect ratio if one of them is given), so the browser can reserve the
+    space before the image loads. Images sized in other units
+    (width="100%") are left as they are. Returns (width, height) as
+    rendered, if known.
+    """
+    if any(img.get(attribute) and _dimension(img[attribute]) is None for attribute in ('width', 'height')):
+        return None
+    width, height = _dimension(img.get('width')), _dimension(img.get('height'))
+    size = image_dimensions.image_size(local_path) if local_path and os.path.isfile(local_path) else None
+    if size and size[0] and size[1] and not (width and height):
+        if width:
+            height = round(width * size[1] / size[0])
+        elif height:
+            width = round(height * size[0] / size[1])
+        else:
+            width, height = size
+        img['width'], img['height'] = str(width), str(height)
+    return (width, height) if width and height else None
+
+def classify_images(soup, file_path=None, site_root=None, fold_margin=FOLD_MARGIN_ELEMENTS):
+    """
+    Sorts the <img> tags of a page into the LCP candidate, other
+    above-the-fold images and images below the fold, and sets their loading
+    attributes accordingly: fetchpriority="high" and eager loading for the
+    LCP candidate, no lazy loading above the fold, loading="lazy" below it.
+    The LCP candidate is an image already marked fetchpriority="high", or
+    else the largest non-SVG image above the fold; the latter also gets
+    LCP_MARKER_ATTRIBUTE, so it doesn't count as a fold marker on later runs.
+    Returns report rows of (src, position, classification, width, height).
+    """
+    fold = {id(element) for element in fold_elements(soup, fold_margin)}
+    images = [img for img in soup.find_all("img") if not img.find_parent("noscript")]
+
+    sizes = []
+    for img in images:
+        local_path = resolve_url(img.get("src") or "", file_path, site_root) if file_path and site_root else None
+        sizes.append(add_intrinsic_dimensions(img, local_path))
+
+    above = [i for i, img in enumerate(images) if id(img) in fold]
+    lcp = next((i for i in above if images[i].get("fetchpriority") == "high"), None)
+    chosen = lcp is None
+    if chosen:
+        candidates = [
+            i for i in above
+            if sizes[i] and sizes[i][0] * sizes[i][1] >= MIN_LCP_AREA
+            and not (images[i].get("src") or "").lower().split("?")[0].endswith(".svg")
+        ]
+        lcp = max(candidates, key=lambda i: sizes[i][0] * sizes[i][1], default=None)
+
+    rows = []
+    for i, img in enumerate(images):
+        if i == lcp:
+            img["fetchpriority"] = "high"
+            img["loading"] = "eager"
+            if chosen:
+                img[LCP_MARKER_ATTRIBUTE] = ""
+            classification = "lcp"
+        elif i in above:
+            if img.get("loading") == "lazy":
+                del img["loading"]
+            classification = "eager"
+        else:
+            img["loading"] = "lazy"
+            classification = "lazy"
+        width, height = sizes[i] or (None, None)
+        rows.append((img.get("src", "N/A"), i, classification, width, height))
+    return rows
+# --- END OF IMAGE LOADING ---
+
+def optimize_soup(soup, file_path=None, site_root=None, fold_margin=FOLD_MARGIN_ELEMENTS,
+                  delay_third_party=False, report=None):
+    """
+    Sets fold-aware image loading and schedules scripts on an already
+    parsed document; inline CSS and JS are left to minify_document().
+    With file_path and site_root, missing image dimensions are read from
+    the local files and local scripts are analysed for the globals they define.
+    The image and script rows are appended to report['images'] and
+    report['scripts'], if given.
+    Always returns True, as every document is rewritten.
+    """
+    # 1. Image Optimization: eager above the fold, lazy below it
+    rows = classify_images(soup, file_path, site_root, fold_margin)
+    for src, _, classification, width, height in rows:
+        if classification != "lazy":
+            print(f"  [{classification}] {src}" + (f" ({width}x{height})" if width else ""))
+    lazy_count = sum(1 for row in rows if row[2] == "lazy")
+    if lazy_count:
+        print(f"  [lazy] {lazy_count} image(s) below the fold")
+    if report is not None:
+        report['images'].extend(rows)
+
+    # 2. Inline CSS and JS are minified with the whole document by
+    # minify_document(); running cssmin and jsmin over them first broke
+    # calc() and, on re-runs, the template literals minify-html writes
+
+    # Defer external scripts together with the inline scripts that need them
+    script_rows = script_scheduler.schedule_scripts(soup, file_path, site_root, delay_third_party)
+    for label, mode, reason in script_rows:
+        if mode != "inline" or reason:
+            print(f"  Script [{mode}] {label}" + (f" ({reason})" if reason else ""))
+    if report is not None:
+        report['scripts'].extend(script_rows)
+
+    return True
+
+def minify_document(html_content):
+    """
+    Minifies the whole HTML structure using minify-html.
+    """
+    return minify_html.minify(html_content,
+                              minify_css=True,
+                              minify_js=True)
+
+def optimize_html_file(file_path, site_root=None, fold_margin=FOLD_MARGIN_ELEMENTS, delay_third_party=False):
+    """
+    Optimizes the given HTML file by setting fold-aware image loading,
+    scheduling scripts and minifying the whole document, inline CSS and JS included.
+    Returns (file_path, {'images': rows, 'scripts': rows}), or None on errors.
     """
     print(f"Optimizing {file_path}...")
+    report = {'images': [], 'scripts': []}
     try:
         with open(file_path, "r", encoding="utf-8") as f:
             html_content = f.read()
 
         soup = BeautifulSoup(html_content, "html.parser")
-
-        # 1. Image Optimization: Add loading="lazy" to all img tags
-        for img_tag in soup.find_all("img"):
-            img_tag["loading"] = "lazy"
-            print(f"  Added loading='lazy' to image: {img_tag.get('src', 'N/A')}")
-
-        # 2. CSS Optimization: Minify content of <style> tags
-        for style_tag in soup.find_all("style"):
-            if style_tag.string:
-                minified_css = cssmin.cssmin(style_tag.string)
-                style_tag.string = minified_css
-                print("  Minified inline CSS in <style> tag.")
-
-        # 3. JavaScript Optimization:
-        # Minify inline JS in <script> tags (not having a 'src' attribute)
-        for script_tag in soup.find_all("script"):
-            if script_tag.string and not script_tag.has_attr("src"):
-                try:
-                    minified_js = jsmin.jsmin(script_tag.string)
-                    script_tag.string = minified_js
-                    print("  Minified inline JavaScript in <script> tag.")
-                except Exception as e:
-                    print(f"  Could not minify inline script: {e}")
-            # Add defer to external scripts if not already async or defer
-            elif script_tag.has_attr("src") and not (script_tag.has_attr("async") or script_tag.has_attr("defer")):
-                script_tag["defer"] = True
-                print(f"  Added defer to script: {script_tag['src']}")
+        optimize_soup(soup, file_path, site_root, fold_margin, delay_third_party, report=report)
 
         # Get the modified HTML from BeautifulSoup
         optimized_html_content = str(soup)
 
         # Minify the whole HTML structure using minify-html
-        final_minified_html = minify_html.minify(optimized_html_content.encode('utf-8'), 
-                                                minify_css=True, 
-                                                minify_js=True).decode('utf-8')
+        final_minified_html = minify_document(optimized_html_content)
 
         with open(file_path, "w", encoding="utf-8") as f:
             f.write(final_minified_html)
         print(f"Successfully optimized and minified {file_path}")
     except Exception as e:
         print(f"Error optimizing {file_path}: {e}")
+        return None
+    return file_path, report
+
+def write_image_report(results, site_root, report_path):
+    """Writes the image classification of every processed page as CSV."""
+    with open(report_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["page", "image", "position", "classification", "width", "height"])
+        for file_path, report in filter(None, results):
+            for src, position, classification, width, height in report['images']:
+                writer.writerow([site_relative(file_path, site_root), src, position, classification, width or "", height or ""])
+    print(f"Wrote image classification report to {report_path}")
+
+def write_script_report(results, site_root, report_path):
+    """Writes the final loading mode of every script of every processed page as CSV."""
+    with open(report_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["page", "script", "mode", "reason"])
+        for file_path, report in filter(None, results):
+            for label, mode, reason in report['scripts']:
+                writer.writerow([site_relative(file_path, site_root), label, mode, reason])
+    print(f"Wrote script schedule report to {report_path}")
 
 def main():
     parser = argparse.ArgumentParser(description="Find and optimize WordPress HTML files in a folder.")
     parser.add_argument("folder", help="The path to the folder to scan.")
+    parser.add_argument(
+        "--fold-margin",
+        type=int,
+        default=FOLD_MARGIN_ELEMENTS,
+        help=f"Number of elements after the first <h1> still treated as above the fold (default: {FOLD_MARGIN_ELEMENTS})."
+    )
+    parser.add_argument("--report", help="Also write the per-page image classification to this CSV file.")
+    parser.add_argument("--script-report", help="Also write every script's final loading mode to this CSV file.")
+    parser.add_argument(
+        "--delay-third-party",
+        action="store_true",
+        help="Run third-party scripts (and inline scripts needing them) on the first user interaction."
+    )
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
     args = parser.parse_args()
 
     if not os.path.isdir(args.folder):
@@ -87,7 +274,17 @@ def main():
     print(f"Found {len(html_files)} HTML file(s):")
     for f_path in html_files:
         print(f" - {f_path}")
-        optimize_html_file(f_path)
+    html_files, skipped = partition_files(html_files, LAZY_TRIGGER, args.folder)
+    print_skipped(len(skipped), len(html_files) + len(skipped), "HTML file(s)")
+    results = run_incremental(partial(optimize_html_file, site_root=args.folder, fold_margin=args.fold_margin,
+                                      delay_third_party=args.delay_third_party),
+                              html_files, args.jobs, manifest_from_args(args), 'lazy',
+                              tool_version(sys.modules[__name__], image_dimensions, script_scheduler),
+                              config={'fold_margin': args.fold_margin, 'delay_third_party': args.delay_third_party})
+    if args.report:
+        write_image_report(results, args.folder, args.report)
+    if args.script_report:
+        write_script_report(results, args.folder, args.script_report)
 
     print("\nOptimization process complete.")
 
@@ -0,0 +1,196 @@
+import os
+import re
+import sys
+import argparse
+from functools import partial
+from bs4 import BeautifulSoup
+
+import lazy
+import css_rules
+from html_translator import PageTemplate, TranslationMemory, DEFAULT_MEMORY_PATH
+from parallel import run_in_pool, add_jobs_argument
+from site_paths import SITE_ORIGINS, resolve_url, site_relative, page_url
+
+# Language of the mirrored pages, used for their own hreflang alternate
+DEFAULT_SOURCE_LOCALE = "en"
+
+# Attributes holding URLs that must keep pointing at the shared assets
+# once a page is copied one directory down, into its locale directory
+URL_ATTRIBUTES = ('href', 'src', 'data-src', 'poster')
+SRCSET_ATTRIBUTES = ('srcset', 'data-srcset')
+
+HTML_EXTENSIONS = ('.html', '.htm')
+HTML_LANG_PATTERN = re.compile(r'(<html\b[^>]*?\blang=)(["\']?)[^"\'\s>]*\2', re.IGNORECASE)
+
+# --- START OF PAGE TEMPLATES ---
+def _relocate_asset_url(url, page_path, site_root, target_path):
+    """
+    Returns url, taken from page_path, rewritten relative to target_path if
+    it is a relative link to an existing asset. Links to pages are left as
+    they are, so they lead to the page of the same locale.
+    """
+    url = (url or '').strip()
+    if not url or url.startswith(('/', '#')) or re.match(r'[a-zA-Z][\w+.-]*:', url):
+        return url
+    local_path = resolve_url(url, page_path, site_root)
+    if not local_path or not os.path.isfile(local_path) or local_path.lower().endswith(HTML_EXTENSIONS):
+        return url
+    query = url[len(url.split('?', 1)[0].split('#', 1)[0]):]
+    return os.path.relpath(local_path, os.path.dirname(target_path)).replace(os.sep, '/') + query
+
+def relocate_assets(soup, page_path, site_root, target_path):
+    """
+    Rewrites the relative asset URLs of a page (attributes, srcsets, inline
+    styles) for it to be served from target_path. Returns the number of
+    attributes and <style> blocks changed.
+    """
+    relocate = partial(_relocate_asset_url, page_path=page_path, site_root=site_root, target_path=target_path)
+    changed = 0
+    for tag in soup.find_all(True):
+        for attribute in URL_ATTRIBUTES:
+            if tag.get(attribute):
+                url = relocate(tag[attribute])
+                if url != tag[attribute].strip():
+                    tag[attribute] = url
+                    changed += 1
+        for attribute in SRCSET_ATTRIBUTES:
+            if tag.get(attribute):
+                candidates = []
+                for candidate in tag[attribute].split(','):
+                    parts = candidate.split()
+                    if parts:
+                        candidates.append(' '.join([relocate(parts[0])] + parts[1:]))
+                srcset = ', '.join(candidates)
+                if srcset != tag[attribute]:
+                    tag[attribute] = srcset
+                    changed += 1
+        if tag.name == 'meta' and tag.get('content'):
+            # msapplication-TileImage and the like; text content never resolves to a file
+            url = relocate(tag['content'])
+            if url != tag['content'].strip():
+                tag['content'] = url
+                changed += 1
+        if tag.get('style') and 'url(' in tag['style']:
+            style = css_rules.relocate_urls(tag['style'], page_path, site_root, target_path)
+            if style != tag['style']:
+                tag['style'] = style
+                changed += 1
+    for style_tag in soup.find_all('style'):
+        if style_tag.string and 'url(' in style_tag.string:
+            css = css_rules.relocate_urls(style_tag.string, page_path, site_root, target_path)
+            if css != style_tag.string:
+                style_tag.string.replace_with(css)
+                changed += 1
+    return changed
+
+def set_hreflang_alternates(soup, relative, source_locale, locales):
+    """
+    Replaces the hreflang alternates of a page with one per locale plus
+    the source page as x-default. Every copy gets the same set, as search
+    engines only honour alternates that point back at each other.
+    Returns True if the page had a different set.
+    """
+    url = page_url(relative)
+    alternates = [(source_locale, SITE_ORIGINS[0] + url)]
+    alternates += [(locale, f"{SITE_ORIGINS[0]}/{locale}{url}") for locale in locales]
+    alternates.append(('x-default', SITE_ORIGINS[0] + url))
+
+    existing = soup.find_all('link', hreflang=True)
+    if [(link['hreflang'], link.get('href')) for link in existing] == alternates:
+        return False
+    for link in existing:
+        link.decompose()
+    head = soup.head or soup
+    for hreflang, href in alternates:
+        head.append(soup.new_tag('link', rel='alternate', hreflang=hreflang, href=href))
+    return True
+
+# --- END OF PAGE TEMPLATES ---
+
+
+def localize_page(page_path, site_root, source_locale, translation_maps):
+    """
+    Parses a page once and writes a copy per locale to <site_root>/<locale>/,
+    each rendered from the same template with that locale's translations.
+    The source page gets the hreflang alternates too.
+    Returns {locale: (text nodes translated, text nodes)}, or None on errors.
+    """
+    try:
+        relative = site_relative(page_path, site_root)
+        with open(page_path, 'r', encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        if set_hreflang_alternates(soup, relative, source_locale, list(translation_maps)):
+            with open(page_path, 'w', encoding='utf-8') as f:
+                f.write(str(soup))
+
+        # Every locale directory is one level down, so one relocation serves them all
+        relocate_assets(soup, page_path, site_root, os.path.join(site_root, 'locale', relative))
+        template = PageTemplate(soup)
+        texts = template.texts()
+
+        coverage = {}
+        for locale, translation_map in translation_maps.items():
+            html = HTML_LANG_PATTERN.sub(lambda match: f"{match.group(1)}{match.group(2)}{locale}{match.group(2)}",
+                                         template.render(translation_map), count=1)
+            output_path = os.path.join(site_root, locale, *relative.split('/'))
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w', encoding='utf-8') as f:
+                f.write(html)
+            coverage[locale] = (sum(1 for text in texts if text in translation_map), len(texts))
+        print(f"Localized: {relative} ({', '.join(translation_maps)})")
+        return coverage
+    except Exception as e:
+        print(f"Error processing {page_path}: {e}")
+        return None
+
+def find_source_pages(site_root, locales):
+    """Returns the pages of site_root, leaving out the locale directories of earlier runs."""
+    locale_dirs = tuple(os.path.join(site_root, locale) + os.sep for locale in locales)
+    return [path for path in lazy.find_html_files(site_root) if not path.startswith(locale_dirs)]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a translated copy of the site per locale (<site_root>/bg/, <site_root>/de/, ...) "
+                    "from the translation memory, with hreflang alternates between all copies."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--locales", required=True,
+                        help="Comma-separated locales to generate, e.g. bg,de (translated with html_translator.py --batch).")
+    parser.add_argument("--source-locale", default=DEFAULT_SOURCE_LOCALE,
+                        help=f"Language of the mirrored pages (default: {DEFAULT_SOURCE_LOCALE}).")
+    parser.add_argument("--memory", default=DEFAULT_MEMORY_PATH,
+                        help=f"SQLite translation memory (default: {DEFAULT_MEMORY_PATH}).")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+    locales = [locale.strip() for locale in args.locales.split(',') if locale.strip()]
+    if not os.path.exists(args.memory):
+        print(f"Error: Translation memory '{args.memory}' not found.", file=sys.stderr)
+        sys.exit(1)
+
+    memory = TranslationMemory(args.memory)
+    try:
+        translation_maps = {locale: memory.translations(locale) for locale in locales}
+        known_locales = set(memory.locales()) | set(locales)
+    finally:
+        memory.close()
+    for locale, translation_map in translation_maps.items():
+        if not translation_map:
+            print(f"Warning: No '{locale}' translations in {args.memory}; its pages stay untranslated.", file=sys.stderr)
+
+    pages = find_source_pages(args.site_root, known_locales)
+    print(f"Localizing {len(pages)} page(s) into {len(locales)} locale(s)...")
+    results = run_in_pool(partial(localize_page, site_root=args.site_root, source_locale=args.source_locale,
+                                  translation_maps=translation_maps), pages, args.jobs)
+    results = [result for result in results if result]
+    for locale in locales:
+        translated = sum(result[locale][0] for result in results)
+        total = sum(result[locale][1] for result in results)
+        print(f"/{locale}/: {len(results)} page(s), {translated} of {total} text nodes translated"
+              f" ({translated / total * 100 if total else 0:.0f}%)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import re
+import sys
+import csv
+import json
+import bisect
+import argparse
+import tempfile
+from functools import partial
+
+import minify_html_assets
+from minify_html_assets import minify_css_content, minify_js_content
+from parallel import add_jobs_argument
+from build_manifest import run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from site_paths import site_relative
+
+MINIFIABLE_EXTENSIONS = ('.css', '.js', '.json')
+
+# Files the mirror already names as minified (jquery.min.js, frontend.min3a83.css);
+# minifying them again gains next to nothing
+MINIFIED_NAME_PATTERN = re.compile(r'[.-]min(?:[0-9a-f]{4,})?\.(?:css|js)$', re.IGNORECASE)
+
+# Existing source map references, dropped along with the other comments
+SOURCE_MAP_COMMENT_PATTERN = re.compile(r'\n?(?://[#@] sourceMappingURL=[^\n]*|/\*[#@] sourceMappingURL=[^*]*\*/)\s*$')
+
+# Tokens of the minified output looked up in the source to build a source map
+MAP_TOKEN_PATTERN = re.compile(r'[A-Za-z_$][\w$-]*|\d[\w.]*|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+
+# How far ahead of the previous token a mapped token may be found in the source
+MAP_SEARCH_WINDOW = 4096
+
+BASE64_DIGITS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+# --- START OF SOURCE MAPS ---
+def _vlq(value):
+    """Encodes one integer as a source map base64 VLQ."""
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    encoded = ''
+    while True:
+        digit = value & 31
+        value >>= 5
+        encoded += BASE64_DIGITS[digit | (32 if value else 0)]
+        if not value:
+            return encoded
+
+def _line_column(line_starts, offset):
+    line = bisect.bisect_right(line_starts, offset) - 1
+    return line, offset - line_starts[line]
+
+def build_source_map(source, minified, source_name, file_name):
+    """
+    Returns a v3 source map from minified back to source. The minifiers
+    mostly drop whitespace and comments and shorten values, so the
+    identifiers, numbers and strings of the output are found, in order, in
+    the source; tokens that were rewritten or moved are left unmapped. The
+    source is embedded, as the minified file replaces it.
+    """
+    source_starts = [0] + [match.end() for match in re.finditer('\n', source)]
+    minified_starts = [0] + [match.end() for match in re.finditer('\n', minified)]
+    lines, segments = [], []
+    previous = [0, 0, 0]  # source line, source column, generated line
+    previous_column = 0
+    position = 0
+    for match in MAP_TOKEN_PATTERN.finditer(minified):
+        found = source.find(match.group(0), position, position + MAP_SEARCH_WINDOW + len(match.group(0)))
+        if found == -1:
+            continue
+        position = found + len(match.group(0))
+        generated_line, generated_column = _line_column(minified_starts, match.start())
+        while previous[2] < generated_line:
+            lines.append(','.join(segments))
+            segments, previous_column = [], 0
+            previous[2] += 1
+        source_line, source_column = _line_column(source_starts, found)
+        segments.append(_vlq(generated_column - previous_column) + _vlq(0)
+                        + _vlq(source_line - previous[0]) + _vlq(source_column - previous[1]))
+        previous_column, previous[0], previous[1] = generated_column, source_line, source_column
+    lines.append(','.join(segments))
+    return {
+        'version': 3,
+        'file': file_name,
+        'sources': [source_name],
+        'sourcesContent': [source],
+        'names': [],
+        'mappings': ';'.join(lines),
+    }
+# --- END OF SOURCE MAPS ---
+
+
+def minify_json_content(json_text):
+    """Re-serializes JSON without whitespace, or returns it unchanged if it doesn't parse."""
+    try:
+        return json.dumps(json.loads(json_text), ensure_ascii=False, separators=(',', ':'))
+    except ValueError as e:
+        print(f"Warning: Could not minify JSON. Error: {e}", file=sys.stderr)
+        return json_text
+
+def minify_text(text, extension):
+    """Minifies the text of a .css, .js or .json file."""
+    if extension == '.css':
+        return minify_css_content(text)
+    if extension == '.js':
+        return minify_js_content(text)
+    return minify_json_content(text)
+
+def _write_atomic(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def minify_file(file_path, source_maps=False):
+    """
+    Minifies one file in place, keeping it unchanged if the result is not
+    smaller. With source_maps, CSS and JS also get a <file>.map sibling
+    and a sourceMappingURL comment.
+    Returns (file_path, source_bytes, minified_bytes).
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        source = f.read()
+    minified = minify_text(source, extension)
+    if extension != '.json':
+        minified = SOURCE_MAP_COMMENT_PATTERN.sub('', minified)
+
+    source_bytes, minified_bytes = len(source.encode('utf-8')), len(minified.encode('utf-8'))
+    if minified_bytes >= source_bytes:
+        return file_path, source_bytes, source_bytes
+
+    if source_maps and extension != '.json':
+        file_name = os.path.basename(file_path)
+        source_map = build_source_map(source, minified, f"{file_name}?source", file_name)
+        _write_atomic(file_path + '.map', json.dumps(source_map, separators=(',', ':')))
+        minified += (f"\n/*# sourceMappingURL={file_name}.map */" if extension == '.css'
+                     else f"\n//# sourceMappingURL={file_name}.map")
+    _write_atomic(file_path, minified)
+    return file_path, source_bytes, minified_bytes
+
+def find_minifiable_files(site_root, include_minified=False):
+    """Returns the sorted list of .css, .js and .json files under site_root."""
+    return sorted(
+        os.path.join(root, file_name)
+        for root, _, files in os.walk(site_root)
+        for file_name in files
+        if file_name.lower().endswith(MINIFIABLE_EXTENSIONS)
+        and (include_minified or not MINIFIED_NAME_PATTERN.search(file_name))
+    )
+
+def print_report(rows, site_root, skipped, report_path=None):
+    """Prints the bytes saved per file, largest savings first, and optionally writes them as CSV."""
+    rows = sorted(rows, key=lambda row: row[1] - row[2], reverse=True)
+    for file_path, source_bytes, minified_bytes in rows:
+        if minified_bytes < source_bytes:
+            print(f"  {site_relative(file_path, site_root)}: {source_bytes / 1024:.1f} KB -> {minified_bytes / 1024:.1f} KB "
+                  f"(-{(source_bytes - minified_bytes) / 1024:.1f} KB)")
+    for extension in MINIFIABLE_EXTENSIONS:
+        selected = [row for row in rows if row[0].lower().endswith(extension)]
+        total_source = sum(row[1] for row in selected)
+        total_minified = sum(row[2] for row in selected)
+        if total_source:
+            print(f"{extension}: {len(selected)} file(s), {total_source / 1024:.1f} KB -> {total_minified / 1024:.1f} KB "
+                  f"({(total_source - total_minified) / total_source * 100:.0f}% saved)")
+    if skipped:
+        print(f"{skipped} file(s) unchanged since the last run.")
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['file', 'source_bytes', 'minified_bytes', 'saved_bytes'])
+            for file_path, source_bytes, minified_bytes in rows:
+                writer.writerow([site_relative(file_path, site_root), source_bytes, minified_bytes,
+                                 source_bytes - minified_bytes])
+        print(f"Wrote size report to {report_path}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Minify the standalone .css, .js and .json files of the publish directory in place."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--source-maps", action="store_true",
+                        help="Write a .map next to every minified CSS and JS file, embedding the original source.")
+    parser.add_argument("--include-minified", action="store_true",
+                        help="Also minify files already named .min (skipped by default).")
+    parser.add_argument("--report", help="Also write the bytes saved per file to this CSV file.")
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    file_paths = find_minifiable_files(args.site_root, args.include_minified)
+    print(f"Found {len(file_paths)} file(s) to minify.")
+    manifest = manifest_from_args(args)
+    results = run_incremental(partial(minify_file, source_maps=args.source_maps), file_paths, args.jobs, manifest,
+                              'minify_assets', tool_version(sys.modules[__name__], minify_html_assets),
+                              config={'source_maps': args.source_maps})
+    print_report([row for row in results if row], args.site_root, len(file_paths) - len(results), args.report)
+
+if __name__ == "__main__":
+    main()
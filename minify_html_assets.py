@@ -1,21 +1,91 @@
 import argparse
 import sys
 import os
+import re
 import glob # For finding files
+import minify_html
+from functools import partial
 from bs4 import BeautifulSoup
-from cssmin import cssmin
 from jsmin import jsmin, JavascriptMinify
+from parallel import add_jobs_argument
+from build_manifest import run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from prefilter import file_triggers, partition_files, print_skipped
+import lazy
+
+# How the modified document is written:
+#   compact   serialized as parsed, without re-indenting
+#   minify    additionally minified with minify-html (as lazy.py does)
+#   prettify  re-indented by BeautifulSoup (larger, for reading only)
+OUTPUT_MODES = ('compact', 'minify', 'prettify')
+DEFAULT_OUTPUT_MODE = 'compact'
+
+# A <style> or a <script> without src: pages with neither have nothing to
+# minify inline and are not parsed (see prefilter.py)
+INLINE_ASSET_TRIGGER = re.compile(rb'<style\b|<script\b(?![^>]*\bsrc\s*=)', re.IGNORECASE)
+
+# Math functions, whose + and - operators need whitespace on both sides
+CSS_MATH_FUNCTION_PATTERN = re.compile(r'\b(?:calc|clamp|min|max)\(', re.IGNORECASE)
+CSS_SHORT_HEX_PATTERN = re.compile(r'#[0-9a-f]{5}\b', re.IGNORECASE)
+
+def _math_expressions(css_code):
+    """Returns the calc()/clamp()/min()/max() expressions of CSS text, outermost only."""
+    expressions = []
+    position = 0
+    while True:
+        match = CSS_MATH_FUNCTION_PATTERN.search(css_code, position)
+        if not match:
+            return expressions
+        end, depth = match.end(), 1
+        while end < len(css_code) and depth:
+            depth += {'(': 1, ')': -1}.get(css_code[end], 0)
+            end += 1
+        expressions.append(css_code[match.start():end])
+        position = end
+
+def css_minification_intact(source_css, minified_css):
+    """
+    Regression check run on every minified CSS block, for the two ways
+    cssmin used to break this site's stylesheets: a + inside calc() left
+    without its required whitespace (calc(60px+var(--x)) is invalid, so the
+    browser drops the declaration), and an 8-digit #rrggbbaa color shortened
+    as if it were #rrggbb (#0000001a became #0001a).
+    """
+    for expression in _math_expressions(minified_css):
+        if re.search(r'[^\s(]\+|\+[^\s]', expression):
+            return False
+    return set(CSS_SHORT_HEX_PATTERN.findall(minified_css)) <= set(CSS_SHORT_HEX_PATTERN.findall(source_css))
 
 def minify_css_content(css_code):
-    """Minifies CSS content."""
+    """
+    Minifies CSS content with minify-html's CSS minifier (the same one
+    lazy.py runs over whole documents), which understands calc() and
+    8-digit hex colors. Returns css_code unchanged if it can't be minified
+    or the result fails css_minification_intact().
+    """
+    if re.search(r'</style', css_code, re.IGNORECASE):
+        return css_code
     try:
-        return cssmin(css_code)
+        minified_html = minify_html.minify(f"<style>{css_code}</style>", minify_css=True)
     except Exception as e:
         print(f"Warning: Could not minify CSS in a block. Error: {e}", file=sys.stderr)
         return css_code
+    if not (minified_html.startswith('<style>') and minified_html.endswith('</style>')):
+        return css_code
+    minified_css = minified_html[len('<style>'):-len('</style>')]
+    if not css_minification_intact(css_code, minified_css):
+        print("Warning: Minifying a CSS block broke a calc() expression or an 8-digit hex color; block left unminified.",
+              file=sys.stderr)
+        return css_code
+    return minified_css
 
 def minify_js_content(js_code):
-    """Minifies JavaScript content."""
+    """
+    Minifies JavaScript content. Code with template literals (which
+    minify-html writes) is returned unchanged: jsmin doesn't know them and
+    would read the // of `https://...` as the start of a comment.
+    """
+    if '`' in js_code:
+        return js_code
     try:
         return jsmin(js_code)
     except JavascriptMinify as e:
@@ -25,25 +95,11 @@ def minify_js_content(js_code):
         print(f"Warning: Could not minify JavaScript in a block due to an unexpected error: {e}", file=sys.stderr)
         return js_code
 
-def process_html_file(filepath):
+def minify_inline_assets(soup):
     """
-    Reads an HTML file, minifies inline CSS and JavaScript,
-    and overwrites the original file.
+    Minifies inline CSS and JavaScript in an already parsed document.
+    Returns a tuple of (style tags minified, script tags minified).
     """
-    print(f"Processing '{filepath}' for in-place minification...")
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-    except FileNotFoundError:
-        print(f"Error: File '{filepath}' not found.", file=sys.stderr)
-        return # Continue to next file if one is not found in batch mode
-    except Exception as e:
-        print(f"Error reading file '{filepath}': {e}", file=sys.stderr)
-        return
-
-    soup = BeautifulSoup(html_content, 'html.parser')
-    changes_made = False
-
     # Minify inline CSS in <style> tags
     style_tags_minified = 0
     for style_tag in soup.find_all('style'):
@@ -53,7 +109,6 @@ def process_html_file(filepath):
             if minified_css != original_css:
                 style_tag.string.replace_with(minified_css)
                 style_tags_minified +=1
-                changes_made = True
 
     # Minify inline JavaScript in <script> tags (excluding those with a 'src' attribute)
     script_tags_minified = 0
@@ -64,20 +119,74 @@ def process_html_file(filepath):
             if minified_js != original_js:
                 script_tag.string.replace_with(minified_js)
                 script_tags_minified += 1
-                changes_made = True
-    
-    if not changes_made:
-        print(f"No inline <style> or <script> content was minified in '{filepath}'. File unchanged.")
+
+    return style_tags_minified, script_tags_minified
+
+def serialize_document(soup, output_mode=DEFAULT_OUTPUT_MODE):
+    """Serializes a parsed document in one of OUTPUT_MODES."""
+    if output_mode == 'prettify':
+        return soup.prettify()
+    if output_mode == 'minify':
+        return lazy.minify_document(str(soup))
+    return str(soup)
+
+def process_html_file(filepath, output_mode=DEFAULT_OUTPUT_MODE, allow_growth=False):
+    """
+    Reads an HTML file, minifies inline CSS and JavaScript,
+    and overwrites the original file. Output bigger than the input is
+    not written unless allow_growth is set.
+    Returns (filepath, bytes_before, bytes_after, written), or None on errors.
+    """
+    print(f"Processing '{filepath}' for in-place minification...")
+    try:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+    except FileNotFoundError:
+        print(f"Error: File '{filepath}' not found.", file=sys.stderr)
+        return # Continue to next file if one is not found in batch mode
+    except Exception as e:
+        print(f"Error reading file '{filepath}': {e}", file=sys.stderr)
         return
 
-    modified_html_content = soup.prettify()
+    soup = BeautifulSoup(html_content, 'html.parser')
+    style_tags_minified, script_tags_minified = minify_inline_assets(soup)
+    changes_made = bool(style_tags_minified or script_tags_minified)
+    bytes_before = len(html_content.encode('utf-8'))
+
+    if not changes_made and output_mode != 'minify':
+        print(f"No inline <style> or <script> content was minified in '{filepath}'. File unchanged.")
+        return filepath, bytes_before, bytes_before, False
+
+    modified_html_content = serialize_document(soup, output_mode)
+    bytes_after = len(modified_html_content.encode('utf-8'))
+    size_change = f"{bytes_before} -> {bytes_after} bytes ({(bytes_after - bytes_before) / bytes_before * 100:+.1f}%)"
+
+    if bytes_after > bytes_before and not allow_growth:
+        print(f"Refused to write '{filepath}': output would grow {size_change}. File unchanged.", file=sys.stderr)
+        return filepath, bytes_before, bytes_after, False
+    if bytes_after == bytes_before and modified_html_content == html_content:
+        print(f"No size change for '{filepath}'. File unchanged.")
+        return filepath, bytes_before, bytes_after, False
 
     try:
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(modified_html_content)
-        print(f"Successfully minified and overwrote '{filepath}' (Styles minified: {style_tags_minified}, Scripts minified: {script_tags_minified})")
+        print(f"Successfully minified and overwrote '{filepath}' (Styles minified: {style_tags_minified}, Scripts minified: {script_tags_minified}), {size_change}")
     except Exception as e:
         print(f"Error writing (overwriting) file '{filepath}': {e}", file=sys.stderr)
+        return None
+    return filepath, bytes_before, bytes_after, True
+
+def print_size_summary(results):
+    """Prints the total size before and after, and how many files were written or refused."""
+    results = [result for result in results if result]
+    if not results:
+        return
+    bytes_before = sum(result[1] for result in results)
+    bytes_after = sum(result[2] if result[3] else result[1] for result in results)
+    refused = sum(1 for result in results if not result[3] and result[2] > result[1])
+    print(f"Total size: {bytes_before} -> {bytes_after} bytes ({(bytes_after - bytes_before) / bytes_before * 100:+.1f}%), "
+          f"{sum(1 for result in results if result[3])} file(s) written, {refused} refused for growing.")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -96,15 +205,32 @@ def main():
         action='store_true',
         help='Recursively search for HTML files in subdirectories of input_path if it is a directory.'
     )
+    parser.add_argument(
+        '--output',
+        choices=OUTPUT_MODES,
+        default=DEFAULT_OUTPUT_MODE,
+        help=f'How to write the modified HTML (default: {DEFAULT_OUTPUT_MODE}); prettify re-indents and usually grows the file.'
+    )
+    parser.add_argument(
+        '--allow-growth',
+        action='store_true',
+        help='Write the output even if it is bigger than the input (refused by default).'
+    )
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
 
     args = parser.parse_args()
+    process = partial(process_html_file, output_mode=args.output, allow_growth=args.allow_growth)
     input_path = args.input_path
 
     if os.path.isfile(input_path):
         if not (input_path.lower().endswith(".html") or input_path.lower().endswith(".htm")):
             print(f"Error: Input file '{input_path}' is not an HTML file (.html or .htm).", file=sys.stderr)
             sys.exit(1)
-        process_html_file(input_path)
+        if args.output != 'minify' and not file_triggers(input_path, {'inline': INLINE_ASSET_TRIGGER}):
+            print(f"No inline <style> or <script> in '{input_path}'. File unchanged (not parsed).")
+            return
+        print_size_summary([process(input_path)])
     elif os.path.isdir(input_path):
         print(f"Processing directory: '{input_path}' for in-place minification.")
         print("WARNING: Files in this directory (and subdirectories if --recursive) will be overwritten.")
@@ -126,9 +252,17 @@ def main():
             print(f"No HTML files (.html or .htm) found in '{input_path}' {'recursively' if args.recursive else 'at the top level'}.")
             sys.exit(0)
 
-        for filepath_to_process in all_files_to_process:
-            process_html_file(filepath_to_process)
+        if args.output != 'minify':
+            # Whole-document minification changes every page; the inline passes only pages with inline code
+            total = len(all_files_to_process)
+            all_files_to_process, skipped = partition_files(all_files_to_process, INLINE_ASSET_TRIGGER)
+            print_skipped(len(skipped), total, "HTML file(s)")
+
+        results = run_incremental(process, all_files_to_process, args.jobs, manifest_from_args(args),
+                                  'minify_html_assets', tool_version(sys.modules[__name__]),
+                                  config={'output': args.output, 'allow_growth': args.allow_growth})
         print(f"Processed {len(all_files_to_process)} HTML file(s).")
+        print_size_summary(results)
     else:
         print(f"Error: Input path '{input_path}' is not a valid file or directory.", file=sys.stderr)
         sys.exit(1)
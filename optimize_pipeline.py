@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import argparse
+from functools import partial
+from bs4 import BeautifulSoup
+
+import update_tags
+import lazy
+import image_dimensions
+import script_scheduler
+import minify_html_assets
+import add_preconnect
+import responsive_images
+import avif_encoder
+import critical_css
+import css_rules
+from parallel import add_jobs_argument
+from build_manifest import run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from prefilter import file_triggers
+
+# --- START OF STAGE REGISTRY ---
+
+# Registered stages, in registration order.
+# Each stage is a dict with:
+#   'transform': function(soup) -> truthy if the tree was modified, or
+#                function(soup, context) when registered with_context=True;
+#                context holds the 'file_path' and 'site_root' being processed
+#   'finalize':  optional function(html_text) -> html_text, applied once to the
+#                serialized document after all transforms have run
+#   'trigger':   optional bytes, compiled bytes regex or
+#                function(raw_bytes, file_path, site_root), or a tuple of them
+#                (see prefilter.py), telling whether the stage has work left in
+#                a file; the stage only runs on files it triggers on, so a
+#                file no stage triggers on is never decoded or parsed.
+#                None runs it on every file
+#   'superseded_by': names of stages whose finalize already does this stage's
+#                work; the stage is left out whenever one of them is selected
+STAGES = {}
+
+def register_stage(name, transform, finalize=None, with_context=False, trigger=None, superseded_by=()):
+    """Registers a transform that runs on the shared parsed tree of each file."""
+    STAGES[name] = {
+        'transform': transform,
+        'finalize': finalize,
+        'with_context': with_context,
+        'trigger': trigger,
+        'superseded_by': tuple(superseded_by),
+    }
+
+register_stage(
+    'webp',
+    lambda soup, context: update_tags.update_soup_image_references(
+        soup, update_tags.webp_target_checker(context['file_path'], context['site_root'])),
+    with_context=True,
+    trigger=update_tags.webp_target_trigger
+)
+register_stage(
+    'responsive',
+    lambda soup, context: responsive_images.apply_responsive_srcset(soup, context['file_path'], context['site_root']),
+    with_context=True,
+    trigger=responsive_images.RESPONSIVE_TRIGGER
+)
+register_stage(
+    'avif',
+    lambda soup, context: avif_encoder.apply_picture_fallbacks(soup, context['file_path'], context['site_root']),
+    with_context=True,
+    trigger=avif_encoder.AVIF_TRIGGER
+)
+register_stage(
+    'critical',
+    lambda soup, context: critical_css.inline_critical_css(soup, context['file_path'], context['site_root']),
+    with_context=True,
+    trigger=critical_css.CRITICAL_TRIGGER
+)
+register_stage(
+    'lazy',
+    lambda soup, context: lazy.optimize_soup(soup, context['file_path'], context['site_root']),
+    finalize=lazy.minify_document,
+    with_context=True,
+    trigger=lazy.LAZY_TRIGGER
+)
+register_stage(
+    'minify',
+    lambda soup: any(minify_html_assets.minify_inline_assets(soup)),
+    trigger=minify_html_assets.INLINE_ASSET_TRIGGER,
+    # lazy's minify-html pass minifies inline CSS and JS too; running jsmin
+    # over its output truncates the template literals it writes
+    superseded_by=('lazy',)
+)
+register_stage(
+    'preconnect',
+    lambda soup, context: add_preconnect.insert_resource_hints(soup, context['file_path'], context['site_root']),
+    with_context=True,
+    trigger=add_preconnect.PRECONNECT_TRIGGER
+)
+
+DEFAULT_STAGES = list(STAGES)
+# --- END OF STAGE REGISTRY ---
+
+
+def drop_superseded_stages(stage_names):
+    """Returns stage_names without the stages superseded by another selected stage, printing those left out."""
+    selected = []
+    for name in stage_names:
+        superseding = [other for other in STAGES[name]['superseded_by'] if other in stage_names]
+        if superseding:
+            print(f"Stage '{name}' left out: '{superseding[0]}' already does its work.")
+        else:
+            selected.append(name)
+    return selected
+
+def stage_triggers(stage_names):
+    """Returns {stage name: trigger} for the selected stages."""
+    return {name: STAGES[name]['trigger'] for name in stage_names}
+
+def run_pipeline_on_file(file_path, stage_names, site_root=None):
+    """
+    Reads and parses a single HTML file once, runs every selected stage on the
+    same tree, and writes the result once if any stage changed it. Stages
+    whose trigger is not in the file's raw bytes are left out, and the file
+    is not parsed at all if that leaves none.
+    Returns the list of stage names that modified the document, or None if
+    the file couldn't be read or written or a stage failed on it.
+    """
+    triggered = file_triggers(file_path, stage_triggers(stage_names), site_root)
+    stage_names = [name for name in stage_names if name in triggered]
+    if not stage_names:
+        print(f"Unchanged: {file_path} (no stage triggered, not parsed)")
+        return []
+
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            html_content = f.read()
+    except (IOError, UnicodeDecodeError) as e:
+        print(f"Error reading {file_path}: {e}", file=sys.stderr)
+        return None
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    context = {
+        'file_path': file_path,
+        'site_root': site_root or os.path.dirname(file_path),
+    }
+
+    modified_by, failed = [], False
+    for name in stage_names:
+        stage = STAGES[name]
+        try:
+            modified = stage['transform'](soup, context) if stage['with_context'] else stage['transform'](soup)
+            if modified:
+                modified_by.append(name)
+        except Exception as e:
+            print(f"Error in stage '{name}' for {file_path}: {e}", file=sys.stderr)
+            failed = True
+
+    if not modified_by:
+        print(f"Unchanged: {file_path}")
+        return None if failed else modified_by
+
+    output_html = str(soup)
+    for name in modified_by:
+        finalize = STAGES[name]['finalize']
+        if finalize:
+            output_html = finalize(output_html)
+
+    try:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(output_html)
+        print(f"Modified: {file_path} (stages: {', '.join(modified_by)})")
+    except IOError as e:
+        print(f"Error writing {file_path}: {e}", file=sys.stderr)
+        return None
+    return None if failed else modified_by
+
+
+def parse_stage_list(value):
+    """Parses a comma-separated --stages value, keeping registry order."""
+    requested = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in requested if name not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"Unknown stage(s): {', '.join(unknown)}. Available: {', '.join(STAGES)}"
+        )
+    return [name for name in STAGES if name in requested]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run all HTML optimization stages over a folder, parsing each file only once."
+    )
+    parser.add_argument("folder", help="The path to the folder to scan.")
+    parser.add_argument(
+        "--stages",
+        type=parse_stage_list,
+        default=DEFAULT_STAGES,
+        help=f"Comma-separated stages to run (default: {','.join(DEFAULT_STAGES)})."
+    )
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print(f"Error: Folder not found at {args.folder}")
+        return
+
+    args.stages = drop_superseded_stages(args.stages)
+    html_files = sorted(lazy.find_html_files(args.folder))
+    if not html_files:
+        print(f"No HTML files found in {args.folder}")
+        return
+
+    print(f"Running stages [{', '.join(args.stages)}] on {len(html_files)} HTML file(s)...")
+    start_time = time.perf_counter()
+
+    # Pre-filter: files no selected stage triggers on never reach the workers
+    triggers = stage_triggers(args.stages)
+    skipped_by_stage = dict.fromkeys(args.stages, 0)
+    triggered_files = []
+    for file_path in html_files:
+        triggered = file_triggers(file_path, triggers, args.folder)
+        for name in args.stages:
+            if name not in triggered:
+                skipped_by_stage[name] += 1
+        if triggered:
+            triggered_files.append(file_path)
+    print(f"Pre-filter: {len(html_files) - len(triggered_files)} of {len(html_files)} file(s) triggered no stage "
+          f"and were not parsed; skipped per stage: "
+          + ', '.join(f"{name} {count}" for name, count in skipped_by_stage.items()))
+    html_files = triggered_files
+    version = tool_version(sys.modules[__name__], update_tags, responsive_images, avif_encoder, critical_css, css_rules, lazy, image_dimensions, script_scheduler, minify_html_assets, add_preconnect)
+    results = run_incremental(partial(run_pipeline_on_file, stage_names=args.stages, site_root=args.folder),
+                              html_files, args.jobs,
+                              manifest_from_args(args), 'optimize_pipeline', version,
+                              config={'stages': args.stages})
+    modified_count = sum(1 for modified_by in results if modified_by)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"\nPipeline complete: {modified_count}/{len(results)} processed file(s) modified in {elapsed:.2f}s.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import io
+import os
+import sys
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from concurrent.futures import ProcessPoolExecutor
+
+def default_jobs():
+    """Returns the default number of worker processes (one per core)."""
+    return os.cpu_count() or 1
+
+def add_jobs_argument(parser):
+    """Adds the shared --jobs option to an argparse parser."""
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=default_jobs(),
+        help=f"Number of worker processes (default: number of cores, {default_jobs()}). Use 1 to run serially."
+    )
+
+def _run_captured(func, item):
+    """
+    Runs func(item) while capturing everything it prints, so the parent
+    process can replay the output of each file in order.
+    Returns (result, stdout_text, stderr_text, error_text).
+    """
+    out, err = io.StringIO(), io.StringIO()
+    result, error = None, None
+    with redirect_stdout(out), redirect_stderr(err):
+        try:
+            result = func(item)
+        except Exception:
+            error = traceback.format_exc()
+    return result, out.getvalue(), err.getvalue(), error
+
+def run_in_pool(func, items, jobs=None):
+    """
+    Runs func(item) for every item across a process pool and returns the
+    results in input order. func must be a module-level (picklable) function.
+
+    Output printed by each call is buffered in the worker and replayed here,
+    one item at a time and in input order, so logs are identical to a
+    serial run regardless of scheduling. Unexpected exceptions are reported
+    for their item and yield a None result instead of stopping the run.
+    """
+    items = list(items)
+    jobs = jobs or default_jobs()
+    jobs = max(1, min(jobs, len(items) or 1))
+
+    if jobs == 1:
+        outcomes = (_run_captured(func, item) for item in items)
+        return _collect(items, outcomes)
+
+    # Larger chunks cut IPC overhead; keep several chunks per worker so the
+    # load still balances when file sizes vary a lot.
+    chunksize = max(1, len(items) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        outcomes = executor.map(_run_captured, [func] * len(items), items, chunksize=chunksize)
+        return _collect(items, outcomes)
+
+def _collect(items, outcomes):
+    """Replays captured output in order and gathers the results."""
+    results = []
+    for item, (result, out_text, err_text, error) in zip(items, outcomes):
+        if out_text:
+            sys.stdout.write(out_text)
+        if err_text:
+            sys.stderr.write(err_text)
+        if error:
+            print(f"Error processing {item}:\n{error}", file=sys.stderr)
+        results.append(result)
+    sys.stdout.flush()
+    return results
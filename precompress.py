@@ -0,0 +1,150 @@
+import os
+import sys
+import gzip
+import argparse
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; without it only .gz files are written
+    brotli = None
+
+from parallel import add_jobs_argument
+from build_manifest import run_cached, tool_version, file_hash, config_hash, add_manifest_arguments, manifest_from_args
+from site_paths import site_relative
+
+# Text formats worth pre-compressing
+COMPRESSIBLE_EXTENSIONS = ('.html', '.htm', '.css', '.js', '.json', '.svg')
+
+# Pre-compressed sibling suffix -> encoder name
+ENCODINGS = {
+    '.br': 'br',
+    '.gz': 'gzip',
+}
+
+# Files smaller than this gain nothing worth a separate request path
+MIN_SIZE = 256
+
+def compress_bytes(data, encoding):
+    """Compresses data at maximum quality for the given encoding ('br' or 'gzip')."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11, mode=brotli.MODE_TEXT)
+    # mtime=0 keeps the output byte-identical across runs
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def compress_file(item):
+    """
+    Writes one (source_path, target_path, encoding) sibling through a
+    temporary file. If compression does not make the file smaller, no
+    sibling is kept. Returns (source_bytes, compressed_bytes, kept).
+    """
+    source_path, target_path, encoding = item
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    compressed = compress_bytes(data, encoding)
+    if len(compressed) >= len(data):
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        return len(data), len(compressed), False
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, target_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return len(data), len(compressed), True
+
+def find_compressible_files(site_root):
+    """Returns the sorted list of files under site_root worth pre-compressing."""
+    file_paths = []
+    for root, _, files in os.walk(site_root):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            if file_name.lower().endswith(COMPRESSIBLE_EXTENSIONS) and os.path.getsize(file_path) >= MIN_SIZE:
+                file_paths.append(file_path)
+    return sorted(file_paths)
+
+def precompress_directory(site_root, encodings, jobs=None, manifest=None):
+    """
+    Writes the pre-compressed siblings of every compressible file under
+    site_root in a process pool, skipping outputs the manifest knows are
+    current or were already rejected for not being smaller. Prints a
+    per-encoding summary.
+    """
+    version = tool_version(sys.modules[__name__])
+    config_digest = config_hash({})
+    items, rejected_count, input_hashes = [], 0, {}
+    for file_path in find_compressible_files(site_root):
+        for suffix, encoding in ENCODINGS.items():
+            if encoding not in encodings:
+                continue
+            if manifest is not None:
+                if file_path not in input_hashes:
+                    input_hashes[file_path] = file_hash(file_path)
+                if manifest.rejected_bytes('precompress', file_path + suffix, input_hashes[file_path],
+                                           version, config_digest) is not None:
+                    rejected_count += 1
+                    continue
+            items.append((file_path, file_path + suffix, encoding))
+    results, cached_items = run_cached(compress_file, items, jobs, manifest, 'precompress', version)
+
+    cached = set(cached_items)
+    stale_items = [item for item in items if item not in cached]
+    totals = {encoding: [0, 0, 0] for encoding in encodings}
+    for (source_path, target_path, encoding), result in zip(stale_items, results):
+        if not result:
+            continue
+        source_bytes, compressed_bytes, kept = result
+        if kept:
+            totals[encoding][0] += source_bytes
+            totals[encoding][1] += compressed_bytes
+            totals[encoding][2] += 1
+        else:
+            print(f"  Skipped {site_relative(target_path, site_root)} (not smaller than the original)")
+            if manifest is not None:
+                manifest.record_rejection('precompress', target_path, input_hashes[source_path], version,
+                                          config_digest, compressed_bytes)
+
+    for encoding, (source_bytes, compressed_bytes, count) in totals.items():
+        if count:
+            print(f"{encoding}: wrote {count} file(s), {source_bytes / 1024:.1f} KB -> {compressed_bytes / 1024:.1f} KB "
+                  f"({compressed_bytes / source_bytes * 100:.0f}% of original).")
+    if manifest is not None:
+        manifest.save()
+    print(f"Reused {len(cached_items)} up-to-date pre-compressed file(s); "
+          f"{rejected_count} not smaller than their original last time, not recompressed.")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write max-quality .br and .gz siblings next to every compressible file of the publish directory."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument(
+        "--encodings",
+        default="br,gzip",
+        help="Comma-separated encodings to write: br, gzip (default: br,gzip)."
+    )
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    encodings = [encoding.strip() for encoding in args.encodings.split(',') if encoding.strip()]
+    unknown = [encoding for encoding in encodings if encoding not in ENCODINGS.values()]
+    if unknown:
+        print(f"Error: Unknown encoding(s): {', '.join(unknown)}", file=sys.stderr)
+        sys.exit(1)
+    if 'br' in encodings and brotli is None:
+        print("Warning: The brotli package is not installed (pip install brotli); writing gzip only.", file=sys.stderr)
+        encodings.remove('br')
+
+    precompress_directory(args.site_root, encodings, args.jobs, manifest_from_args(args))
+
+if __name__ == "__main__":
+    main()
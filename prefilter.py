@@ -0,0 +1,86 @@
+import os
+import re
+import mmap
+
+# Files at least this big are memory-mapped rather than read into memory
+MMAP_THRESHOLD = 256 * 1024
+
+NOSCRIPT_PATTERN = re.compile(rb'<noscript\b.*?</noscript\s*>', re.IGNORECASE | re.DOTALL)
+IMAGE_TAG_PATTERN = re.compile(rb'<(img|source)\b[^>]*>', re.IGNORECASE)
+TAG_ATTRIBUTE_PATTERN = re.compile(rb'''\s([\w-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+
+def without_noscript(data):
+    """Returns the raw bytes of a page without its <noscript> blocks, whose content never loads."""
+    return NOSCRIPT_PATTERN.sub(b'', data)
+
+def tag_attributes(tag):
+    """Returns {name: value} of the attributes of one raw tag (bytes), names lowercased, values decoded."""
+    attributes = {}
+    for match in TAG_ATTRIBUTE_PATTERN.finditer(tag):
+        value = next(group for group in match.groups()[1:] if group is not None)
+        attributes.setdefault(match.group(1).decode('ascii', 'replace').lower(), value.decode('utf-8', 'replace'))
+    return attributes
+
+def image_tags(data):
+    """
+    Yields (name, tag, attributes) for every <img> and <source> tag in the
+    raw bytes of a page outside <noscript>: 'img' or 'source', the raw tag
+    and its attributes (see tag_attributes()).
+    """
+    for match in IMAGE_TAG_PATTERN.finditer(without_noscript(data)):
+        yield match.group(1).decode('ascii').lower(), match.group(0), tag_attributes(match.group(0))
+
+def _trigger_matcher(trigger):
+    """
+    Returns function(data, file_path, site_root) -> bool for a trigger: a
+    bytes substring, a compiled bytes regex, a function(data, file_path,
+    site_root) (for triggers that check the files a page references), or a
+    tuple of those (matching if any does). None matches every file.
+    """
+    if trigger is None:
+        return lambda data, file_path, site_root: True
+    if isinstance(trigger, (tuple, list)):
+        matchers = [_trigger_matcher(part) for part in trigger]
+        return lambda data, file_path, site_root: any(matcher(data, file_path, site_root) for matcher in matchers)
+    if isinstance(trigger, bytes):
+        return lambda data, file_path, site_root: data.find(trigger) != -1
+    if isinstance(trigger, re.Pattern):
+        return lambda data, file_path, site_root: trigger.search(data) is not None
+    return trigger
+
+def check_triggers(data, triggers, file_path=None, site_root=None):
+    """
+    Returns the names of the triggers ({name: trigger}) found in data, the
+    raw bytes of the file at file_path.
+    """
+    return [name for name, trigger in triggers.items() if _trigger_matcher(trigger)(data, file_path, site_root)]
+
+def file_triggers(file_path, triggers, site_root=None):
+    """
+    Returns the names of the triggers ({name: trigger}) found in a file,
+    scanning its raw bytes without decoding them; big files are
+    memory-mapped. site_root (by default the file's directory) is where
+    triggers resolve the URLs of the page. Unreadable files match every
+    trigger, so the tool still gets to report the error.
+    """
+    site_root = site_root or os.path.dirname(file_path)
+    try:
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MMAP_THRESHOLD:
+                return check_triggers(f.read(), triggers, file_path, site_root)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return check_triggers(data, triggers, file_path, site_root)
+    except (OSError, ValueError):
+        return list(triggers)
+
+def partition_files(file_paths, trigger, site_root=None):
+    """Splits file_paths into (files containing the trigger, files that don't)."""
+    matching, skipped = [], []
+    for file_path in file_paths:
+        (matching if file_triggers(file_path, {'trigger': trigger}, site_root) else skipped).append(file_path)
+    return matching, skipped
+
+def print_skipped(skipped_count, total, what="file(s)"):
+    """Prints the pre-filter counter of a tool."""
+    print(f"Pre-filter: {skipped_count} of {total} {what} have nothing to change and were not parsed.")
@@ -0,0 +1,190 @@
+import os
+import re
+import csv
+import sys
+import argparse
+import tempfile
+from functools import partial
+from bs4 import BeautifulSoup
+
+import lazy
+import css_rules
+from parallel import run_in_pool, add_jobs_argument
+from site_paths import site_relative
+
+DEFAULT_OUTPUT_DIR = "pruned-css"
+
+# Quoted string literals in JavaScript (single, double or template quotes)
+JS_STRING_PATTERN = re.compile(r'''(['"`])((?:\\.|(?!\1)[^\\\n])*)\1''')
+
+# Words in a string literal that could be a class name, id or tag name
+JS_WORD_PATTERN = re.compile(r'-?[A-Za-z_][\w-]*')
+
+# --- START OF SELECTOR INDEX ---
+def html_tokens(file_path):
+    """
+    Returns (tags, classes, ids, scripts) for one page: every element name,
+    class and id used in its markup, and the text of its inline scripts.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    tags, classes, ids = css_rules.document_tokens(soup.find_all(True))
+    scripts = [script.string for script in soup.find_all('script') if script.string and not script.get('src')]
+    return tags, classes, ids, scripts
+
+def script_safelist(script_texts):
+    """
+    Returns (words, prefixes) from the string literals of scripts. Every
+    word may be a class or id added at runtime; a literal ending in '-'
+    (e.g. 'elementor-widget-' + name) safelists everything starting with it.
+    """
+    words, prefixes = set(), set()
+    for text in script_texts:
+        for _, literal in JS_STRING_PATTERN.findall(text):
+            words.update(JS_WORD_PATTERN.findall(literal))
+            prefix = re.search(r'(?:^|\s)(-?[A-Za-z_][\w-]*-)$', literal)
+            if prefix and len(prefix.group(1)) > 2:
+                prefixes.add(prefix.group(1))
+    return words, prefixes
+
+def find_scripts(site_root):
+    """Returns the sorted list of .js files under site_root."""
+    return sorted(
+        os.path.join(root, file_name)
+        for root, _, files in os.walk(site_root)
+        for file_name in files if file_name.endswith('.js')
+    )
+
+def build_selector_index(site_root, jobs=None):
+    """
+    Collects the element names, classes and ids used anywhere on the site,
+    plus the words and prefixes safelisted by inline and external scripts.
+    """
+    html_files = lazy.find_html_files(site_root)
+    index = {'tags': set(), 'classes': set(), 'ids': set(), 'prefixes': set()}
+    script_texts = []
+    for result in run_in_pool(html_tokens, html_files, jobs):
+        if result:
+            tags, classes, ids, scripts = result
+            index['tags'] |= tags
+            index['classes'] |= classes
+            index['ids'] |= ids
+            script_texts.extend(scripts)
+
+    script_files = find_scripts(site_root)
+    for script_path in script_files:
+        with open(script_path, 'r', encoding='utf-8', errors='replace') as f:
+            script_texts.append(f.read())
+    words, prefixes = script_safelist(script_texts)
+    index['classes'] |= words
+    index['ids'] |= words
+    index['tags'] |= {word.lower() for word in words}
+    index['prefixes'] = prefixes
+
+    print(f"Indexed {len(html_files)} page(s) and {len(script_files)} script(s): {len(index['tags'])} tag(s), "
+          f"{len(index['classes'])} class(es), {len(index['ids'])} id(s), {len(prefixes)} safelisted prefix(es).")
+    return index
+
+def selector_used(selector, index, safelist=()):
+    """True if selector may match something on the site (set lookups only)."""
+    tags, classes, ids = css_rules.required_tokens(selector)
+    prefixes = tuple(index['prefixes'])
+    for name in classes:
+        if name not in index['classes'] and not name.startswith(prefixes) \
+                and not any(pattern.search(name) for pattern in safelist):
+            return False
+    for name in ids:
+        if name not in index['ids'] and not any(pattern.search(name) for pattern in safelist):
+            return False
+    return tags <= index['tags']
+# --- END OF SELECTOR INDEX ---
+
+
+def prune_stylesheet(item, index, safelist=()):
+    """
+    Writes the (source_path, target_path) stylesheet without the style rules
+    no selector of which can match, and without @media/@supports blocks left
+    empty. Other at-rules are kept; if nothing could be removed the source
+    is copied unchanged. Returns (source_bytes, pruned_bytes).
+    """
+    source_path, target_path = item
+    css_text = css_rules.read_stylesheet(source_path)
+    rules = css_rules.parse_stylesheet(css_text)
+    kept = css_rules.filter_rules(rules, lambda rule: rule['type'] != 'style' or any(
+        selector_used(selector, index, safelist) for selector in css_rules.split_selectors(rule['selector'])
+    ))
+    pruned = css_rules.serialize_rules(kept)
+    if len(pruned) >= len(css_text):
+        pruned = css_text
+
+    os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(pruned)
+        os.replace(tmp_path, target_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return len(css_text.encode('utf-8')), len(pruned.encode('utf-8'))
+
+def find_stylesheets(site_root):
+    """Returns the sorted list of .css files under site_root."""
+    return sorted(
+        os.path.join(root, file_name)
+        for root, _, files in os.walk(site_root)
+        for file_name in files if file_name.endswith('.css')
+    )
+
+def print_report(rows, site_root, report_path=None):
+    """Prints the bytes removed per stylesheet, largest savings first, and optionally writes them as CSV."""
+    rows = sorted(rows, key=lambda row: row[1] - row[2], reverse=True)
+    for source_path, source_bytes, pruned_bytes in rows:
+        print(f"  {site_relative(source_path, site_root)}: {source_bytes / 1024:.1f} KB -> {pruned_bytes / 1024:.1f} KB "
+              f"(-{(source_bytes - pruned_bytes) / 1024:.1f} KB)")
+    total_source = sum(row[1] for row in rows)
+    total_pruned = sum(row[2] for row in rows)
+    if total_source:
+        print(f"\nPruned {len(rows)} stylesheet(s): {total_source / 1024:.1f} KB -> {total_pruned / 1024:.1f} KB "
+              f"({(total_source - total_pruned) / total_source * 100:.0f}% removed).")
+
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stylesheet', 'source_bytes', 'pruned_bytes', 'removed_bytes'])
+            for source_path, source_bytes, pruned_bytes in rows:
+                writer.writerow([site_relative(source_path, site_root), source_bytes, pruned_bytes,
+                                 source_bytes - pruned_bytes])
+        print(f"Wrote size report to {report_path}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write copies of every stylesheet without the rules that match nothing in the site's HTML and scripts."
+    )
+    parser.add_argument("site_root", help="The publish directory (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR,
+                        help=f"Where to write the pruned copies, mirroring the site layout (default: {DEFAULT_OUTPUT_DIR}).")
+    parser.add_argument("--in-place", action="store_true", help="Overwrite the stylesheets instead of writing copies.")
+    parser.add_argument("--safelist", action="append", default=[], metavar="REGEX",
+                        help="Keep classes and ids matching this pattern (repeatable), e.g. for names built at runtime.")
+    parser.add_argument("--report", help="Also write the bytes removed per stylesheet to this CSV file.")
+    add_jobs_argument(parser)
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    index = build_selector_index(args.site_root, args.jobs)
+    safelist = [re.compile(pattern) for pattern in args.safelist]
+    stylesheets = find_stylesheets(args.site_root)
+    items = [
+        (path, path if args.in_place else os.path.join(args.output_dir, *site_relative(path, args.site_root).split('/')))
+        for path in stylesheets
+    ]
+    results = run_in_pool(partial(prune_stylesheet, index=index, safelist=safelist), items, args.jobs)
+    rows = [(path, *result) for path, result in zip(stylesheets, results) if result]
+    print_report(rows, args.site_root, args.report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+import re
+import sys
+import argparse
+import tempfile
+from functools import partial
+from bs4 import BeautifulSoup
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed to resize, see main()
+    Image = None
+
+import lazy
+from parallel import run_in_pool, add_jobs_argument
+from build_manifest import run_cached, run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from site_paths import resolve_url, strip_query, site_relative
+from image_dimensions import image_size
+from prefilter import image_tags
+
+# Widths (in CSS pixels at 1x) of the variants generated for each image
+BREAKPOINTS = [480, 768, 1024, 1600]
+
+DEFAULT_QUALITY = 80
+
+RASTER_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# --- START OF IMAGE HELPERS ---
+def variant_path(source_path, width):
+    """Returns the path of the width variant of source_path (photo.jpg -> photo-480w.webp)."""
+    return f"{os.path.splitext(source_path)[0]}-{width}w.webp"
+
+def variant_url(url, variant_file):
+    """Returns url with its file name replaced by variant_file's (query string dropped)."""
+    base = strip_query(url)
+    directory = base.rsplit('/', 1)[0] + '/' if '/' in base else ''
+    return directory + os.path.basename(variant_file)
+
+def variant_widths(source_width, breakpoints):
+    """Breakpoints narrower than the source; we never upscale."""
+    return [width for width in sorted(breakpoints) if width < source_width]
+
+def resize_to_webp(item, quality=DEFAULT_QUALITY):
+    """
+    Writes one (source_path, target_path, width) variant as WebP through a
+    temporary file. Returns the size of the variant in bytes.
+    """
+    source_path, target_path, width = item
+    with Image.open(source_path) as image:
+        height = max(1, round(image.height * width / image.width))
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        resized = image.convert('RGBA' if has_alpha else 'RGB').resize((width, height), Image.LANCZOS)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            resized.save(f, 'WEBP', quality=quality, method=6)
+        os.replace(tmp_path, target_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return os.path.getsize(target_path)
+# --- END OF IMAGE HELPERS ---
+
+
+# --- START OF HTML PROCESSING ---
+def _first_srcset_url(srcset):
+    candidate = srcset.split(',')[0].strip()
+    return candidate.split()[0] if candidate else None
+
+def _has_unlisted_variants(data, file_path, site_root):
+    """True if an <img>/<source> of the raw page has a width variant on disk its tag doesn't list yet."""
+    for name, tag, attributes in image_tags(data):
+        url = attributes.get('src') if name == 'img' else _first_srcset_url(attributes.get('srcset') or '')
+        local_path = resolve_url(url or '', file_path, site_root)
+        if not local_path or not local_path.lower().endswith(RASTER_EXTENSIONS):
+            continue
+        for width in BREAKPOINTS:
+            variant_file = variant_path(local_path, width)
+            if tag.find(os.path.basename(variant_file).encode('utf-8')) == -1 and os.path.isfile(variant_file):
+                return True
+    return False
+
+# Pages whose images list every variant on disk already have nothing to do (see prefilter.py)
+RESPONSIVE_TRIGGER = _has_unlisted_variants
+
+def responsive_candidates(soup, file_path, site_root):
+    """
+    Yields (tag, url, local_path) for every <img src> and <source srcset>
+    that points to a local raster image.
+    """
+    for tag in soup.find_all(['img', 'source']):
+        if tag.name == 'img':
+            url = tag.get('src')
+        else:
+            # A <source> declaring another format can't list WebP variants
+            if tag.get('type') not in (None, 'image/webp'):
+                continue
+            url = _first_srcset_url(tag.get('srcset') or '')
+        if not url:
+            continue
+        local_path = resolve_url(url, file_path, site_root)
+        if (local_path and local_path.lower().endswith(RASTER_EXTENSIONS)
+                and os.path.isfile(local_path)):
+            yield tag, url, local_path
+
+def sizes_for(tag):
+    """
+    Keeps an existing sizes attribute; otherwise uses the WordPress default
+    for images with a known width, and the full viewport width as fallback.
+    """
+    if tag.get('sizes'):
+        return tag['sizes']
+    img = tag if tag.name == 'img' else (tag.parent.find('img') if tag.parent else None)
+    width = img.get('width') if img else None
+    if width and str(width).isdigit():
+        return f"(max-width: {width}px) 100vw, {width}px"
+    return "100vw"
+
+def apply_responsive_srcset(soup, file_path, site_root, breakpoints=BREAKPOINTS):
+    """
+    Writes srcset/sizes listing the generated width variants that exist on
+    disk for every local <img>/<source> image. Returns True if changed.
+    """
+    changed = False
+    for tag, url, local_path in responsive_candidates(soup, file_path, site_root):
+        size = image_size(local_path)
+        if not size:
+            continue
+        candidates = [
+            (variant_url(url, variant_path(local_path, width)), width)
+            for width in variant_widths(size[0], breakpoints)
+            if os.path.isfile(variant_path(local_path, width))
+        ]
+        if not candidates:
+            continue
+        # The original closes the list unless a WebP-only <source> can't take it
+        if tag.name == 'img' or local_path.lower().endswith('.webp'):
+            candidates.append((strip_query(url), size[0]))
+
+        new_srcset = ', '.join(f"{candidate_url} {width}w" for candidate_url, width in candidates)
+        new_sizes = sizes_for(tag)
+        if tag.get('srcset') != new_srcset or tag.get('sizes') != new_sizes:
+            tag['srcset'] = new_srcset
+            tag['sizes'] = new_sizes
+            changed = True
+    return changed
+
+def collect_sources(file_path, site_root):
+    """Returns the local images in one HTML file that can get width variants."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+    return sorted({local_path for _, _, local_path in responsive_candidates(soup, file_path, site_root)})
+
+def process_html_file(file_path, site_root, breakpoints=BREAKPOINTS):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            soup = BeautifulSoup(f.read(), 'html.parser')
+        if apply_responsive_srcset(soup, file_path, site_root, breakpoints):
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(str(soup))
+            print(f"Modified: {file_path}")
+            return True
+        return False
+    except Exception as e:
+        print(f"Error processing {file_path}: {e}")
+        return None
+# --- END OF HTML PROCESSING ---
+
+
+def generate_variants(site_root, html_files, breakpoints=BREAKPOINTS, quality=DEFAULT_QUALITY, jobs=None, manifest=None):
+    """
+    Produces the missing WebP width variants of every image referenced by
+    html_files, in parallel and cached in the manifest by source hash.
+    Returns the number of variants written.
+    """
+    per_file_sources = run_in_pool(partial(collect_sources, site_root=site_root), html_files, jobs)
+    sources = sorted({path for paths in per_file_sources if paths for path in paths})
+
+    items = []
+    for source_path in sources:
+        size = image_size(source_path)
+        if not size:
+            continue
+        for width in variant_widths(size[0], breakpoints):
+            items.append((source_path, variant_path(source_path, width), width))
+
+    print(f"Found {len(sources)} image(s) needing up to {len(items)} width variant(s).")
+    version = tool_version(sys.modules[__name__])
+    results, cached_items = run_cached(partial(resize_to_webp, quality=quality), items, jobs, manifest,
+                                       'responsive_images', version, config={'quality': quality})
+    cached = set(cached_items)
+    stale_items = [item for item in items if item not in cached]
+    for (source_path, target_path, width), variant_bytes in zip(stale_items, results):
+        if variant_bytes is not None:
+            print(f"  {site_relative(target_path, site_root)}: {variant_bytes / 1024:.1f} KB")
+    return sum(1 for variant_bytes in results if variant_bytes is not None)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate resized WebP variants at fixed breakpoints and write srcset/sizes on <img> and <source> tags."
+    )
+    parser.add_argument("site_root", help="The root of the mirrored site (e.g. evolves/www.evolves.tech).")
+    parser.add_argument(
+        "--breakpoints",
+        type=lambda value: [int(width) for width in value.split(',')],
+        default=BREAKPOINTS,
+        help=f"Comma-separated variant widths in pixels (default: {','.join(map(str, BREAKPOINTS))})."
+    )
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help=f"WebP quality 0-100 (default: {DEFAULT_QUALITY}).")
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    args = parser.parse_args()
+
+    if Image is None:
+        print("Error: Pillow is required to read and resize images (pip install Pillow).", file=sys.stderr)
+        sys.exit(1)
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    manifest = manifest_from_args(args)
+    html_files = lazy.find_html_files(args.site_root)
+    written = generate_variants(args.site_root, html_files, args.breakpoints, args.quality, args.jobs, manifest)
+    print(f"Wrote {written} variant(s).\n")
+
+    print("Writing srcset/sizes...")
+    # Which variants exist is an input of the rewrite, so it is part of the config
+    variants = sorted(
+        site_relative(os.path.join(root, name), args.site_root)
+        for root, _, files in os.walk(args.site_root)
+        for name in files if re.search(r'-\d+w\.webp$', name)
+    )
+    run_incremental(partial(process_html_file, site_root=args.site_root, breakpoints=args.breakpoints),
+                    html_files, args.jobs, manifest, 'responsive_images:html', tool_version(sys.modules[__name__]),
+                    config={'breakpoints': args.breakpoints, 'variants': variants})
+
+if __name__ == "__main__":
+    main()
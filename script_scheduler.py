@@ -0,0 +1,256 @@
+import os
+import re
+import base64
+from functools import lru_cache
+
+from site_paths import resolve_url, is_site_url
+
+# Script types that run as classic JavaScript
+CLASSIC_SCRIPT_TYPES = (None, '', 'text/javascript', 'application/javascript', 'text/ecmascript')
+
+# Type given to scripts held back until the first user interaction
+DELAYED_SCRIPT_TYPE = 'text/delayed-javascript'
+
+DELAYED_LOADER_ID = 'delayed-scripts-loader'
+
+# Runs the delayed scripts, in document order, on the first user interaction
+DELAYED_LOADER = (
+    "(function(){var events=['keydown','mousedown','mousemove','touchstart','scroll','wheel'],started=false;"
+    "function start(){if(started)return;started=true;"
+    "events.forEach(function(e){removeEventListener(e,start,{passive:true})});"
+    "var scripts=[].slice.call(document.querySelectorAll('script[type=\"" + DELAYED_SCRIPT_TYPE + "\"]'));"
+    "(function next(){var old=scripts.shift();if(!old)return;var s=document.createElement('script');"
+    "[].forEach.call(old.attributes,function(a){if(a.name!=='type'&&a.name!=='data-src')s.setAttribute(a.name,a.value)});"
+    "if(old.hasAttribute('data-src')){s.onload=s.onerror=next;s.src=old.getAttribute('data-src');old.parentNode.replaceChild(s,old)}"
+    "else{s.text=old.text;old.parentNode.replaceChild(s,old);next()}})()}"
+    "events.forEach(function(e){addEventListener(e,start,{passive:true})})})();"
+)
+
+# Globals of well-known libraries whose builds don't assign them as window.X = ...
+KNOWN_GLOBALS = [
+    (re.compile(r'(?:^|/)jquery(?:\.min)?[0-9a-f]*\.js$'), {'jQuery', '$'}),
+    (re.compile(r'(?:^|/)underscore(?:\.min)?[0-9a-f]*\.js$'), {'_'}),
+]
+
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z_$][\w$]*')
+DECLARATION_PATTERN = re.compile(r'\b(?:var|let|const|function|class)\s+([A-Za-z_$][\w$]*)')
+WINDOW_ASSIGNMENT_PATTERN = re.compile(r'\bwindow\.([A-Za-z_$][\w$]*)\s*=[^=]')
+
+# window properties that scripts assign without defining a new global
+BUILTIN_GLOBALS = {'location', 'onload', 'onerror', 'onresize', 'onscroll', 'name', 'status'}
+
+# --- START OF DEPENDENCY ANALYSIS ---
+def _top_level_text(text):
+    """
+    Returns text with everything nested in braces blanked out, or None if
+    the braces don't balance (e.g. a brace inside a regex literal threw the
+    count off), in which case callers must fall back to the whole text.
+    """
+    out, depth, i, start = [], 0, 0, 0
+    while i < len(text):
+        c = text[i]
+        if c in '"\'`':
+            end = i + 1
+            while end < len(text) and text[end] != c:
+                end += 2 if text[end] == '\\' else 1
+            i = end + 1
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = len(text) if end == -1 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = len(text) if end == -1 else end + 2
+        elif c == '{':
+            if depth == 0:
+                out.append(text[start:i])
+            depth += 1
+            i += 1
+        elif c == '}':
+            depth -= 1
+            if depth < 0:
+                return None
+            if depth == 0:
+                out.append(' ')
+                start = i + 1
+            i += 1
+        else:
+            i += 1
+    if depth != 0:
+        return None
+    out.append(text[start:])
+    return ''.join(out)
+
+def provided_globals(text, path=''):
+    """
+    Returns the globals a script may define: its top-level declarations,
+    window.X assignments anywhere, and the known globals of its library.
+    When the top level can't be told apart, all declarations count.
+    """
+    top_level = _top_level_text(text)
+    declarations = DECLARATION_PATTERN.findall(text if top_level is None else top_level)
+    provided = set(declarations) | set(WINDOW_ASSIGNMENT_PATTERN.findall(text))
+    for pattern, names in KNOWN_GLOBALS:
+        if pattern.search(path):
+            provided |= names
+    return provided - BUILTIN_GLOBALS
+
+def used_identifiers(text):
+    return set(IDENTIFIER_PATTERN.findall(text))
+
+@lru_cache(maxsize=None)
+def _external_script_info(local_path):
+    """(provides, uses, writes_document) of a local script file, cached per process."""
+    with open(local_path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    return provided_globals(text, local_path.replace(os.sep, '/')), used_identifiers(text), 'document.write' in text
+
+def _data_url_text(src):
+    """Returns the code of a data:text/javascript URL, or None."""
+    match = re.match(r'data:(?:text|application)/javascript(;base64)?,(.*)', src, re.DOTALL)
+    if not match:
+        return None
+    if match.group(1):
+        return base64.b64decode(match.group(2)).decode('utf-8', errors='replace')
+    return match.group(2)
+
+def script_nodes(soup, file_path=None, site_root=None):
+    """
+    Returns one dict per classic script in document order with its tag,
+    label, original mode ('inline', 'blocking', 'defer' or 'async'),
+    provided globals, used identifiers, whether it calls document.write,
+    whether it is third-party, and the indexes of the earlier scripts it
+    depends on (those defining a global it uses). A synchronous script whose
+    code can't be read (e.g. third-party) may define anything, so every
+    later script depends on it; async and defer scripts were already
+    declared independent by their authors.
+    """
+    nodes = []
+    for index, script in enumerate(soup.find_all('script')):
+        script_type = (script.get('type') or '').strip().lower()
+        if script_type not in CLASSIC_SCRIPT_TYPES:
+            continue
+        src = script.get('src')
+        node = {'tag': script, 'label': src or f"inline #{script.get('id') or index}", 'third_party': False}
+        text = _data_url_text(src) if src else (script.string or '')
+        if src and text is None:
+            node['mode'] = 'async' if script.has_attr('async') else 'defer' if script.has_attr('defer') else 'blocking'
+            node['third_party'] = not is_site_url(src)
+            local_path = resolve_url(src, file_path, site_root) if file_path and site_root else None
+            if local_path and os.path.isfile(local_path):
+                node['provides'], node['uses'], node['writes'] = _external_script_info(local_path)
+            else:
+                node['provides'] = provided_globals('', src)
+                node['uses'], node['writes'] = set(), False
+                node['opaque'] = node['mode'] == 'blocking' and not node['provides']
+        else:
+            node['mode'] = 'defer' if src else 'inline'
+            node['provides'], node['uses'] = provided_globals(text), used_identifiers(text)
+            node['writes'] = 'document.write' in text
+        nodes.append(node)
+
+    for i, node in enumerate(nodes):
+        node['depends'] = {j for j in range(i) if nodes[j].get('opaque') or nodes[j]['provides'] & node['uses']}
+    return nodes
+
+def _closure(nodes, start):
+    """Returns start plus every script the scripts in start depend on, transitively."""
+    result, stack = set(start), list(start)
+    while stack:
+        for j in nodes[stack.pop()]['depends']:
+            if j not in result:
+                result.add(j)
+                stack.append(j)
+    return result
+# --- END OF DEPENDENCY ANALYSIS ---
+
+
+def plan_schedule(nodes, delay_third_party=False):
+    """
+    Chooses the final mode of every script:
+      'inline'       inline script left where it is (runs during parsing)
+      'blocking'     external script kept synchronous because a script that
+                     must run during parsing depends on it
+      'defer'        external script deferred (runs in order after parsing)
+      'defer-inline' inline script depending on a deferred script; deferred
+                     with it as a data: URL so the chain keeps its order
+      'async'        left async
+      'delayed'      third-party script (or an inline script depending on
+                     one) run on the first user interaction
+    Scripts calling document.write, and everything they depend on, stay
+    where they are. Returns a list of (mode, reason) in node order.
+    """
+    pinned = [i for i, node in enumerate(nodes) if node['writes'] and node['mode'] in ('inline', 'blocking')]
+    fixed = _closure(nodes, pinned)
+
+    modes = []
+    for i, node in enumerate(nodes):
+        if node['mode'] == 'async':
+            modes.append('async')
+        elif node['mode'] == 'inline':
+            deferred_dependency = any(modes[j] in ('defer', 'defer-inline') for j in node['depends'])
+            modes.append('defer-inline' if deferred_dependency and i not in fixed else 'inline')
+        elif node['mode'] == 'blocking' and i in fixed:
+            modes.append('blocking')
+        else:
+            modes.append('defer')
+
+    if delay_third_party:
+        undelayable = set()
+        while True:
+            delayed = {i for i, node in enumerate(nodes)
+                       if node['third_party'] and modes[i] in ('defer', 'async') and i not in undelayable}
+            for i, node in enumerate(nodes):
+                if modes[i] in ('inline', 'defer-inline') and i not in fixed and node['depends'] & delayed:
+                    delayed.add(i)
+            # A script that runs earlier can't depend on a delayed one
+            blocked = {j for i in range(len(nodes)) if i not in delayed for j in nodes[i]['depends'] & delayed}
+            if not blocked:
+                break
+            undelayable |= _closure(nodes, blocked)
+        for i in delayed:
+            modes[i] = 'delayed'
+
+    reasons = []
+    for i, node in enumerate(nodes):
+        if modes[i] == 'blocking' or (modes[i] == 'inline' and i in fixed and i not in pinned):
+            reasons.append('needed during parsing by a script calling document.write')
+        elif modes[i] == 'inline' and i in pinned:
+            reasons.append('calls document.write')
+        elif modes[i] == 'defer-inline':
+            reasons.append('depends on ' + ', '.join(nodes[j]['label'] for j in sorted(node['depends'])
+                                                     if modes[j] in ('defer', 'defer-inline')))
+        else:
+            reasons.append('')
+    return list(zip(modes, reasons))
+
+def schedule_scripts(soup, file_path=None, site_root=None, delay_third_party=False):
+    """
+    Replaces the blanket defer: defers external scripts together with the
+    inline scripts depending on them, keeps what must run during parsing,
+    and optionally delays third-party scripts until the first interaction.
+    Returns report rows of (label, mode, reason), one per classic script.
+    """
+    nodes = script_nodes(soup, file_path, site_root)
+    plan = plan_schedule(nodes, delay_third_party)
+
+    for node, (mode, _) in zip(nodes, plan):
+        script = node['tag']
+        if mode == 'defer' and not script.has_attr('defer'):
+            script['defer'] = True
+        elif mode == 'defer-inline':
+            code = script.string or ''
+            script.string = ''
+            script['src'] = 'data:text/javascript;base64,' + base64.b64encode(code.encode('utf-8')).decode('ascii')
+            script['defer'] = True
+        elif mode == 'delayed':
+            if script.get('src'):
+                script['data-src'] = script['src']
+                del script['src']
+            script['type'] = DELAYED_SCRIPT_TYPE
+
+    if any(mode == 'delayed' for mode, _ in plan) and not soup.find('script', id=DELAYED_LOADER_ID):
+        loader = soup.new_tag('script', id=DELAYED_LOADER_ID)
+        loader.string = DELAYED_LOADER
+        (soup.body or soup).append(loader)
+
+    return [(node['label'], mode, reason) for node, (mode, reason) in zip(nodes, plan)]
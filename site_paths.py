@@ -0,0 +1,57 @@
+import os
+import posixpath
+from urllib.parse import urlsplit, unquote
+
+# Absolute URLs on these origins point into the mirrored site root
+SITE_ORIGINS = ('https://www.evolves.tech', 'http://www.evolves.tech', '//www.evolves.tech')
+
+def strip_query(url):
+    """Removes the query string and fragment from a URL."""
+    return url.split('#', 1)[0].split('?', 1)[0]
+
+def is_site_url(url):
+    """True if url points into the mirrored site (relative, root-relative or on a site origin)."""
+    if not url or url.startswith(('data:', 'mailto:', 'tel:', 'javascript:', '#')):
+        return False
+    if url.startswith(SITE_ORIGINS):
+        return True
+    return not urlsplit(url).scheme and not url.startswith('//')
+
+def resolve_url(url, referrer_path, site_root):
+    """
+    Resolves a URL found in referrer_path (an HTML or CSS file under
+    site_root) to a normalized local file path, or None if it points outside
+    the mirrored site. The file does not have to exist.
+    """
+    url = url.strip().replace('\\/', '/') if url else url
+    if not is_site_url(url):
+        return None
+    for origin in SITE_ORIGINS:
+        if url.startswith(origin):
+            url = url[len(origin):] or '/'
+            break
+
+    path = unquote(strip_query(url))
+    if not path:
+        return None
+    if path.startswith('/'):
+        relative = posixpath.normpath(path.lstrip('/'))
+    else:
+        referrer_dir = os.path.relpath(os.path.dirname(os.path.abspath(referrer_path)), os.path.abspath(site_root))
+        referrer_dir = '' if referrer_dir == '.' else referrer_dir.replace(os.sep, '/')
+        relative = posixpath.normpath(posixpath.join(referrer_dir, path))
+    if relative.startswith('..'):
+        return None
+    return os.path.join(site_root, *relative.split('/'))
+
+def site_relative(path, site_root):
+    """Returns path relative to site_root with forward slashes (e.g. 'wp-content/a.css')."""
+    return os.path.relpath(path, site_root).replace(os.sep, '/')
+
+def page_url(relative):
+    """The root-relative URL a page is served at: '/a/b.html', or '/a/' for a directory index."""
+    if relative == 'index.html':
+        return '/'
+    if relative.endswith('/index.html'):
+        return '/' + relative[:-len('index.html')]
+    return '/' + relative
@@ -1,6 +1,15 @@
 import os
+import sys
+import shutil
+import argparse
+import tempfile
+from functools import partial
+from urllib.parse import unquote
 from bs4 import BeautifulSoup, NavigableString
 import re
+from parallel import add_jobs_argument
+from build_manifest import run_incremental, tool_version, add_manifest_arguments, manifest_from_args
+from prefilter import partition_files, print_skipped
 
 # --- START OF REGEX PATTERNS ---
 
@@ -26,9 +35,85 @@ JS_IMG_URL_PATTERN = re.compile(
     r'\1',  # Matches the same opening quote
     re.IGNORECASE
 )
+
+# Uploads of the live site still listed in some srcsets of the mirror
+LIVE_SITE_CONTENT_URL = 'https://www.evolves.tech/wp-content'
+
+# Every reference rewritten ends in one of these extensions, so files without
+# them are never read as text or parsed (see prefilter.py)
+WEBP_TRIGGER = re.compile(rb'\.(?:png|jpe?g)', re.IGNORECASE)
+
+# The end of a .png/.jpg/.jpeg reference in raw bytes, and the bytes one
+# can start after (see webp_target_trigger()); URLs are looked for at most
+# MAX_URL_BYTES back, which also keeps long data: URIs cheap
+IMAGE_EXTENSION_PATTERN = re.compile(rb'''\.(?:png|jpe?g)(?=[\s"'`)?#,&\\]|$)''', re.IGNORECASE)
+URL_DELIMITERS = tuple(bytes([byte]) for byte in b''' \t\r\n"'`()<>,=;''')
+MAX_URL_BYTES = 512
+LIVE_SRCSET_PATTERN = re.compile(rb'''\bsrcset\s*=\s*["']?[^"'>]*''' + re.escape(LIVE_SITE_CONTENT_URL.encode('ascii')),
+                                 re.IGNORECASE)
 # --- END OF REGEX PATTERNS ---
 
 
+# --- START OF TARGET CHECKING ---
+def webp_target_checker(file_path, site_root):
+    """
+    Returns a function telling whether the .webp file a rewritten URL points
+    to exists on disk. Root-relative URLs resolve against site_root; relative
+    ones against the referencing file's directory, then against site_root
+    (JS string literals are usually relative to the page, not the script).
+    """
+    base_dir = os.path.dirname(file_path)
+
+    def target_exists(url):
+        path = unquote(url.split('?', 1)[0].split('#', 1)[0])
+        if path.startswith('/'):
+            return os.path.isfile(os.path.join(site_root, path.lstrip('/')))
+        return (os.path.isfile(os.path.join(base_dir, path)) or
+                os.path.isfile(os.path.join(site_root, path)))
+
+    return target_exists
+
+def webp_target_trigger(data, file_path, site_root):
+    """
+    Trigger for rewriting with target checks (see prefilter.py): True if
+    the raw bytes reference a local .png/.jpg/.jpeg whose .webp exists, or
+    a srcset still lists uploads of the live site. References without a
+    .webp don't keep a converted file coming back to the parser.
+    """
+    if LIVE_SRCSET_PATTERN.search(data):
+        return True
+    target_exists = webp_target_checker(file_path, site_root)
+    for match_obj in IMAGE_EXTENSION_PATTERN.finditer(data):
+        window = data[max(0, match_obj.start() - MAX_URL_BYTES):match_obj.end()]
+        start = max(window.rfind(delimiter) for delimiter in URL_DELIMITERS) + 1
+        url = window[start:].decode('utf-8', 'replace').replace('\\/', '/')
+        if start == 0 or url.startswith(('https:', 'http:', '//', 'data:')):
+            continue
+        if target_exists(re.sub(r'\.(?:png|jpe?g)$', '.webp', url, flags=re.IGNORECASE)):
+            return True
+    return False
+
+def subn_existing_targets(pattern, callback, text, target_exists=None):
+    """
+    Runs pattern.subn(callback, text) for the CSS/JS patterns above, but leaves
+    a match untouched when target_exists is given and its .webp target is missing.
+    Returns the modified text and the number of rewritten references.
+    """
+    if target_exists is None:
+        return pattern.subn(callback, text)
+
+    replacements = 0
+    def checked_callback(match_obj):
+        nonlocal replacements
+        new_image_path = re.sub(r'\.(png|jpg|jpeg)$', '.webp', match_obj.group(2), flags=re.IGNORECASE)
+        if not target_exists(new_image_path):
+            return match_obj.group(0)
+        replacements += 1
+        return callback(match_obj)
+    return pattern.sub(checked_callback, text), replacements
+# --- END OF TARGET CHECKING ---
+
+
 # --- START OF CSS PROCESSING FUNCTIONS ---
 def replace_css_image_path_to_webp(match_obj):
     """Callback function for re.sub to replace image extension in a CSS url() path."""
@@ -37,12 +122,13 @@ def replace_css_image_path_to_webp(match_obj):
     new_image_path = re.sub(r'\.(png|jpg|jpeg)$', '.webp', image_path, flags=re.IGNORECASE)
     return f'url({quote}{new_image_path}{quote})'
 
-def update_css_text_content(css_text):
+def update_css_text_content(css_text, target_exists=None):
     """
     Updates internal image URLs to .webp within a string of CSS content.
     Returns the modified CSS text and a boolean indicating if changes were made.
     """
-    modified_css_text, num_replacements = CSS_URL_PATTERN.subn(replace_css_image_path_to_webp, css_text)
+    modified_css_text, num_replacements = subn_existing_targets(
+        CSS_URL_PATTERN, replace_css_image_path_to_webp, css_text, target_exists)
     return modified_css_text, num_replacements > 0
 # --- END OF CSS PROCESSING FUNCTIONS ---
 
@@ -55,20 +141,22 @@ def replace_js_image_path_to_webp(match_obj):
     new_image_path = re.sub(r'\.(png|jpg|jpeg)$', '.webp', image_path, flags=re.IGNORECASE)
     return f'{quote}{new_image_path}{quote}'
 
-def update_js_text_content(js_text):
+def update_js_text_content(js_text, target_exists=None):
     """
     Updates internal image URLs within string literals in JS content to .webp.
     Returns the modified JS text and a boolean indicating if changes were made.
     """
-    modified_js_text, num_replacements = JS_IMG_URL_PATTERN.subn(replace_js_image_path_to_webp, js_text)
+    modified_js_text, num_replacements = subn_existing_targets(
+        JS_IMG_URL_PATTERN, replace_js_image_path_to_webp, js_text, target_exists)
     return modified_js_text, num_replacements > 0
 # --- END OF JS PROCESSING FUNCTIONS ---
 
 
 # --- START OF HTML ATTRIBUTE PROCESSING (srcset) ---
-def process_srcset_attribute(srcset_value):
+def process_srcset_attribute(srcset_value, target_exists=None):
     """
     Processes a srcset attribute string, converting internal image URLs to .webp.
+    URLs whose .webp target fails target_exists (when given) are kept as they are.
     Returns the modified srcset string and a boolean indicating if changes were made.
     """
     if not srcset_value:
@@ -101,6 +189,8 @@ def process_srcset_attribute(srcset_value):
 
         if is_internal_image:
             new_url = re.sub(r'\.(png|jpg|jpeg)$', '.webp', url, flags=re.IGNORECASE)
+            if target_exists and not target_exists(new_url):
+                new_url = url
             if new_url != url:
                 changed_overall = True
             new_parts.append(new_url + descriptor)
@@ -110,174 +200,512 @@ def process_srcset_attribute(srcset_value):
     if changed_overall:
         return ', '.join(new_parts), True
     return srcset_value, False
+
+def localize_live_srcset(srcset_value, target_exists=None):
+    """
+    For the srcset of a local <img> that still lists the live site's
+    uploads (https://www.evolves.tech/wp-content/...): makes those candidates
+    root-relative, so they are served from the mirror with their widths
+    kept, and converts them to .webp like any other internal candidate.
+    The responsive stage later replaces the list if it generated variants.
+    Returns the modified srcset string and a boolean indicating if changes were made.
+    """
+    if not srcset_value or LIVE_SITE_CONTENT_URL not in srcset_value:
+        return srcset_value, False
+    localized = srcset_value.replace(LIVE_SITE_CONTENT_URL, '/wp-content')
+    return process_srcset_attribute(localized, target_exists)[0], True
 # --- END OF HTML ATTRIBUTE PROCESSING (srcset) ---
 
 
 # --- START OF FILE PROCESSING FUNCTIONS ---
-def process_html_file(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-        soup = BeautifulSoup(content, 'html.parser')
-        file_modified_overall = False
-
-        # --- Process <img> tags ---
-        img_tags = soup.find_all('img')
-        for img_tag in img_tags:
-            original_src = img_tag.get('src')
-            original_srcset = img_tag.get('srcset') # Save for evolves.tech logic
-            tag_modified_this_iteration = False
-
-            # 1. Initial Skip (mimicking original script's first skip condition for <img>)
-            if original_src and original_src.startswith('https://') and not original_srcset:
-                continue
-
-            # 2. Process 'src' attribute: convert to .webp if internal
-            current_src = img_tag.get('src')
-            if current_src and not current_src.startswith(('https://', '//', 'data:')):
-                if re.search(r'\.(png|jpg|jpeg)$', current_src, re.IGNORECASE):
-                    new_src = re.sub(r'\.(png|jpg|jpeg)$', '.webp', current_src, flags=re.IGNORECASE)
-                    if new_src != current_src:
-                        img_tag['src'] = new_src
-                        tag_modified_this_iteration = True
-            
-            # 3. Process 'srcset' attribute: convert internal images to .webp
-            current_srcset = img_tag.get('srcset')
-            if current_srcset:
-                modified_srcset_val, srcset_content_changed = process_srcset_attribute(current_srcset)
-                if srcset_content_changed:
-                    img_tag['srcset'] = modified_srcset_val
+def update_soup_image_references(soup, target_exists=None):
+    """
+    Rewrites internal .png/.jpg/.jpeg references to .webp on a parsed document
+    (img/source srcset, link href, <style> bodies and style attributes).
+    With target_exists, references whose .webp file is missing are left alone.
+    Returns True if the tree was modified.
+    """
+    file_modified_overall = False
+
+    # --- Process <img> tags ---
+    img_tags = soup.find_all('img')
+    for img_tag in img_tags:
+        original_src = img_tag.get('src')
+        original_srcset = img_tag.get('srcset') # Save for the initial skip below
+        tag_modified_this_iteration = False
+
+        # 1. Initial Skip (mimicking original script's first skip condition for <img>)
+        if original_src and original_src.startswith('https://') and not original_srcset:
+            continue
+
+        # 2. Process 'src' attribute: convert to .webp if internal
+        current_src = img_tag.get('src')
+        if current_src and not current_src.startswith(('https://', '//', 'data:')):
+            if re.search(r'\.(png|jpg|jpeg)$', current_src, re.IGNORECASE):
+                new_src = re.sub(r'\.(png|jpg|jpeg)$', '.webp', current_src, flags=re.IGNORECASE)
+                if new_src != current_src and (target_exists is None or target_exists(new_src)):
+                    img_tag['src'] = new_src
                     tag_modified_this_iteration = True
-            
-            # 4. evolves.tech cleanup specific to <img>
-            final_src_on_tag = img_tag.get('src') # Get src after potential .webp conversion
-            final_src_is_internal = (final_src_on_tag and 
-                                     not final_src_on_tag.startswith(('https://', '//', 'data:')))
-            
-            original_srcset_had_evolves = (original_srcset and 
-                                           'https://www.evolves.tech/wp-content' in original_srcset)
-
-            if final_src_is_internal and original_srcset_had_evolves:
-                if img_tag.has_attr('srcset'): # Check if srcset still exists (it might have been modified)
-                    del img_tag['srcset']
-                    tag_modified_this_iteration = True # Ensure modification is flagged
-            
-            if tag_modified_this_iteration:
-                file_modified_overall = True
+        
+        # 3. Process 'srcset' attribute: convert internal images to .webp
+        current_srcset = img_tag.get('srcset')
+        if current_srcset:
+            modified_srcset_val, srcset_content_changed = process_srcset_attribute(current_srcset, target_exists)
+            if srcset_content_changed:
+                img_tag['srcset'] = modified_srcset_val
+                tag_modified_this_iteration = True
+        
+        # 4. evolves.tech cleanup specific to <img>: a local image's srcset
+        # pointing at the live site is localized rather than dropped
+        final_src_on_tag = img_tag.get('src') # Get src after potential .webp conversion
+        final_src_is_internal = (final_src_on_tag and 
+                                 not final_src_on_tag.startswith(('https://', '//', 'data:')))
 
-        # --- Process <link> tags (for href attributes pointing to images) ---
-        link_tags = soup.find_all('link')
-        for link_tag in link_tags:
-            original_href = link_tag.get('href')
-            # Skip if no href, or href is external/data URI
-            if not original_href or original_href.startswith(('https://', '//', 'data:')):
-                continue
-
-            # Check if it's a PNG, JPG, or JPEG file (case-insensitive)
-            if re.search(r'\.(png|jpg|jpeg)$', original_href, re.IGNORECASE):
-                new_href = re.sub(r'\.(png|jpg|jpeg)$', '.webp', original_href, flags=re.IGNORECASE)
-                if new_href != original_href: # Ensure change actually happens
-                    link_tag['href'] = new_href
-                    file_modified_overall = True
+        if final_src_is_internal and img_tag.get('srcset'):
+            localized_srcset, srcset_localized = localize_live_srcset(img_tag['srcset'], target_exists)
+            if srcset_localized:
+                img_tag['srcset'] = localized_srcset
+                tag_modified_this_iteration = True
         
-        # --- Process <source> tags (for srcset attributes) ---
-        source_tags = soup.find_all('source')
-        for source_tag in source_tags:
-            original_srcset = source_tag.get('srcset')
-            if original_srcset: # process_srcset_attribute handles internal/external logic
-                modified_srcset, srcset_changed = process_srcset_attribute(original_srcset)
-                if srcset_changed:
-                    source_tag['srcset'] = modified_srcset
-                    file_modified_overall = True
-
-        # --- Process <style> tags ---
-        style_tags = soup.find_all('style')
-        for style_tag in style_tags:
-            css_changed_in_this_tag = False
-            new_style_contents = [] # To build the new content for the style tag
-            
-            for item in style_tag.contents:
-                if isinstance(item, NavigableString):
-                    original_css_chunk = str(item)
-                    modified_css_chunk, chunk_was_changed = update_css_text_content(original_css_chunk)
-                    if chunk_was_changed:
-                        css_changed_in_this_tag = True
-                    new_style_contents.append(NavigableString(modified_css_chunk))
-                else: # Keep comments or other non-string nodes as they are
-                    new_style_contents.append(item.copy()) # Append a copy to avoid issues if modifying tree elsewhere
-            
-            if css_changed_in_this_tag:
-                style_tag.clear() # Remove old contents
-                for new_node in new_style_contents:
-                    style_tag.append(new_node) # Add new/modified contents
+        if tag_modified_this_iteration:
+            file_modified_overall = True
+
+    # --- Process <link> tags (for href attributes pointing to images) ---
+    link_tags = soup.find_all('link')
+    for link_tag in link_tags:
+        original_href = link_tag.get('href')
+        # Skip if no href, or href is external/data URI
+        if not original_href or original_href.startswith(('https://', '//', 'data:')):
+            continue
+
+        # Check if it's a PNG, JPG, or JPEG file (case-insensitive)
+        if re.search(r'\.(png|jpg|jpeg)$', original_href, re.IGNORECASE):
+            new_href = re.sub(r'\.(png|jpg|jpeg)$', '.webp', original_href, flags=re.IGNORECASE)
+            if new_href != original_href and (target_exists is None or target_exists(new_href)):
+                link_tag['href'] = new_href
                 file_modified_overall = True
+    
+    # --- Process <source> tags (for srcset attributes) ---
+    source_tags = soup.find_all('source')
+    for source_tag in source_tags:
+        original_srcset = source_tag.get('srcset')
+        if original_srcset: # process_srcset_attribute handles internal/external logic
+            modified_srcset, srcset_changed = process_srcset_attribute(original_srcset, target_exists)
+            if srcset_changed:
+                source_tag['srcset'] = modified_srcset
+                file_modified_overall = True
+
+    # --- Process <style> tags ---
+    style_tags = soup.find_all('style')
+    for style_tag in style_tags:
+        css_changed_in_this_tag = False
+        new_style_contents = [] # To build the new content for the style tag
         
-        # --- Process style attributes on all tags ---
-        # Find all tags that *have* a style attribute
-        tags_with_style_attr = soup.find_all(attrs={"style": True})
-        for tag_with_style in tags_with_style_attr:
-            original_style_value = tag_with_style.get('style')
-            if original_style_value: # Ensure it's not empty or None
-                modified_style_value, style_attr_changed = update_css_text_content(original_style_value)
-                if style_attr_changed:
-                    tag_with_style['style'] = modified_style_value
-                    file_modified_overall = True
+        for item in style_tag.contents:
+            if isinstance(item, NavigableString):
+                original_css_chunk = str(item)
+                modified_css_chunk, chunk_was_changed = update_css_text_content(original_css_chunk, target_exists)
+                if chunk_was_changed:
+                    css_changed_in_this_tag = True
+                new_style_contents.append(NavigableString(modified_css_chunk))
+            else: # Keep comments or other non-string nodes as they are
+                new_style_contents.append(item.copy()) # Append a copy to avoid issues if modifying tree elsewhere
         
+        if css_changed_in_this_tag:
+            style_tag.clear() # Remove old contents
+            for new_node in new_style_contents:
+                style_tag.append(new_node) # Add new/modified contents
+            file_modified_overall = True
+    
+    # --- Process style attributes on all tags ---
+    # Find all tags that *have* a style attribute
+    tags_with_style_attr = soup.find_all(attrs={"style": True})
+    for tag_with_style in tags_with_style_attr:
+        original_style_value = tag_with_style.get('style')
+        if original_style_value: # Ensure it's not empty or None
+            modified_style_value, style_attr_changed = update_css_text_content(original_style_value, target_exists)
+            if style_attr_changed:
+                tag_with_style['style'] = modified_style_value
+                file_modified_overall = True
+
+    return file_modified_overall
+
+def process_html_file(file_path, site_root=None):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            content = file.read()
+        soup = BeautifulSoup(content, 'html.parser')
+        target_exists = webp_target_checker(file_path, site_root) if site_root else None
+        file_modified_overall = update_soup_image_references(soup, target_exists)
+
         if file_modified_overall:
             with open(file_path, 'w', encoding='utf-8') as file:
                 file.write(str(soup)) # Use str(soup) for minimal structural changes
             print(f"Modified: {file_path}")
+        return file_modified_overall
 
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
+        return None
 
-def process_css_file(file_path):
+def process_css_file(file_path, site_root=None):
     """Processes a .css file to update internal image URLs to .webp."""
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
             content = file.read()
         
-        modified_content, changes_made = update_css_text_content(content)
+        target_exists = webp_target_checker(file_path, site_root) if site_root else None
+        modified_content, changes_made = update_css_text_content(content, target_exists)
         
         if changes_made:
             with open(file_path, 'w', encoding='utf-8') as file:
                 file.write(modified_content)
             print(f"Modified: {file_path}")
+        return changes_made
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
+        return None
 
-def process_js_file(file_path):
+def process_js_file(file_path, site_root=None):
     """Processes a .js file to update internal image URLs in string literals to .webp."""
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
             content = file.read()
         
-        modified_content, changes_made = update_js_text_content(content)
+        target_exists = webp_target_checker(file_path, site_root) if site_root else None
+        modified_content, changes_made = update_js_text_content(content, target_exists)
         
         if changes_made:
             with open(file_path, 'w', encoding='utf-8') as file:
                 file.write(modified_content)
             print(f"Modified: {file_path}")
+        return changes_made
     except Exception as e:
         print(f"Error processing {file_path}: {str(e)}")
+        return None
 # --- END OF FILE PROCESSING FUNCTIONS ---
 
 
-def process_directory(directory):
+# --- START OF STREAMING HTML REWRITER ---
+# Tokenizes the raw HTML text chunk by chunk and only rewrites the attribute
+# values and <style> bodies that the tree-based path would change; every other
+# character is copied through untouched. Memory is bounded by the chunk size
+# plus the largest single tag or <style>/<script> element.
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Elements whose content is raw text for html.parser (never tokenized as markup)
+RAW_TEXT_ELEMENTS = ('script', 'style')
+
+EXTERNAL_URL_PREFIXES = ('https://', '//', 'data:')
+
+TAG_NAME_PATTERN = re.compile(r'[a-zA-Z][^\s/>]*')
+ATTR_NAME_PATTERN = re.compile(r'[^\s/>][^\s/=>]*')
+ATTR_EQUALS_PATTERN = re.compile(r'\s*=\s*')
+UNQUOTED_VALUE_PATTERN = re.compile(r'[^\s>]*')
+RAW_TEXT_END_PATTERNS = {
+    name: re.compile(r'</' + name + r'[\s/>]', re.IGNORECASE) for name in RAW_TEXT_ELEMENTS
+}
+
+def webp_path_for(url, target_exists=None):
+    """
+    Returns the .webp variant of an internal .png/.jpg/.jpeg URL, or None
+    (also None when target_exists is given and rejects the .webp file).
+    """
+    if not url or url.startswith(EXTERNAL_URL_PREFIXES):
+        return None
+    if not re.search(r'\.(png|jpg|jpeg)$', url, re.IGNORECASE):
+        return None
+    new_url = re.sub(r'\.(png|jpg|jpeg)$', '.webp', url, flags=re.IGNORECASE)
+    if target_exists and not target_exists(new_url):
+        return None
+    return new_url
+
+def _scan_start_tag(buffer, pos):
+    """
+    Scans the start tag beginning at buffer[pos] ('<' followed by a letter).
+    Returns (end, tag_name, attributes), where each attribute is a dict with
+    its lowercased name, raw value and the offsets of the value and of the
+    whole attribute (including leading whitespace). Returns None if the tag
+    is not complete in the buffer yet.
+    """
+    name_match = TAG_NAME_PATTERN.match(buffer, pos + 1)
+    i = name_match.end()
+    length = len(buffer)
+    attributes = []
+    while True:
+        attr_start = i
+        while i < length and (buffer[i].isspace() or buffer[i] == '/'):
+            i += 1
+        if i >= length:
+            return None
+        if buffer[i] == '>':
+            return i + 1, name_match.group().lower(), attributes
+
+        attr_name_match = ATTR_NAME_PATTERN.match(buffer, i)
+        i = attr_name_match.end()
+        # Wait for the character after the name (and any '=') before deciding
+        equals_match = ATTR_EQUALS_PATTERN.match(buffer, i)
+        if (equals_match.end() if equals_match else i) >= length:
+            return None
+        attribute = {
+            'name': attr_name_match.group().lower(),
+            'value': None,
+            'value_span': None,
+        }
+        if equals_match:
+            i = equals_match.end()
+            if buffer[i] in '"\'':
+                closing = buffer.find(buffer[i], i + 1)
+                if closing == -1:
+                    return None
+                value_span = (i + 1, closing)
+                i = closing + 1
+            else:
+                value_span = (i, UNQUOTED_VALUE_PATTERN.match(buffer, i).end())
+                i = value_span[1]
+                if i >= length:
+                    return None
+            attribute['value'] = buffer[value_span[0]:value_span[1]]
+            attribute['value_span'] = value_span
+        attribute['span'] = (attr_start, i)
+        attributes.append(attribute)
+
+def _start_tag_edits(tag_name, attributes, target_exists=None):
+    """
+    Decides the attribute rewrites for one start tag, mirroring
+    update_soup_image_references. Returns a list of (start, end, replacement)
+    edits in buffer offsets.
+    """
+    # Like html.parser, the last occurrence of a duplicated attribute wins
+    attrs = {attribute['name']: attribute for attribute in attributes}
+    edits = {}
+
+    def value_of(name):
+        return attrs[name]['value'] if name in attrs else None
+
+    def replace_value(name, new_value):
+        start, end = attrs[name]['value_span']
+        edits[name] = (start, end, new_value)
+
+    if tag_name == 'img':
+        src = value_of('src')
+        srcset = value_of('srcset')
+        if not (src and src.startswith('https://') and not srcset):
+            final_src = src
+            new_src = webp_path_for(src, target_exists)
+            if new_src and new_src != src:
+                replace_value('src', new_src)
+                final_src = new_src
+            if srcset:
+                modified_srcset, srcset_changed = process_srcset_attribute(srcset, target_exists)
+                final_src_is_internal = final_src and not final_src.startswith(EXTERNAL_URL_PREFIXES)
+                if final_src_is_internal:
+                    modified_srcset, srcset_localized = localize_live_srcset(modified_srcset, target_exists)
+                    srcset_changed = srcset_changed or srcset_localized
+                if srcset_changed:
+                    replace_value('srcset', modified_srcset)
+    elif tag_name == 'link':
+        href = value_of('href')
+        new_href = webp_path_for(href, target_exists)
+        if new_href and new_href != href:
+            replace_value('href', new_href)
+    elif tag_name == 'source':
+        srcset = value_of('srcset')
+        if srcset:
+            modified_srcset, srcset_changed = process_srcset_attribute(srcset, target_exists)
+            if srcset_changed:
+                replace_value('srcset', modified_srcset)
+
+    style = value_of('style')
+    if style:
+        modified_style, style_changed = update_css_text_content(style, target_exists)
+        if style_changed:
+            replace_value('style', modified_style)
+
+    return sorted(edits.values())
+
+def _apply_edits(buffer, start, end, edits):
+    """Returns buffer[start:end] with the given (start, end, replacement) edits applied."""
+    pieces = []
+    position = start
+    for edit_start, edit_end, replacement in edits:
+        pieces.append(buffer[position:edit_start])
+        pieces.append(replacement)
+        position = edit_end
+    pieces.append(buffer[position:end])
+    return ''.join(pieces)
+
+def _next_token(buffer, pos, raw_text_element, target_exists=None):
+    """
+    Reads the token starting at buffer[pos].
+    Returns (end, output_text, changed, raw_text_element) or None when the
+    token is not complete in the buffer yet.
+    """
+    if raw_text_element:
+        end_match = RAW_TEXT_END_PATTERNS[raw_text_element].search(buffer, pos)
+        if not end_match:
+            return None
+        content = buffer[pos:end_match.start()]
+        if raw_text_element == 'style':
+            modified_content, content_changed = update_css_text_content(content, target_exists)
+            return end_match.start(), modified_content, content_changed, None
+        return end_match.start(), content, False, None
+
+    if buffer[pos] != '<':
+        next_tag = buffer.find('<', pos)
+        end = len(buffer) if next_tag == -1 else next_tag
+        return end, buffer[pos:end], False, None
+
+    if buffer.startswith('<!--', pos):
+        closing = buffer.find('-->', pos + 4)
+        if closing == -1:
+            return None
+        return closing + 3, buffer[pos:closing + 3], False, None
+
+    if buffer.startswith(('<!', '<?', '</'), pos):
+        closing = buffer.find('>', pos + 2)
+        if closing == -1:
+            return None
+        return closing + 1, buffer[pos:closing + 1], False, None
+
+    if pos + 1 >= len(buffer):
+        return None
+    if not buffer[pos + 1].isalpha() or not buffer[pos + 1].isascii():
+        return pos + 1, '<', False, None
+
+    scanned = _scan_start_tag(buffer, pos)
+    if scanned is None:
+        return None
+    end, tag_name, attributes = scanned
+    edits = _start_tag_edits(tag_name, attributes, target_exists)
+    next_raw_text_element = tag_name if tag_name in RAW_TEXT_ELEMENTS else None
+    return end, _apply_edits(buffer, pos, end, edits), bool(edits), next_raw_text_element
+
+def rewrite_html_stream(source, destination, chunk_size=STREAM_CHUNK_SIZE, target_exists=None):
+    """
+    Streams HTML text from the source file object to the destination file
+    object, rewriting internal image references to .webp like
+    update_soup_image_references but copying all other text unchanged.
+    Returns True if anything was rewritten.
+    """
+    buffer = ''
+    pos = 0
+    at_eof = False
+    changed = False
+    raw_text_element = None
+
+    while True:
+        token = _next_token(buffer, pos, raw_text_element, target_exists) if pos < len(buffer) else None
+        if token is None:
+            if at_eof:
+                # Incomplete markup at the end of the file is copied as is
+                destination.write(buffer[pos:])
+                break
+            chunk = source.read(chunk_size)
+            at_eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        pos, output_text, token_changed, raw_text_element = token
+        destination.write(output_text)
+        changed = changed or token_changed
+
+    return changed
+
+def process_html_file_streaming(file_path, site_root=None):
+    """
+    Streaming counterpart of process_html_file: rewrites the file through a
+    temporary sibling and only replaces the original if something changed.
+    """
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', suffix='.tmp')
+        # newline='' and surrogateescape keep line endings and undecodable bytes intact
+        with open(file_path, 'r', encoding='utf-8', newline='', errors='surrogateescape') as source, \
+                os.fdopen(fd, 'w', encoding='utf-8', newline='', errors='surrogateescape') as destination:
+            target_exists = webp_target_checker(file_path, site_root) if site_root else None
+            changed = rewrite_html_stream(source, destination, target_exists=target_exists)
+
+        if changed:
+            shutil.copymode(file_path, tmp_path)
+            os.replace(tmp_path, file_path)
+            tmp_path = None
+            print(f"Modified: {file_path}")
+        return changed
+    except Exception as e:
+        print(f"Error processing {file_path}: {str(e)}")
+        return None
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+# --- END OF STREAMING HTML REWRITER ---
+
+
+def process_file(file_path, streaming=False, site_root=None):
+    """
+    Dispatches a single file to the matching processor by its extension.
+    With site_root, only references whose .webp file exists are rewritten.
+    Returns True if the file was modified, or None on errors.
+    """
+    if file_path.endswith('.html'):
+        if streaming:
+            return process_html_file_streaming(file_path, site_root)
+        return process_html_file(file_path, site_root)
+    elif file_path.endswith('.css'):
+        return process_css_file(file_path, site_root)
+    elif file_path.endswith('.js'):
+        return process_js_file(file_path, site_root)
+    return False
+
+def find_files(directory):
+    """Returns a sorted list of the HTML, CSS and JS files under directory."""
+    file_paths = []
     for root, _, files in os.walk(directory):
         for file_name in files:
-            file_path = os.path.join(root, file_name)
-            if file_name.endswith('.html'):
-                process_html_file(file_path)
-            elif file_name.endswith('.css'):
-                process_css_file(file_path)
-            elif file_name.endswith('.js'):
-                process_js_file(file_path)
+            if file_name.endswith(('.html', '.css', '.js')):
+                file_paths.append(os.path.join(root, file_name))
+    return sorted(file_paths)
+
+def process_directory(directory, jobs=None, manifest=None, streaming=False, verify_targets=False):
+    version = tool_version(sys.modules[__name__])
+    site_root = directory if verify_targets else None
+    config = {'streaming': streaming, 'verify_targets': verify_targets}
+    if verify_targets:
+        # Which .webp files exist is an input too: a file skipped for a missing
+        # target must be revisited once the target has been encoded
+        config['webp_files'] = sorted(
+            os.path.relpath(os.path.join(root, file_name), directory)
+            for root, _, files in os.walk(directory)
+            for file_name in files if file_name.lower().endswith('.webp')
+        )
+    file_paths = find_files(directory)
+    file_paths, skipped = partition_files(file_paths, webp_target_trigger if verify_targets else WEBP_TRIGGER, directory)
+    print_skipped(len(skipped), len(file_paths) + len(skipped))
+    run_incremental(partial(process_file, streaming=streaming, site_root=site_root), file_paths, jobs,
+                    manifest, 'update_tags', version, config=config)
 
 if __name__ == "__main__":
-    directory = input("Enter the directory path containing HTML, CSS, and JS files: ")
+    parser = argparse.ArgumentParser(description="Rewrite internal .png/.jpg/.jpeg references to .webp in HTML, CSS and JS files.")
+    parser.add_argument("directory", nargs="?", help="The directory containing HTML, CSS, and JS files (prompted for if omitted).")
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Rewrite HTML with the streaming tokenizer instead of BeautifulSoup, leaving untouched markup byte-for-byte."
+    )
+    parser.add_argument(
+        "--verify-targets",
+        action="store_true",
+        help="Only rewrite references whose .webp file exists (see webp_encoder.py)."
+    )
+    args = parser.parse_args()
+
+    directory = args.directory or input("Enter the directory path containing HTML, CSS, and JS files: ")
     if os.path.isdir(directory):
-        process_directory(directory)
+        process_directory(directory, args.jobs, manifest_from_args(args), args.streaming, args.verify_targets)
         print("Processing complete.")
     else:
-        print("Invalid directory path.")
\ No newline at end of file
+        print("Invalid directory path.")
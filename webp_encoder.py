@@ -0,0 +1,147 @@
+import os
+import re
+import sys
+import argparse
+import tempfile
+from functools import partial
+from urllib.parse import unquote
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed to encode, see main()
+    Image = None
+
+import update_tags
+from parallel import add_jobs_argument
+from build_manifest import run_cached, tool_version, add_manifest_arguments, manifest_from_args
+
+# Only uploaded media is converted; theme/plugin images are left alone
+UPLOADS_PREFIX = 'wp-content/uploads/'
+
+DEFAULT_QUALITY = 80
+
+# References to rasters under wp-content/uploads, in any form: relative,
+# root-relative, absolute, or JSON-escaped (wp-content\/uploads\/...) in inline scripts
+RASTER_REFERENCE_PATTERN = re.compile(
+    r'wp-content\\?/uploads\\?/[^\s"\'`()<>,?#]+?\.(?:png|jpg|jpeg)(?![\w])',
+    re.IGNORECASE
+)
+
+def find_referenced_rasters(site_root):
+    """
+    Scans every HTML, CSS and JS file under site_root for references to
+    .png/.jpg/.jpeg files under wp-content/uploads and returns the sorted
+    list of referenced files that exist on disk.
+    """
+    referenced = set()
+    for file_path in update_tags.find_files(site_root):
+        try:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                content = f.read()
+        except IOError as e:
+            print(f"Error reading {file_path}: {e}", file=sys.stderr)
+            continue
+        for match in RASTER_REFERENCE_PATTERN.finditer(content):
+            relative_path = unquote(match.group().replace('\\/', '/'))
+            referenced.add(os.path.join(site_root, *relative_path.split('/')))
+    return sorted(path for path in referenced if os.path.isfile(path))
+
+def webp_target_path(source_path):
+    """Returns the .webp path update_tags rewrites a reference to source_path into."""
+    return re.sub(r'\.(png|jpg|jpeg)$', '.webp', source_path, flags=re.IGNORECASE)
+
+def encode_webp(item, quality=DEFAULT_QUALITY):
+    """
+    Encodes one (source_path, target_path) pair to WebP.
+    Writes through a temporary file so an interrupted run never leaves a
+    truncated .webp behind. Returns (source_bytes, target_bytes).
+    """
+    source_path, target_path = item
+    with Image.open(source_path) as image:
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'WEBP', quality=quality, method=6)
+            os.replace(tmp_path, target_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    return os.path.getsize(source_path), os.path.getsize(target_path)
+
+def convert_rasters(site_root, quality=DEFAULT_QUALITY, jobs=None, manifest=None):
+    """
+    Encodes a .webp next to every referenced raster under wp-content/uploads,
+    reusing outputs the manifest knows were produced from the same source.
+    Returns report rows of (source_path, source_bytes, webp_bytes, cached).
+    """
+    items = []
+    claimed_targets = {}
+    for source_path in find_referenced_rasters(site_root):
+        target_path = webp_target_path(source_path)
+        if target_path in claimed_targets:
+            # e.g. logo.png and logo.jpg would both become logo.webp
+            print(f"Warning: Skipping {source_path}, {target_path} is already produced from {claimed_targets[target_path]}", file=sys.stderr)
+            continue
+        claimed_targets[target_path] = source_path
+        items.append((source_path, target_path))
+
+    version = tool_version(sys.modules[__name__])
+    results, cached_items = run_cached(partial(encode_webp, quality=quality), items, jobs, manifest,
+                                       'webp_encoder', version, config={'quality': quality})
+
+    rows = []
+    cached = set(cached_items)
+    stale_items = [item for item in items if item not in cached]
+    for (source_path, target_path), sizes in zip(stale_items, results):
+        if sizes:
+            rows.append((source_path, sizes[0], sizes[1], False))
+    for source_path, target_path in cached_items:
+        rows.append((source_path, os.path.getsize(source_path), os.path.getsize(target_path), True))
+    return sorted(rows)
+
+def print_report(rows, site_root):
+    """Prints bytes saved per image and in total."""
+    total_source = total_webp = 0
+    for source_path, source_bytes, webp_bytes, cached in rows:
+        total_source += source_bytes
+        total_webp += webp_bytes
+        saved = source_bytes - webp_bytes
+        print(f"  {os.path.relpath(source_path, site_root)}: {source_bytes / 1024:.1f} KB -> {webp_bytes / 1024:.1f} KB "
+              f"(saved {saved / 1024:.1f} KB, {saved / source_bytes * 100 if source_bytes else 0:.0f}%)"
+              f"{' [cached]' if cached else ''}")
+    saved = total_source - total_webp
+    print(f"\nConverted {len(rows)} image(s): {total_source / 1024:.1f} KB -> {total_webp / 1024:.1f} KB, "
+          f"saved {saved / 1024:.1f} KB ({saved / total_source * 100 if total_source else 0:.0f}%).")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Encode WebP copies of the .png/.jpg/.jpeg files referenced under wp-content/uploads, "
+                    "then rewrite only the references whose .webp exists."
+    )
+    parser.add_argument("site_root", help="The root of the mirrored site (e.g. evolves/www.evolves.tech).")
+    parser.add_argument("--quality", type=int, default=DEFAULT_QUALITY, help=f"WebP quality 0-100 (default: {DEFAULT_QUALITY}).")
+    parser.add_argument("--no-rewrite", action="store_true", help="Only encode images, do not run update_tags afterwards.")
+    parser.add_argument("--streaming", action="store_true", help="Use the streaming HTML rewriter of update_tags.")
+    add_jobs_argument(parser)
+    add_manifest_arguments(parser)
+    args = parser.parse_args()
+
+    if Image is None:
+        print("Error: Pillow is required to encode WebP images (pip install Pillow).", file=sys.stderr)
+        sys.exit(1)
+    if not os.path.isdir(args.site_root):
+        print(f"Error: The path '{args.site_root}' is not a valid directory.", file=sys.stderr)
+        sys.exit(1)
+
+    manifest = manifest_from_args(args)
+    rows = convert_rasters(args.site_root, args.quality, args.jobs, manifest)
+    print_report(rows, args.site_root)
+
+    if not args.no_rewrite:
+        print("\nRewriting references whose .webp exists...")
+        update_tags.process_directory(args.site_root, args.jobs, manifest, args.streaming, verify_targets=True)
+
+if __name__ == "__main__":
+    main()